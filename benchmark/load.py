@@ -0,0 +1,182 @@
+import argparse
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmark.offline import QUESTIONS, commit, percentiles
+from benchmark.product_database import make_products
+from rag_assistant.app.backend import RetrievalBackend
+from rag_assistant.database.product_database import SQLiteProductDatabase
+from rag_assistant.llm.chat import ChatMessage, ScriptedChat
+from rag_assistant.retrieval.embedding import BatchingEmbeddingDecorator, HashEmbedding
+from rag_assistant.retrieval.vector_index import NumpyVectorIndex
+
+
+def make_backend(n: int, dim: int, latency: float, workers: int) -> RetrievalBackend:
+    database = SQLiteProductDatabase(":memory:")
+    database.create_tables()
+    database.insert_products(make_products(n))
+    chat = ScriptedChat(
+        rules=[
+            ("Do we need to search", "yes"),
+            ("Construct a query", lambda content: content.split("---")[1]),
+        ],
+        default="Here is what I found for you.",
+        latency=latency,
+    )
+    return RetrievalBackend(
+        chat,
+        HashEmbedding(dim, latency=latency),
+        database,
+        NumpyVectorIndex(dim),
+        max_workers=workers,
+    )
+
+
+_runs = itertools.count()
+
+
+def bench_sessions(
+    backend: RetrievalBackend, sessions: int, turns: int, refresh: bool, cached: bool
+) -> dict:
+    # Each session thread owns its agent, as a Streamlit session would. The
+    # optional writer re-prices part of the catalog while sessions search.
+    # Unless cached, every question is new to the backend, so the search
+    # decision and query rewrite are never answered by the auxiliary cache.
+    latencies = [[] for _ in range(sessions)]
+    run = next(_runs)
+
+    def session(i: int):
+        agent = backend.agent()
+        for turn in range(turns):
+            question = QUESTIONS[(i + turn) % len(QUESTIONS)]
+            if not cached:
+                question += f" (run {run}, session {i}, turn {turn})"
+            start = time.perf_counter()
+            agent.respond(ChatMessage(role="user", content=question))
+            latencies[i].append(time.perf_counter() - start)
+
+    done = threading.Event()
+    refreshes = 0
+
+    def writer():
+        nonlocal refreshes
+        products = make_products(100)
+        while not done.is_set():
+            price = 1.0 + refreshes % 2
+            backend.refresh([p.model_copy(update={"price": price}) for p in products])
+            refreshes += 1
+
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(sessions)]
+    refresher = threading.Thread(target=writer)
+    start = time.perf_counter()
+    if refresh:
+        refresher.start()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    if refresh:
+        refresher.join()
+    return {
+        "sessions": sessions,
+        "cached": cached,
+        "refresh": refresh,
+        "refreshes": refreshes,
+        "turns_per_s": sessions * turns / elapsed,
+        **percentiles([t for session in latencies for t in session]),
+    }
+
+
+def bench_batching(
+    sessions: int, calls: int, dim: int, latency: float, window: float | None
+) -> dict:
+    # Query embeddings from concurrent sessions, sent one per request or
+    # coalesced over window seconds.
+    embedding = HashEmbedding(dim, latency=latency)
+    if window is not None:
+        embedding = BatchingEmbeddingDecorator(embedding, window=window)
+    latencies = []
+
+    def embed(i: int):
+        start = time.perf_counter()
+        embedding.embed(QUESTIONS[i % len(QUESTIONS)] + f" {i}")
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(sessions) as executor:
+        list(executor.map(embed, range(sessions * calls)))
+    elapsed = time.perf_counter() - start
+    result = {
+        "window_ms": None if window is None else window * 1e3,
+        "sessions": sessions,
+        "embeds_per_s": sessions * calls / elapsed,
+        "api_requests": sessions * calls,
+        **percentiles(latencies),
+    }
+    if window is not None:
+        stats = embedding.stats()
+        result["api_requests"] = stats["batches"]
+        result["requests_per_batch"] = stats["mean_batch_size"]
+        result["queue_delay_p99_ms"] = stats["queue_delay_p99"] * 1e3
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Concurrent sessions over one shared retrieval backend"
+    )
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--products", type=int, default=5_000)
+    parser.add_argument("--dim", type=int, default=100)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="Simulated seconds per API call"
+    )
+    parser.add_argument(
+        "--windows",
+        type=float,
+        nargs="+",
+        default=[0.001, 0.005, 0.02],
+        help="Embedding batching windows in seconds",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Retrieval pool size; defaults to the largest session count",
+    )
+    parser.add_argument("--output", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    workers = args.workers or max(args.sessions)
+    backend = make_backend(args.products, args.dim, args.latency, workers)
+    results = {
+        "commit": commit(),
+        "arguments": vars(args),
+        "numpy": np.__version__,
+        "load": [
+            bench_sessions(backend, sessions, args.turns, refresh, cached)
+            for cached in (False, True)
+            for refresh in (False, True)
+            for sessions in args.sessions
+        ],
+        "batching": [
+            bench_batching(max(args.sessions), args.turns, args.dim, args.latency, w)
+            for w in (None, *args.windows)
+        ],
+    }
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import argparse
+import json
+import platform
+import subprocess
+import time
+
+import numpy as np
+
+from benchmark.product_database import make_products
+from rag_assistant.database.product_database import SQLiteProductDatabase
+from rag_assistant.llm.agent import SimpleRAGAgent
+from rag_assistant.llm.chat import ChatMessage, ScriptedChat
+from rag_assistant.retrieval.embedding import HashEmbedding
+from rag_assistant.retrieval.sync import sync_vector_index
+from rag_assistant.retrieval.vector_index import NumpyVectorIndex
+
+QUESTIONS = [
+    "Do you sell cotton jackets for men?",
+    "I need a backpack for my laptop",
+    "Show me gold rings under $100",
+    "What electronics do you have?",
+]
+
+
+def commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentiles(seconds: list[float]) -> dict[str, float]:
+    p50, p99 = np.percentile(seconds, [50, 99]) * 1e3
+    return {"p50_ms": float(p50), "p99_ms": float(p99)}
+
+
+def bench_index(n: int, dim: int, queries: int, k: int) -> dict:
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(n, dim)).astype(np.float32)
+    documents = [str(i) for i in range(n)]
+    index = NumpyVectorIndex(dim)
+    start = time.perf_counter()
+    for i in range(0, n, 1024):
+        index.insert_array(documents[i : i + 1024], vectors[i : i + 1024])
+    insert = time.perf_counter() - start
+
+    latencies = []
+    for q in rng.normal(size=(queries, dim)):
+        start = time.perf_counter()
+        index.search(q, k)
+        latencies.append(time.perf_counter() - start)
+    return {
+        "n": n,
+        "insert_rows_per_s": n / insert,
+        "search_qps": queries / sum(latencies),
+        **percentiles(latencies),
+    }
+
+
+def bench_population(n: int, dim: int) -> dict:
+    database = SQLiteProductDatabase(":memory:")
+    database.create_tables()
+    database.insert_products(make_products(n))
+    index = NumpyVectorIndex(dim)
+    start = time.perf_counter()
+    sync_vector_index(database, index, HashEmbedding(dim))
+    elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    sync_vector_index(database, index, HashEmbedding(dim))
+    unchanged = time.perf_counter() - start
+    database.close()
+    return {
+        "n": n,
+        "products_per_s": n / elapsed,
+        "unchanged_sync_ms": unchanged * 1e3,
+    }
+
+
+def bench_agent(
+    n: int, dim: int, turns: int, latency: float, parallel: bool
+) -> dict[str, float]:
+    products = make_products(n)
+    embedding = HashEmbedding(dim, latency=latency)
+    index = NumpyVectorIndex(dim)
+    index.insert_array(
+        [str(p) for p in products],
+        HashEmbedding(dim).embed_batch([p.description for p in products]),
+    )
+    chat = ScriptedChat(
+        rules=[
+            ("Do we need to search", "yes"),
+            ("Construct a query", lambda content: content.split("---")[1]),
+        ],
+        default="Here is what I found for you.",
+        latency=latency,
+    )
+    agent = SimpleRAGAgent(chat, index, embedding, parallel=parallel)
+    latencies = []
+    for i in range(turns):
+        message = ChatMessage(role="user", content=QUESTIONS[i % len(QUESTIONS)])
+        start = time.perf_counter()
+        agent.respond(message)
+        latencies.append(time.perf_counter() - start)
+        agent.reset()
+    return {
+        "parallel": parallel,
+        "turns_per_s": turns / sum(latencies),
+        **percentiles(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Offline benchmarks with deterministic fake backends"
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--dim", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--products", type=int, default=5_000)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="Simulated seconds per API call"
+    )
+    parser.add_argument("--output", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    results = {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "arguments": vars(args),
+        "index": [bench_index(n, args.dim, args.queries, args.k) for n in args.sizes],
+        "population": bench_population(args.products, args.dim),
+        "agent": [
+            bench_agent(args.products, args.dim, args.turns, args.latency, parallel)
+            for parallel in (False, True)
+        ],
+    }
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
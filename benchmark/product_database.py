@@ -0,0 +1,81 @@
+import argparse
+import time
+from functools import partial
+
+from rag_assistant.database.product_database import Product, SQLiteProductDatabase
+
+
+def make_products(n: int) -> list[Product]:
+    return [
+        Product(
+            id=i,
+            title=f"Product {i}",
+            price=i + 0.99,
+            description="A product description of typical length. " * 8,
+            category=f"category {i % 20}",
+            image=f"https://fakestoreapi.com/img/{i}.jpg",
+        )
+        for i in range(n)
+    ]
+
+
+def fetch_all_baseline(database: SQLiteProductDatabase) -> list[Product]:
+    # The original fetch_all: materialize every row, then validate each one.
+    cur = database._connection.cursor()
+    cur.execute(
+        """
+        SELECT id, title, price, description, category, image
+        FROM products
+        """
+    )
+    products = [
+        Product(
+            id=row[0],
+            title=row[1],
+            price=row[2],
+            description=row[3],
+            category=row[4],
+            image=row[5],
+        )
+        for row in cur.fetchall()
+    ]
+    cur.close()
+    return products
+
+
+def rows_per_second(fetch) -> float:
+    start = time.perf_counter()
+    count = sum(1 for _ in fetch())
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLiteProductDatabase read rate")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    args = parser.parse_args()
+
+    print(
+        f"{'n':>10} {'baseline/s':>12} {'fetch_all/s':>12} {'iter_all/s':>12}"
+        f" {'iter_rows/s':>12} {'speedup':>8}"
+    )
+    for n in args.sizes:
+        database = SQLiteProductDatabase(":memory:")
+        database.create_tables()
+        database.insert_products(make_products(n))
+
+        # Warm up the page cache so the first measurement is not penalized.
+        sum(1 for _ in database.iter_rows())
+
+        baseline = rows_per_second(partial(fetch_all_baseline, database))
+        eager = rows_per_second(database.fetch_all)
+        lazy = rows_per_second(database.iter_all)
+        trusted = rows_per_second(database.iter_rows)
+        print(
+            f"{n:>10} {baseline:>12,.0f} {eager:>12,.0f} {lazy:>12,.0f}"
+            f" {trusted:>12,.0f} {trusted / baseline:>7.1f}x"
+        )
+        database.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import argparse
+import os
+
+import numpy as np
+
+from benchmark.vector_index import measure
+from rag_assistant.retrieval.sharded_index import ShardedVectorIndex
+from rag_assistant.retrieval.vector_index import NumpyVectorIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="ShardedVectorIndex search latency across shard counts"
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000_000])
+    parser.add_argument(
+        "--shards", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1]
+    )
+    parser.add_argument("--dim", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    queries = rng.normal(size=(args.queries, args.dim))
+    print(f"cpus: {os.cpu_count()}")
+    print(f"{'n':>10} {'pool':>8} {'shards':>7} {'ms':>8} {'speedup':>8}")
+    for n in args.sizes:
+        vectors = rng.normal(size=(n, args.dim)).astype(np.float32)
+        documents = [str(i) for i in range(n)]
+        exact = NumpyVectorIndex(args.dim, n)
+        exact.insert_array(documents, vectors)
+        baseline = measure(exact.search, queries, args.k)
+        print(f"{n:>10} {'-':>8} {1:>7} {baseline * 1e3:>8.2f} {1:>7.1f}x")
+        expected = [exact.search(q, args.k) for q in queries]
+        for processes in (False, True):
+            for shards in sorted(set(args.shards)):
+                index = ShardedVectorIndex(
+                    args.dim, shards=shards, processes=processes, capacity=n
+                )
+                index.insert_array(documents, vectors)
+                # Warms up the pool and builds the shared block.
+                if [index.search(q, args.k) for q in queries] != expected:
+                    raise AssertionError("Sharded results differ from exact search")
+                latency = measure(index.search, queries, args.k)
+                index.close()
+                pool = "process" if processes else "thread"
+                print(
+                    f"{n:>10} {pool:>8} {shards:>7} {latency * 1e3:>8.2f}"
+                    f" {baseline / latency:>7.1f}x"
+                )
+
+
+if __name__ == "__main__":
+    main()
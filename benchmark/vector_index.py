@@ -0,0 +1,56 @@
+import argparse
+import time
+from functools import partial
+
+import numpy as np
+
+from rag_assistant.retrieval.vector_index import NumpyVectorIndex, cosine_similarity
+
+
+def argsort_search(vectors: np.ndarray, v: np.ndarray, k: int) -> np.ndarray:
+    similarity = cosine_similarity(vectors, v)
+    return np.argsort(similarity)[::-1][:k]
+
+
+def measure(search, queries: np.ndarray, k: int) -> float:
+    start = time.perf_counter()
+    for q in queries:
+        search(q, k)
+    return (time.perf_counter() - start) / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NumpyVectorIndex search latency")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--dim", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    queries = rng.normal(size=(args.queries, args.dim))
+    print(
+        f"{'n':>10} {'argsort ms':>12} {'top-k ms':>12} {'speedup':>8}"
+        f" {'batch ms':>10} {'speedup':>8}"
+    )
+    for n in args.sizes:
+        vectors = rng.normal(size=(n, args.dim))
+        index = NumpyVectorIndex(args.dim, n)
+        index.insert([(str(i), v) for i, v in enumerate(vectors)])
+
+        baseline = measure(partial(argsort_search, vectors), queries, args.k)
+        optimized = measure(index.search, queries, args.k)
+        start = time.perf_counter()
+        index.search_batch(queries, args.k)
+        batched = (time.perf_counter() - start) / len(queries)
+        print(
+            f"{n:>10} {baseline * 1e3:>12.2f} {optimized * 1e3:>12.2f}"
+            f" {baseline / optimized:>7.1f}x {batched * 1e3:>10.2f}"
+            f" {baseline / batched:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
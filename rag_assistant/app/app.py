@@ -1,60 +1,125 @@
+import os
+
 import streamlit as st
 from dotenv import load_dotenv
 from streamlit.delta_generator import DeltaGenerator
 
-from rag_assistant.database.product_database import get_fake_store_data
-from rag_assistant.llm.agent import Agent, SimpleChatBot, SimpleRAGAgent
-from rag_assistant.llm.chat import ChatMessage, OpenAIChat, SafeChatDecorator
+from rag_assistant.app.backend import RetrievalBackend
+from rag_assistant.database.product_database import (
+    DATABASE_ENVIRON,
+    SQLiteProductDatabase,
+    get_fake_store_data,
+)
+from rag_assistant.llm.agent import Agent, SimpleChatBot
+from rag_assistant.llm.chat import (
+    CHAT_CACHE_ENVIRON,
+    AsyncOpenAIChat,
+    CachedChatDecorator,
+    ChatMessage,
+    OpenAIChat,
+    SafeChatDecorator,
+    SyncChatAdapter,
+    TracingChatDecorator,
+)
 from rag_assistant.retrieval.embedding import (
-    Embedding,
-    OpenAIEmbedding,
+    EMBEDDING_CACHE_ENVIRON,
+    AsyncOpenAIEmbedding,
+    BatchingEmbeddingDecorator,
+    CachedEmbeddingDecorator,
     SafeEmbeddingDecorator,
+    SyncEmbeddingAdapter,
+    TracingEmbeddingDecorator,
 )
-from rag_assistant.retrieval.vector_index import NumpyVectorIndex, VectorIndex
+from rag_assistant.retrieval.vector_index import (
+    VECTOR_INDEX_ENVIRON,
+    NumpyVectorIndex,
+)
+from rag_assistant.tracing import TRACE_ENVIRON, Tracer
 
 
 def simple_chat_bot() -> SimpleChatBot:
     load_dotenv()
     model = "gpt-4o-mini-2024-07-18"
     chat = OpenAIChat(model=model)
-    chat = SafeChatDecorator(chat, limit=100)
-    return SimpleChatBot(chat)
-
+    # Summaries of evicted history are sent without the per-turn limit.
+    return SimpleChatBot(
+        SafeChatDecorator(chat, limit=100), history_budget=60, auxiliary_chat=chat
+    )
 
-def populate_vector_index(vector_index: VectorIndex, embedding: Embedding):
-    products = get_fake_store_data()
-    products = [
-        (str(product), embedding.embed(product.description)) for product in products
-    ]
-    vector_index.insert(products)
 
-
-def simple_rag_agent() -> SimpleRAGAgent:
+def retrieval_backend() -> RetrievalBackend:
     load_dotenv()
 
     chat_model = "gpt-4o-mini-2024-07-18"
-    chat = OpenAIChat(model=chat_model)
+    chat = SyncChatAdapter(AsyncOpenAIChat(model=chat_model))
     chat = SafeChatDecorator(chat, limit=1000)
+    auxiliary_chat = CachedChatDecorator(chat, path=os.environ.get(CHAT_CACHE_ENVIRON))
 
     embedding_model = "text-embedding-3-small"
     embedding_dim = 100
-    embedding = OpenAIEmbedding(model=embedding_model, dim=100)
+    embedding = SyncEmbeddingAdapter(
+        AsyncOpenAIEmbedding(model=embedding_model, dim=embedding_dim)
+    )
+    # Query embeddings from concurrent sessions share requests; cache hits
+    # above the batcher never wait for a batch. Texts over the limit are
+    # rejected before they join one, so they fail only their own caller.
+    embedding = BatchingEmbeddingDecorator(embedding, window=0.005)
     embedding = SafeEmbeddingDecorator(embedding, limit=1000)
+    embedding = CachedEmbeddingDecorator(
+        embedding, path=os.environ.get(EMBEDDING_CACHE_ENVIRON)
+    )
+
+    database = SQLiteProductDatabase(os.environ.get(DATABASE_ENVIRON, ":memory:"))
+    database.create_tables()
+    # The catalog is fetched only into an empty database; later updates go
+    # through RetrievalBackend.refresh().
+    if not database.fetch_hashes():
+        database.insert_products(get_fake_store_data())
+
+    index_dir = os.environ.get(VECTOR_INDEX_ENVIRON)
+    vector_index = NumpyVectorIndex(dim=embedding_dim)
+    # An empty or partly written directory has no vectors to load yet.
+    if index_dir and os.path.exists(os.path.join(index_dir, "vectors.npy")):
+        loaded = NumpyVectorIndex.load(index_dir, mmap=True)
+        # Indexes saved before change tracking have no product ids to sync.
+        if loaded.content_hashes():
+            vector_index = loaded
+
+    # Per-turn traces are appended to TRACE_FILE when it is set.
+    trace_file = os.environ.get(TRACE_ENVIRON)
+    tracer = Tracer(path=trace_file, enabled=trace_file is not None)
+    if tracer.enabled:
+        chat = TracingChatDecorator(chat, tracer)
+        auxiliary_chat = TracingChatDecorator(
+            auxiliary_chat, tracer, name="auxiliary_chat"
+        )
+        embedding = TracingEmbeddingDecorator(embedding, tracer)
+
+    return RetrievalBackend(
+        chat,
+        embedding,
+        database,
+        vector_index,
+        auxiliary_chat=auxiliary_chat,
+        tracer=tracer,
+        index_dir=index_dir,
+    )
 
-    vector_index = NumpyVectorIndex(dim=embedding_dim, capacity=100)
-    populate_vector_index(vector_index, embedding)
 
-    return SimpleRAGAgent(chat, vector_index, embedding, k=2)
+@st.cache_resource
+def backend() -> RetrievalBackend:
+    # Shared by every session of this process.
+    return retrieval_backend()
 
 
-@st.cache_resource
 def agent() -> Agent:
-    return simple_rag_agent()
+    if "agent" not in st.session_state:
+        st.session_state["agent"] = backend().agent()
+    return st.session_state["agent"]
 
 
-@st.cache_resource
 def messages() -> list[ChatMessage]:
-    return []
+    return st.session_state.setdefault("messages", [])
 
 
 def clear_history():
@@ -83,10 +148,9 @@ def display_assistant(assistant_container: DeltaGenerator):
             st.markdown(prompt)
 
         with chat_container.chat_message("assistant"):
-            response = agent().respond(user_message)
-            st.markdown(response.content)
+            content = st.write_stream(agent().respond_stream(user_message))
 
-        messages().append(response)
+        messages().append(ChatMessage(role="assistant", content=content))
 
 
 def main():
@@ -0,0 +1,114 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from rag_assistant.database.product_database import Product, ProductDatabase
+from rag_assistant.llm.agent import SimpleRAGAgent
+from rag_assistant.llm.chat import CachedChatDecorator, Chat
+from rag_assistant.locks import ReadWriteLock
+from rag_assistant.retrieval.bm25 import BM25Index
+from rag_assistant.retrieval.embedding import Embedding
+from rag_assistant.retrieval.retriever import HybridRetriever, LockedRetriever
+from rag_assistant.retrieval.sync import SyncResult, sync_vector_index
+from rag_assistant.retrieval.vector_index import (
+    NumpyVectorIndex,
+    TracingVectorIndexDecorator,
+    VectorIndex,
+)
+from rag_assistant.tracing import Tracer
+
+
+class RetrievalBackend:
+    # Process-wide state shared by every session: model clients, the product
+    # database and the indexes built from it. Sessions get their own agent,
+    # and with it their own history, from agent(). refresh() is the only
+    # writer and excludes searches only while it updates the indexes.
+    _chat: Chat
+    _auxiliary_chat: Chat
+    _embedding: Embedding
+    _database: ProductDatabase
+    _vector_index: NumpyVectorIndex
+    _searched_index: VectorIndex
+    _retriever: LockedRetriever
+    _tracer: Tracer
+    _index_dir: str | None
+    _history_budget: int | None
+    _executor: ThreadPoolExecutor
+    _lock: ReadWriteLock
+    _refresh_lock: threading.Lock
+
+    def __init__(
+        self,
+        chat: Chat,
+        embedding: Embedding,
+        database: ProductDatabase,
+        vector_index: NumpyVectorIndex,
+        auxiliary_chat: Chat | None = None,
+        tracer: Tracer | None = None,
+        index_dir: str | None = None,
+        history_budget: int | None = 600,
+        max_workers: int = 64,
+    ):
+        self._chat = chat
+        self._auxiliary_chat = auxiliary_chat or CachedChatDecorator(chat)
+        self._embedding = embedding
+        self._database = database
+        self._vector_index = vector_index
+        self._tracer = tracer or Tracer(enabled=False)
+        self._index_dir = index_dir
+        self._history_budget = history_budget
+        # Speculative retrievals of every session run on one pool. Each one
+        # holds a worker through a query rewrite and an embedding request,
+        # so the pool is sized for concurrent sessions rather than cores.
+        self._executor = ThreadPoolExecutor(max_workers, "retrieval")
+        self._lock = ReadWriteLock()
+        self._refresh_lock = threading.Lock()
+        self._searched_index = vector_index
+        if self._tracer.enabled:
+            self._searched_index = TracingVectorIndexDecorator(
+                vector_index, self._tracer
+            )
+        self._retriever = LockedRetriever(
+            HybridRetriever(BM25Index(), embedding, self._searched_index),
+            self._lock,
+        )
+        self.refresh()
+
+    def agent(self) -> SimpleRAGAgent:
+        return SimpleRAGAgent(
+            self._chat,
+            self._vector_index,
+            self._embedding,
+            k=2,
+            executor=self._executor,
+            auxiliary_chat=self._auxiliary_chat,
+            history_budget=self._history_budget,
+            retriever=self._retriever,
+            # Read per search, so categories added by refresh() become
+            # filters in existing sessions too.
+            categories=lambda: self._vector_index.categories,
+            tracer=self._tracer,
+        )
+
+    def close(self) -> None:
+        self._executor.shutdown()
+
+    def refresh(self, products: list[Product] | None = None) -> SyncResult:
+        # Upserts products, if given, and brings both indexes up to date with
+        # the database.
+        with self._refresh_lock:
+            if products is not None:
+                self._database.insert_products(products)
+            version = self._vector_index.version
+            result = sync_vector_index(
+                self._database, self._vector_index, self._embedding, lock=self._lock
+            )
+            # The lexical index is cheap to rebuild, so it is replaced whole.
+            lexical_index = BM25Index()
+            lexical_index.insert_products(list(self._database.iter_rows()))
+            self._retriever.replace(
+                HybridRetriever(lexical_index, self._embedding, self._searched_index)
+            )
+            if self._index_dir and self._vector_index.version != version:
+                with self._lock.read():
+                    self._vector_index.save(self._index_dir)
+            return result
@@ -0,0 +1,103 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+from collections.abc import Hashable, Iterable
+
+
+class LRUCache:
+    _capacity: int
+    _entries: OrderedDict
+    _lock: threading.Lock
+    hits: int
+    misses: int
+
+    def __init__(self, capacity: int):
+        self._capacity = capacity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: Hashable, value) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._capacity:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class SQLiteStore:
+    _connection: sqlite3.Connection
+    _table_name: str
+    _lock: threading.Lock
+    _chunk_size: int = 500
+
+    def __init__(self, path: str, table_name: str):
+        self._table_name = table_name
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self._table_name} (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL
+            )
+        """)
+        self._connection.commit()
+
+    def get_many(self, keys: list[str]) -> dict[str, bytes]:
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), self._chunk_size):
+                chunk = keys[start : start + self._chunk_size]
+                placeholders = ", ".join("?" * len(chunk))
+                cur = self._connection.execute(
+                    f"""
+                    SELECT key, value FROM {self._table_name}
+                    WHERE key IN ({placeholders})
+                    """,
+                    chunk,
+                )
+                found.update(cur.fetchall())
+                cur.close()
+        return found
+
+    def put_many(self, items: Iterable[tuple[str, bytes]]) -> None:
+        with self._lock:
+            self._connection.executemany(
+                f"""
+                INSERT OR REPLACE INTO {self._table_name} (key, value)
+                VALUES (?, ?)
+                """,
+                items,
+            )
+            self._connection.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection.execute(f"DELETE FROM {self._table_name}")
+            self._connection.commit()
+
+    def close(self) -> None:
+        self._connection.close()
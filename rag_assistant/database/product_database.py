@@ -1,6 +1,9 @@
+import hashlib
 import os
 import sqlite3
+import time
 from abc import ABC, abstractmethod
+from collections.abc import Iterator
 
 import requests
 from dotenv import load_dotenv
@@ -18,6 +21,53 @@ class Product(BaseModel):
     image: HttpUrl
 
 
+class ProductRow:
+    # An unvalidated product read back from a database that only stores
+    # validated products. Formats like the Product it was stored from, so the
+    # two are interchangeable as index documents.
+    __slots__ = ("id", "title", "price", "description", "category", "image")
+
+    def __init__(
+        self,
+        id: int,
+        title: str,
+        price: float,
+        description: str,
+        category: str,
+        image: str,
+    ):
+        self.id = id
+        self.title = title
+        self.price = price
+        self.description = description
+        self.category = category
+        self.image = image
+
+    def __str__(self) -> str:
+        return (
+            f"id={self.id!r} title={self.title!r} price={self.price!r} "
+            f"description={self.description!r} category={self.category!r} "
+            f"image=HttpUrl({self.image!r})"
+        )
+
+    def to_product(self) -> Product:
+        return Product(
+            id=self.id,
+            title=self.title,
+            price=self.price,
+            description=self.description,
+            category=self.category,
+            image=self.image,
+        )
+
+
+def product_hash(product: Product) -> str:
+    # Covers every field but the id, so it changes exactly when the product's
+    # indexed content does.
+    content = product.model_dump_json(exclude={"id"})
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
 def get_fake_store_data() -> list[Product] | None:
     response = requests.get("https://fakestoreapi.com/products")
     product_list = TypeAdapter(list[Product])
@@ -46,6 +96,15 @@ class ProductDatabase(ABC):
         self,
     ) -> list[Product]: ...
 
+    @abstractmethod
+    def iter_all(self, batch_size: int = 1000) -> Iterator[Product]: ...
+
+    @abstractmethod
+    def iter_rows(self, batch_size: int = 1000) -> Iterator[ProductRow]: ...
+
+    @abstractmethod
+    def fetch_hashes(self) -> dict[int, str]: ...
+
     @abstractmethod
     def delete_products(self, ids: list[int] | int): ...
 
@@ -63,10 +122,24 @@ class ProductDatabase(ABC):
 class SQLiteProductDatabase(ProductDatabase):
     _connection: sqlite3.Connection
     _table_name: str = "products"
+    # Stays below SQLite's default limit on bound parameters.
+    _chunk_size: int = 500
 
-    def __init__(self):
+    def __init__(self, path: str | None = None):
+        # The connection may be used from any thread, one at a time.
         load_dotenv()
-        self._connection = sqlite3.connect(os.environ[DATABASE_ENVIRON])
+        self._connection = sqlite3.connect(
+            path or os.environ[DATABASE_ENVIRON], check_same_thread=False
+        )
+        self._configure()
+
+    def _configure(self) -> None:
+        # WAL lets readers proceed during a catalog refresh, and NORMAL
+        # synchronous is durable in WAL mode except on power loss.
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        # Negative values are in KiB: a 64 MiB page cache.
+        self._connection.execute("PRAGMA cache_size=-65536")
 
     def create_tables(self) -> None:
         cur = self._connection.cursor()
@@ -77,67 +150,191 @@ class SQLiteProductDatabase(ProductDatabase):
                 price FLOAT NOT NULL,
                 description STR DEFAULT '',
                 category STRING NOT NULL,
-                image STRING
+                image STRING,
+                content_hash STRING,
+                updated_at FLOAT
             )
         """)
         cur.close()
+        self._migrate()
+
+    def _migrate(self) -> None:
+        # Tables created before change tracking get its columns, and their
+        # rows get hashes.
+        cur = self._connection.cursor()
+        cur.execute(f"PRAGMA table_info({self._table_name})")
+        columns = {row[1] for row in cur.fetchall()}
+        for column, column_type in (
+            ("content_hash", "STRING"),
+            ("updated_at", "FLOAT"),
+        ):
+            if column not in columns:
+                cur.execute(
+                    f"ALTER TABLE {self._table_name} ADD COLUMN {column} {column_type}"
+                )
+        cur.execute(
+            f"""
+            SELECT id, title, price, description, category, image
+            FROM {self._table_name}
+            WHERE content_hash IS NULL
+            """
+        )
+        rows = cur.fetchall()
+        now = time.time()
+        cur.executemany(
+            f"""
+            UPDATE {self._table_name} SET content_hash = ?, updated_at = ?
+            WHERE id = ?
+            """,
+            [
+                (
+                    product_hash(SQLiteProductDatabase._product_from_row(row)),
+                    now,
+                    row[0],
+                )
+                for row in rows
+            ],
+        )
+        self._connection.commit()
+        cur.close()
 
     def insert_products(self, products: list[Product] | Product) -> None:
+        # Products that already exist are updated in place; updated_at only
+        # moves when their content does.
         if isinstance(products, Product):
             products = [products]
 
+        now = time.time()
         products = [
-            SQLiteProductDatabase._product_model_dump_sqlite(x) for x in products
+            SQLiteProductDatabase._product_model_dump_sqlite(x)
+            | {"content_hash": product_hash(x), "updated_at": now}
+            for x in products
         ]
 
         cur = self._connection.cursor()
         cur.executemany(
             f"""
             INSERT INTO {self._table_name} (
-                id, title, price, description, category, image
+                id, title, price, description, category, image,
+                content_hash, updated_at
             ) VALUES (
-                :id, :title, :price, :description, :category, :image
-            )""",
+                :id, :title, :price, :description, :category, :image,
+                :content_hash, :updated_at
+            ) ON CONFLICT (id) DO UPDATE SET
+                title = excluded.title,
+                price = excluded.price,
+                description = excluded.description,
+                category = excluded.category,
+                image = excluded.image,
+                content_hash = excluded.content_hash,
+                updated_at = excluded.updated_at
+            WHERE content_hash IS NOT excluded.content_hash
+            """,
             products,
         )
         self._connection.commit()
         cur.close()
 
-    def fetch_products(self, ids) -> list[Product]:
-        raise NotImplementedError()
+    def fetch_products(self, ids: list[int] | int) -> list[Product]:
+        # Products are returned in the order of ids; missing ones are skipped.
+        if isinstance(ids, int):
+            ids = [ids]
+        found = {}
+        cur = self._connection.cursor()
+        for start in range(0, len(ids), self._chunk_size):
+            chunk = ids[start : start + self._chunk_size]
+            placeholders = ", ".join("?" * len(chunk))
+            cur.execute(
+                f"""
+                SELECT id, title, price, description, category, image
+                FROM {self._table_name}
+                WHERE id IN ({placeholders})
+                """,
+                chunk,
+            )
+            for row in cur.fetchall():
+                found[row[0]] = SQLiteProductDatabase._product_from_row(row)
+        cur.close()
+        return [found[i] for i in ids if i in found]
 
     def fetch_all(self) -> list[Product]:
+        # Validating each product dominates, whichever way rows are read;
+        # iter_rows() skips it for reads that only need the stored values.
+        return list(self.iter_all())
+
+    def iter_all(self, batch_size: int = 1000) -> Iterator[Product]:
         cur = self._connection.cursor()
-        cur.execute(
-            f"""
-            SELECT id, title, price, description, category, image
-            FROM {self._table_name}
-            """
-        )
-        products = []
-        for row in cur.fetchall():
-            products.append(
-                Product(
-                    id=row[0],
-                    title=row[1],
-                    price=row[2],
-                    description=row[3],
-                    category=row[4],
-                    image=row[5],
-                )
+        try:
+            cur.execute(
+                f"""
+                SELECT id, title, price, description, category, image
+                FROM {self._table_name}
+                ORDER BY id
+                """
             )
+            while rows := cur.fetchmany(batch_size):
+                for row in rows:
+                    yield SQLiteProductDatabase._product_from_row(row)
+        finally:
+            cur.close()
+
+    def iter_rows(self, batch_size: int = 1000) -> Iterator[ProductRow]:
+        # Skips pydantic validation, which dominates iter_all on large
+        # catalogs.
+        cur = self._connection.cursor()
+        cur.row_factory = lambda _, row: ProductRow(*row)
+        try:
+            cur.execute(
+                f"""
+                SELECT id, title, price, description, category, image
+                FROM {self._table_name}
+                ORDER BY id
+                """
+            )
+            while rows := cur.fetchmany(batch_size):
+                yield from rows
+        finally:
+            cur.close()
+
+    def fetch_hashes(self) -> dict[int, str]:
+        cur = self._connection.cursor()
+        cur.execute(f"SELECT id, content_hash FROM {self._table_name}")
+        hashes = dict(cur.fetchall())
         cur.close()
-        return products
+        return hashes
 
-    def delete_products(self, ids) -> None:
-        raise NotImplementedError()
+    def delete_products(self, ids: list[int] | int) -> None:
+        if isinstance(ids, int):
+            ids = [ids]
+        cur = self._connection.cursor()
+        for start in range(0, len(ids), self._chunk_size):
+            chunk = ids[start : start + self._chunk_size]
+            placeholders = ", ".join("?" * len(chunk))
+            cur.execute(
+                f"DELETE FROM {self._table_name} WHERE id IN ({placeholders})",
+                chunk,
+            )
+        self._connection.commit()
+        cur.close()
 
     def delete_all(self) -> None:
-        raise NotImplementedError()
+        self._connection.execute(f"DELETE FROM {self._table_name}")
+        self._connection.commit()
 
     def close(self) -> None:
         self._connection.close()
 
+    @staticmethod
+    def _product_from_row(row: tuple) -> Product:
+        return Product(
+            id=row[0],
+            title=row[1],
+            price=row[2],
+            description=row[3],
+            category=row[4],
+            image=row[5],
+        )
+
     @staticmethod
     def _product_model_dump_sqlite(product: Product, *args, **kwargs):
         model = product.model_dump(*args, **kwargs)
@@ -1,51 +1,134 @@
+import contextvars
+import re
+import time
 from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
-from rag_assistant.llm.chat import Chat, ChatMessage
+from rag_assistant.llm.chat import CachedChatDecorator, Chat, ChatMessage
+from rag_assistant.llm.history import ChatHistory
+from rag_assistant.llm.response_cache import SemanticResponseCache
+from rag_assistant.retrieval.bm25 import tokenize
 from rag_assistant.retrieval.embedding import Embedding
-from rag_assistant.retrieval.vector_index import VectorIndex
+from rag_assistant.retrieval.retriever import Retriever
+from rag_assistant.retrieval.vector_index import Filter, VectorIndex
+from rag_assistant.tracing import Tracer
 
+# Amounts may use thousands separators; amounts followed by a unit other
+# than a currency, such as a rating, are not prices.
+_AMOUNT = (
+    r"\$?\s*(\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)"
+    r"(?!\.?\d|,\d|\s*(?:\"|%|inch|cm|mm|gb|tb|mah|w\b|stars?\b|rating|reviews?\b))"
+)
+_PRICE_RANGE = re.compile(rf"between\s+{_AMOUNT}\s*(?:and|to|-)\s*{_AMOUNT}", re.I)
+_MAX_PRICE = re.compile(
+    rf"(?:under|below|less than|cheaper than|at most|up to|max(?:imum)?)\s+{_AMOUNT}",
+    re.I,
+)
+_MIN_PRICE = re.compile(
+    rf"(?:over|above|more than|at least|min(?:imum)?)\s+{_AMOUNT}", re.I
+)
+# Comparisons following a rating, as in "rated over 4", are not prices.
+_RATING = re.compile(r"(?:rat(?:ed|ing)|stars?|reviews?)\s*$", re.I)
 
-def chat_history_to_text(chat_history: list[ChatMessage]):
-    return "\n\n".join([f"{m.role}: {m.content}" for m in chat_history])
+
+def _price(amount: str) -> float:
+    return float(amount.replace(",", ""))
+
+
+def _search(pattern: re.Pattern, text: str) -> re.Match | None:
+    return next(
+        (m for m in pattern.finditer(text) if not _RATING.search(text, 0, m.start())),
+        None,
+    )
+
+
+def extract_filter(text: str, categories: list[str]) -> Filter | None:
+    min_price = max_price = None
+    if match := _search(_PRICE_RANGE, text):
+        min_price, max_price = sorted(map(_price, match.groups()))
+    else:
+        if match := _search(_MAX_PRICE, text):
+            max_price = _price(match.group(1))
+        if match := _search(_MIN_PRICE, text):
+            min_price = _price(match.group(1))
+    # A category is named when all of its words appear in the text; the most
+    # specific one wins.
+    words = set(tokenize(text))
+    named = [c for c in categories if set(tokenize(c)) <= words and tokenize(c)]
+    category = max(named, key=lambda c: len(tokenize(c)), default=None)
+    if category is None and min_price is None and max_price is None:
+        return None
+    return Filter(category=category, min_price=min_price, max_price=max_price)
 
 
 class Agent(ABC):
     @abstractmethod
     def respond(self, messages: ChatMessage) -> ChatMessage: ...
 
+    def respond_stream(self, message: ChatMessage) -> Iterator[str]:
+        yield self.respond(message).content
+
     @abstractmethod
     def reset(self) -> None: ...
 
 
 class SimpleChatBot(Agent):
     _chat: Chat
-    _history: list[ChatMessage]
+    _history: ChatHistory
 
-    def __init__(self, chat: Chat):
+    def __init__(
+        self,
+        chat: Chat,
+        history_budget: int | None = None,
+        auxiliary_chat: Chat | None = None,
+    ):
         self._chat = chat
-        self._history = [
-            ChatMessage(
-                role="developer",
-                content="You are an assistant for an e-commerce web site.",
-            )
-        ]
+        self._history = ChatHistory(
+            chat,
+            [
+                ChatMessage(
+                    role="developer",
+                    content="You are an assistant for an e-commerce web site.",
+                )
+            ],
+            budget=history_budget,
+            summary_chat=auxiliary_chat,
+        )
 
     def respond(self, message: ChatMessage) -> ChatMessage:
+        answer = self._chat.chat(self._history.prompt(message))
         self._history.append(message)
-        answer = self._chat.chat(self._history)
         self._history.append(answer)
         return answer
 
+    def respond_stream(self, message: ChatMessage) -> Iterator[str]:
+        # A failed or abandoned stream leaves the history as it was.
+        deltas = []
+        for delta in self._chat.stream(self._history.prompt(message)):
+            deltas.append(delta)
+            yield delta
+        self._history.append(message)
+        self._history.append(ChatMessage(role="assistant", content="".join(deltas)))
+
     def reset(self) -> None:
         self._history.clear()
 
 
 class SimpleRAGAgent(Agent):
     _chat: Chat
-    _history: list[ChatMessage]
+    _auxiliary_chat: Chat
+    _history: ChatHistory
     _vector_index: VectorIndex
     _k: int
     _embedding: Embedding
+    _executor: ThreadPoolExecutor | None
+    _response_cache: SemanticResponseCache | None
+    _retriever: Retriever | None
+    _categories: list[str] | Callable[[], list[str]] | None
+    _tracer: Tracer
+    timings: dict[str, float]
     _search_decision_prompt = """
         You are an assistant for an e-commerce web site.
         Consider the last message of the conversation:
@@ -83,59 +166,184 @@ class SimpleRAGAgent(Agent):
     """
 
     def __init__(
-        self, chat: Chat, vector_index: VectorIndex, embedding: Embedding, k=2
+        self,
+        chat: Chat,
+        vector_index: VectorIndex,
+        embedding: Embedding,
+        k=2,
+        parallel=False,
+        response_cache: SemanticResponseCache | None = None,
+        auxiliary_chat: Chat | None = None,
+        history_budget: int | None = None,
+        retriever: Retriever | None = None,
+        categories: list[str] | Callable[[], list[str]] | None = None,
+        tracer: Tracer | None = None,
+        executor: ThreadPoolExecutor | None = None,
     ):
-        self._history = [
-            ChatMessage(
-                role="developer",
-                content="You are an assistant for an e-commerce web site.",
-            )
-        ]
         self._chat = chat
+        # The search decision and query rewrite prompts are deterministic
+        # templates, so their answers are memoized by default.
+        self._auxiliary_chat = auxiliary_chat or CachedChatDecorator(chat)
+        self._history = ChatHistory(
+            chat,
+            [
+                ChatMessage(
+                    role="developer",
+                    content="You are an assistant for an e-commerce web site.",
+                )
+            ],
+            budget=history_budget,
+            summary_chat=self._auxiliary_chat,
+        )
         self._vector_index = vector_index
         self._embedding = embedding
         self._k = k
+        # Speculatively retrieve while the search decision is being made, on
+        # the given executor when agents share one.
+        if executor is None and parallel:
+            executor = ThreadPoolExecutor(max_workers=1)
+        self._executor = executor
+        self._response_cache = response_cache
+        # Replaces the embed-then-search path, e.g. with hybrid retrieval.
+        self._retriever = retriever
+        # Known product categories, or a callable read at search time; when
+        # set, price and category constraints in the message become search
+        # filters.
+        self._categories = categories
+        self._tracer = tracer or Tracer(enabled=False)
+        self.timings = {}
 
     def respond(self, message: ChatMessage) -> ChatMessage:
-        if self.decide_to_search(message):
-            search_results = self.search(message)
-            extended_message = ChatMessage(
-                role="user",
-                content=self._user_question_with_search_results_prompt.format(
-                    message.content,
-                    "\n\n".join(search_results[: self._k]),
-                ),
-            )
-            answer = self._chat.chat(self._history + [extended_message])
-        else:
-            answer = self._chat.chat([message])
-
+        self.timings = {}
+        with self._tracer.turn(), self._timed("total"):
+            answer = self._cached(message)
+            if answer is None:
+                messages = self._prompt(message)
+                with self._timed("answer"):
+                    answer = self._chat.chat(messages)
+                self._store(message, answer)
         self._history.append(message)
         self._history.append(answer)
         return answer
 
-    def decide_to_search(self, message: ChatMessage) -> bool:
-        answer = self._chat.chat(
-            [
-                ChatMessage(
-                    role="user",
-                    content=self._search_decision_prompt.format(message.content),
-                )
-            ]
+    def respond_stream(self, message: ChatMessage) -> Iterator[str]:
+        with self._tracer.turn():
+            yield from self._respond_stream(message)
+
+    def _respond_stream(self, message: ChatMessage) -> Iterator[str]:
+        self.timings = {}
+        start = time.perf_counter()
+        answer = self._cached(message)
+        if answer is not None:
+            self.timings["total"] = time.perf_counter() - start
+            self._history.append(message)
+            self._history.append(answer)
+            yield answer.content
+            return
+        messages = self._prompt(message)
+        deltas = []
+        with self._timed("answer"):
+            for delta in self._chat.stream(messages):
+                if not deltas:
+                    self.timings["first_token"] = time.perf_counter() - start
+                deltas.append(delta)
+                yield delta
+        self.timings["total"] = time.perf_counter() - start
+        answer = ChatMessage(role="assistant", content="".join(deltas))
+        self._store(message, answer)
+        self._history.append(message)
+        self._history.append(answer)
+
+    def _cached(self, message: ChatMessage) -> ChatMessage | None:
+        if self._response_cache is None:
+            return None
+        with self._timed("cache"):
+            return self._response_cache.lookup(message.content, self._filter(message))
+
+    def _store(self, message: ChatMessage, answer: ChatMessage) -> None:
+        if self._response_cache is not None:
+            self._response_cache.store(message.content, answer, self._filter(message))
+
+    def _prompt(self, message: ChatMessage) -> list[ChatMessage]:
+        search_results = self._retrieve(message)
+        if search_results is None:
+            return [message]
+        extended_message = ChatMessage(
+            role="user",
+            content=self._user_question_with_search_results_prompt.format(
+                message.content,
+                "\n\n".join(search_results[: self._k]),
+            ),
         )
+        return self._history.prompt(extended_message)
+
+    def _retrieve(self, message: ChatMessage) -> list[str] | None:
+        if self._executor is None:
+            return self.search(message) if self.decide_to_search(message) else None
+        # The copied context keeps the retrieval's trace spans in this turn.
+        context = contextvars.copy_context()
+        retrieval = self._executor.submit(context.run, self.search, message)
+        if self.decide_to_search(message):
+            return retrieval.result()
+        # A retrieval that has already started is left to finish and its
+        # result is discarded.
+        retrieval.cancel()
+        return None
+
+    def decide_to_search(self, message: ChatMessage) -> bool:
+        with self._timed("decide"):
+            answer = self._auxiliary_chat.chat(
+                [
+                    ChatMessage(
+                        role="user",
+                        content=self._search_decision_prompt.format(message.content),
+                    )
+                ]
+            )
         return "yes" in answer.content.lower()
 
+    def construct_query(self, message: ChatMessage) -> str:
+        with self._timed("query"):
+            query = self._auxiliary_chat.chat(
+                [
+                    ChatMessage(
+                        role="user",
+                        content=self._construct_query_prompt.format(message.content),
+                    )
+                ]
+            )
+        return query.content
+
     def search(self, message: ChatMessage) -> list[str]:
-        query = self._chat.chat(
-            [
-                ChatMessage(
-                    role="user",
-                    content=self._construct_query_prompt.format(message.content),
-                )
-            ]
-        )
-        query_embedding = self._embedding.embed(query.content)
-        return self._vector_index.search(query_embedding, self._k)
+        query = self.construct_query(message)
+        where = self._filter(message)
+        if self._retriever is not None:
+            with self._timed("search"):
+                return self._retriever.search(query, self._k, where)
+        with self._timed("embed"):
+            query_embedding = self._embedding.embed(query)
+        with self._timed("search"):
+            return self._vector_index.search(query_embedding, self._k, where)
+
+    def _filter(self, message: ChatMessage) -> Filter | None:
+        categories = self._categories
+        if callable(categories):
+            categories = categories()
+        if categories is None:
+            return None
+        return extract_filter(message.content, categories)
+
+    @contextmanager
+    def _timed(self, stage: str) -> Iterator[None]:
+        # Bind the current turn so a discarded retrieval cannot leak into the
+        # timings of a later one.
+        timings = self.timings
+        start = time.perf_counter()
+        try:
+            with self._tracer.span(f"agent.{stage}"):
+                yield
+        finally:
+            timings[stage] = time.perf_counter() - start
 
     def reset(self) -> None:
         self._history.clear()
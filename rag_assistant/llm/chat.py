@@ -1,21 +1,135 @@
+import asyncio
+import hashlib
+import json
+import time
 from abc import ABC, abstractmethod
+from collections.abc import AsyncIterator, Callable, Iterator
+from functools import cached_property
 
-from openai import OpenAI
-from pydantic import BaseModel
+from openai import AsyncOpenAI, OpenAI
+from pydantic import BaseModel, PrivateAttr
 from tiktoken import Encoding, encoding_for_model
 
+from rag_assistant.cache import LRUCache, SQLiteStore
+from rag_assistant.openai_client import (
+    EventLoopThread,
+    background_loop,
+    shared_async_client,
+    with_retries,
+)
+from rag_assistant.tracing import Tracer
+
+CHAT_CACHE_ENVIRON = "CHAT_CACHE_FILE"
+
 
 class ChatMessage(BaseModel):
     role: str
     content: str
+    _token_counts: dict[str, tuple[str, str, int]] = PrivateAttr(default_factory=dict)
+
+    def __eq__(self, other: object) -> bool:
+        # Cached token counts are not part of a message's identity.
+        if not isinstance(other, ChatMessage):
+            return NotImplemented
+        return self.role == other.role and self.content == other.content
+
+
+# Every message is wrapped in <|start|>{role}\n{content}<|end|>\n and every
+# reply is primed with <|start|>assistant<|message|>.
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+
+def count_message_tokens(message: ChatMessage, encoding: Encoding) -> int:
+    # Counts are cached on the message and reused while role and content are
+    # unchanged, so a growing history is only ever encoded once.
+    cached = message._token_counts.get(encoding.name)
+    if (
+        cached is not None
+        and cached[0] is message.role
+        and cached[1] is message.content
+    ):
+        return cached[2]
+    count = (
+        TOKENS_PER_MESSAGE
+        + len(encoding.encode(message.role))
+        + len(encoding.encode(message.content))
+    )
+    message._token_counts[encoding.name] = (message.role, message.content, count)
+    return count
+
+
+def count_messages_tokens(messages: list[ChatMessage], encoding: Encoding) -> int:
+    return TOKENS_PER_REPLY + sum(count_message_tokens(m, encoding) for m in messages)
+
+
+class Prompt(list[ChatMessage]):
+    # Messages whose token total, without reply priming, is already known,
+    # such as a history's running count, so limit checks need not add up
+    # every message again.
+    tokens: int
+
+    def __init__(self, messages: list[ChatMessage], tokens: int):
+        super().__init__(messages)
+        self.tokens = tokens
 
 
 class Chat(ABC):
+    @property
+    @abstractmethod
+    def model(self) -> str: ...
     @abstractmethod
     def chat(self, messages: list[ChatMessage]) -> ChatMessage: ...
     @abstractmethod
     def count_tokens(self, messages: list[ChatMessage]) -> int: ...
 
+    def count_message_tokens(self, message: ChatMessage) -> int:
+        return self.count_tokens([message])
+
+    def stream(self, messages: list[ChatMessage]) -> Iterator[str]:
+        yield self.chat(messages).content
+
+
+class AsyncChat(ABC):
+    @property
+    @abstractmethod
+    def model(self) -> str: ...
+    @abstractmethod
+    async def chat(self, messages: list[ChatMessage]) -> ChatMessage: ...
+    @abstractmethod
+    def count_tokens(self, messages: list[ChatMessage]) -> int: ...
+
+    def count_message_tokens(self, message: ChatMessage) -> int:
+        return self.count_tokens([message])
+
+    async def stream(self, messages: list[ChatMessage]) -> AsyncIterator[str]:
+        yield (await self.chat(messages)).content
+
+
+class SyncChatAdapter(Chat):
+    _chat: AsyncChat
+    _loop: EventLoopThread
+
+    def __init__(self, chat: AsyncChat, loop: EventLoopThread | None = None):
+        self._chat = chat
+        self._loop = loop or background_loop()
+
+    @property
+    def model(self) -> str:
+        return self._chat.model
+
+    def chat(self, messages: list[ChatMessage]) -> ChatMessage:
+        return self._loop.run(self._chat.chat(messages))
+
+    def stream(self, messages: list[ChatMessage]) -> Iterator[str]:
+        return self._loop.iterate(self._chat.stream(messages))
+
+    def count_tokens(self, messages: list[ChatMessage]) -> int:
+        return self._chat.count_tokens(messages)
+
+    def count_message_tokens(self, message: ChatMessage) -> int:
+        return self._chat.count_message_tokens(message)
+
 
 class SafeChatDecorator(Chat):
     _chat: Chat
@@ -25,14 +139,202 @@ class SafeChatDecorator(Chat):
         self._chat = chat
         self._limit = limit
 
+    @property
+    def model(self) -> str:
+        return self._chat.model
+
     def chat(self, messages: list[ChatMessage]) -> ChatMessage:
-        if self.count_tokens(messages) > self._limit:
-            raise ValueError("Token limit exceeded")
+        self._check(messages)
         return self._chat.chat(messages)
 
+    def stream(self, messages: list[ChatMessage]) -> Iterator[str]:
+        self._check(messages)
+        return self._chat.stream(messages)
+
     def count_tokens(self, messages: list[ChatMessage]) -> int:
         return self._chat.count_tokens(messages)
 
+    def count_message_tokens(self, message: ChatMessage) -> int:
+        return self._chat.count_message_tokens(message)
+
+    def _check(self, messages: list[ChatMessage]) -> None:
+        if isinstance(messages, Prompt):
+            # Only the reply priming is left to count.
+            tokens = messages.tokens + self.count_tokens([])
+        else:
+            tokens = self.count_tokens(messages)
+        if tokens > self._limit:
+            raise ValueError("Token limit exceeded")
+
+
+class CachedChatDecorator(Chat):
+    _chat: Chat
+    _memory: LRUCache
+    _store: SQLiteStore | None
+    _table_name: str = "chat_completions"
+    hits: int
+    misses: int
+
+    def __init__(self, chat: Chat, capacity: int = 1024, path: str | None = None):
+        self._chat = chat
+        self._memory = LRUCache(capacity)
+        self._store = None if path is None else SQLiteStore(path, self._table_name)
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def model(self) -> str:
+        return self._chat.model
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def chat(self, messages: list[ChatMessage]) -> ChatMessage:
+        key = self._key(messages)
+        answer = self._memory.get(key)
+        if answer is None and self._store is not None:
+            stored = self._store.get_many([key]).get(key)
+            if stored is not None:
+                answer = ChatMessage.model_validate_json(stored)
+                self._memory.put(key, answer)
+        if answer is not None:
+            self.hits += 1
+            return answer.model_copy()
+
+        self.misses += 1
+        answer = self._chat.chat(messages)
+        self._memory.put(key, answer)
+        if self._store is not None:
+            self._store.put_many([(key, answer.model_dump_json().encode())])
+        return answer.model_copy()
+
+    def count_tokens(self, messages: list[ChatMessage]) -> int:
+        return self._chat.count_tokens(messages)
+
+    def count_message_tokens(self, message: ChatMessage) -> int:
+        return self._chat.count_message_tokens(message)
+
+    def _key(self, messages: list[ChatMessage]) -> str:
+        # Templated prompts differ only in indentation, so whitespace is
+        # collapsed before hashing.
+        normalized = [(m.role, " ".join(m.content.split())) for m in messages]
+        payload = json.dumps([self.model, normalized])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class TracingChatDecorator(Chat):
+    _chat: Chat
+    _tracer: Tracer
+    _name: str
+
+    def __init__(self, chat: Chat, tracer: Tracer, name: str = "chat"):
+        self._chat = chat
+        self._tracer = tracer
+        self._name = name
+
+    @property
+    def model(self) -> str:
+        return self._chat.model
+
+    def chat(self, messages: list[ChatMessage]) -> ChatMessage:
+        if not self._tracer.enabled:
+            return self._chat.chat(messages)
+        hits = getattr(self._chat, "hits", None)
+        with self._tracer.span(
+            f"{self._name}.chat",
+            model=self.model,
+            prompt_tokens=self.count_tokens(messages),
+        ) as attributes:
+            answer = self._chat.chat(messages)
+            attributes["completion_tokens"] = self.count_message_tokens(answer)
+            if hits is not None:
+                attributes["cache_hit"] = self._chat.hits > hits
+        return answer
+
+    def stream(self, messages: list[ChatMessage]) -> Iterator[str]:
+        if not self._tracer.enabled:
+            yield from self._chat.stream(messages)
+            return
+        with self._tracer.span(
+            f"{self._name}.stream",
+            model=self.model,
+            prompt_tokens=self.count_tokens(messages),
+        ) as attributes:
+            start = time.perf_counter()
+            deltas = []
+            for delta in self._chat.stream(messages):
+                if not deltas:
+                    attributes["first_token"] = time.perf_counter() - start
+                deltas.append(delta)
+                yield delta
+            answer = ChatMessage(role="assistant", content="".join(deltas))
+            attributes["completion_tokens"] = self.count_message_tokens(answer)
+
+    def count_tokens(self, messages: list[ChatMessage]) -> int:
+        return self._chat.count_tokens(messages)
+
+    def count_message_tokens(self, message: ChatMessage) -> int:
+        return self._chat.count_message_tokens(message)
+
+
+class ScriptedChat(Chat):
+    # A deterministic offline stand-in for benchmarks and tests. The first
+    # rule whose pattern occurs in the last message gives the answer, either
+    # verbatim or computed from that message. Tokens are whitespace-separated
+    # words; latency is paid before the first token and token_latency after
+    # each streamed one.
+    _rules: list[tuple[str, str | Callable[[str], str]]]
+    _default: str | Callable[[str], str]
+    latency: float
+    token_latency: float
+    calls: int
+
+    def __init__(
+        self,
+        rules: list[tuple[str, str | Callable[[str], str]]] | None = None,
+        default: str | Callable[[str], str] = "OK",
+        latency: float = 0.0,
+        token_latency: float = 0.0,
+    ):
+        self._rules = rules or []
+        self._default = default
+        self.latency = latency
+        self.token_latency = token_latency
+        self.calls = 0
+
+    @property
+    def model(self) -> str:
+        return "scripted"
+
+    def chat(self, messages: list[ChatMessage]) -> ChatMessage:
+        content = self._answer(messages)
+        time.sleep(self.latency + self.token_latency * len(content.split()))
+        return ChatMessage(role="assistant", content=content)
+
+    def stream(self, messages: list[ChatMessage]) -> Iterator[str]:
+        content = self._answer(messages)
+        time.sleep(self.latency)
+        for i, word in enumerate(content.split()):
+            time.sleep(self.token_latency)
+            yield word if i == 0 else " " + word
+
+    def count_tokens(self, messages: list[ChatMessage]) -> int:
+        return TOKENS_PER_REPLY + sum(map(self.count_message_tokens, messages))
+
+    def count_message_tokens(self, message: ChatMessage) -> int:
+        return TOKENS_PER_MESSAGE + len(message.content.split())
+
+    def _answer(self, messages: list[ChatMessage]) -> str:
+        self.calls += 1
+        content = messages[-1].content
+        answer = next(
+            (answer for pattern, answer in self._rules if pattern in content),
+            self._default,
+        )
+        return answer(content) if callable(answer) else answer
+
 
 class OpenAIChat(Chat):
     _model: str
@@ -44,6 +346,10 @@ class OpenAIChat(Chat):
         self._encoding = encoding_for_model(self._model)
         self._client = OpenAI()
 
+    @property
+    def model(self) -> str:
+        return self._model
+
     def chat(self, messages: list[ChatMessage]) -> ChatMessage:
         messages = [message.model_dump() for message in messages]
         response = self._client.chat.completions.create(
@@ -53,6 +359,83 @@ class OpenAIChat(Chat):
         message = response.choices[0].message
         return ChatMessage(role=message.role, content=message.content)
 
+    def stream(self, messages: list[ChatMessage]) -> Iterator[str]:
+        messages = [message.model_dump() for message in messages]
+        response = self._client.chat.completions.create(
+            model=self._model,
+            messages=messages,
+            stream=True,
+        )
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def count_tokens(self, messages: list[ChatMessage]) -> int:
+        return count_messages_tokens(messages, self._encoding)
+
+    def count_message_tokens(self, message: ChatMessage) -> int:
+        return count_message_tokens(message, self._encoding)
+
+
+class AsyncOpenAIChat(AsyncChat):
+    _model: str
+    _client: AsyncOpenAI
+    _semaphore: asyncio.Semaphore
+    _retries: int
+    _backoff: float
+
+    def __init__(
+        self,
+        model: str,
+        client: AsyncOpenAI | None = None,
+        max_concurrency: int = 8,
+        retries: int = 3,
+        backoff: float = 0.5,
+    ):
+        self._model = model
+        self._client = client or shared_async_client()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._retries = retries
+        self._backoff = backoff
+
+    @cached_property
+    def _encoding(self) -> Encoding:
+        return encoding_for_model(self._model)
+
+    @property
+    def model(self) -> str:
+        return self._model
+
+    async def chat(self, messages: list[ChatMessage]) -> ChatMessage:
+        messages = [message.model_dump() for message in messages]
+        async with self._semaphore:
+            response = await with_retries(
+                lambda: self._client.chat.completions.create(
+                    model=self._model, messages=messages
+                ),
+                self._retries,
+                self._backoff,
+            )
+        message = response.choices[0].message
+        return ChatMessage(role=message.role, content=message.content)
+
+    async def stream(self, messages: list[ChatMessage]) -> AsyncIterator[str]:
+        messages = [message.model_dump() for message in messages]
+        async with self._semaphore:
+            # Only opening the stream is retried; a broken stream is not resumed.
+            response = await with_retries(
+                lambda: self._client.chat.completions.create(
+                    model=self._model, messages=messages, stream=True
+                ),
+                self._retries,
+                self._backoff,
+            )
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
     def count_tokens(self, messages: list[ChatMessage]) -> int:
-        text = " ".join([m.content for m in messages])
-        return len(self._encoding.encode(text))
+        return count_messages_tokens(messages, self._encoding)
+
+    def count_message_tokens(self, message: ChatMessage) -> int:
+        return count_message_tokens(message, self._encoding)
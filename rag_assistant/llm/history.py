@@ -0,0 +1,169 @@
+from collections import deque
+from collections.abc import Iterator
+
+from rag_assistant.llm.chat import Chat, ChatMessage, Prompt
+
+
+def chat_history_to_text(chat_history: list[ChatMessage]):
+    return "\n\n".join([f"{m.role}: {m.content}" for m in chat_history])
+
+
+class ChatHistory:
+    _chat: Chat
+    _summary_chat: Chat
+    _pinned: list[ChatMessage]
+    _summary: ChatMessage | None
+    _window: deque[ChatMessage]
+    _budget: int | None
+    _summary_limit: int | None
+    _tokens: int
+    _total_tokens: int
+    turn_savings: deque[int]
+    _summary_prompt = """
+        You are an assistant for an e-commerce web site.
+        Here is a summary of the conversation so far:
+        ---
+        {0}
+        ---
+        Here are the messages that followed it:
+        ---
+        {1}
+        ---
+        Write a summary of the whole conversation in at most {2} words. Keep
+        the products, prices and preferences the user mentioned and any open
+        questions.
+    """
+
+    def __init__(
+        self,
+        chat: Chat,
+        messages: list[ChatMessage] | None = None,
+        budget: int | None = None,
+        summary_chat: Chat | None = None,
+        capacity: int = 1000,
+        summary_limit: int | None = None,
+    ):
+        # The initial messages are the instructions and are always sent.
+        # Summaries go through summary_chat when given: the summary prompt
+        # carries the evicted messages and may not fit a limit meant for the
+        # budgeted history. A summary counts against the budget and is cut
+        # to summary_limit tokens, a quarter of the budget by default.
+        self._chat = chat
+        self._summary_chat = summary_chat or chat
+        self._pinned = list(messages or [])
+        self._summary = None
+        self._window = deque()
+        self._budget = budget
+        if summary_limit is None and budget is not None:
+            summary_limit = budget // 4
+        self._summary_limit = summary_limit
+        self._tokens = sum(chat.count_message_tokens(m) for m in self._pinned)
+        self._total_tokens = self._tokens
+        self.turn_savings = deque(maxlen=capacity)
+
+    @property
+    def messages(self) -> Prompt:
+        summary = [] if self._summary is None else [self._summary]
+        return Prompt(self._pinned + summary + list(self._window), self._tokens)
+
+    def prompt(self, message: ChatMessage) -> Prompt:
+        # The history followed by a message that is not kept in it.
+        messages = self.messages
+        messages.append(message)
+        messages.tokens += self._chat.count_message_tokens(message)
+        return messages
+
+    @property
+    def tokens(self) -> int:
+        return self._tokens
+
+    @property
+    def tokens_saved(self) -> int:
+        return self._total_tokens - self._tokens
+
+    @property
+    def summary(self) -> str | None:
+        return None if self._summary is None else self._summary.content
+
+    def __len__(self) -> int:
+        return len(self._pinned) + (self._summary is not None) + len(self._window)
+
+    def __iter__(self) -> Iterator[ChatMessage]:
+        return iter(self.messages)
+
+    def __getitem__(self, i: int) -> ChatMessage:
+        return self.messages[i]
+
+    def append(self, message: ChatMessage) -> None:
+        count = self._chat.count_message_tokens(message)
+        self._tokens += count
+        self._total_tokens += count
+        self._window.append(message)
+        self._compact()
+        if message.role == "assistant":
+            self.turn_savings.append(self.tokens_saved)
+
+    def clear(self) -> None:
+        self._pinned.clear()
+        self._summary = None
+        self._window.clear()
+        self._tokens = 0
+        self._total_tokens = 0
+        self.turn_savings.clear()
+
+    def _compact(self) -> None:
+        # Old messages are evicted down to half the budget, so the next turns
+        # fit without another summary. The newest message is always kept
+        # verbatim.
+        if self._budget is None or self._tokens <= self._budget:
+            return
+        evicted = []
+        while self._tokens > self._budget // 2 and len(self._window) > 1:
+            message = self._window.popleft()
+            self._tokens -= self._chat.count_message_tokens(message)
+            evicted.append(message)
+        if evicted:
+            self._summarize(evicted)
+
+    def _summarize(self, evicted: list[ChatMessage]) -> None:
+        answer = self._summary_chat.chat(
+            [
+                ChatMessage(
+                    role="user",
+                    content=self._summary_prompt.format(
+                        self.summary or "(nothing yet)",
+                        chat_history_to_text(evicted),
+                        self._summary_limit,
+                    ),
+                )
+            ]
+        )
+        if self._summary is not None:
+            self._tokens -= self._chat.count_message_tokens(self._summary)
+        self._summary = ChatMessage(
+            role="developer",
+            content="Summary of the earlier conversation: "
+            + self._truncate(answer.content),
+        )
+        self._tokens += self._chat.count_message_tokens(self._summary)
+
+    def _truncate(self, content: str) -> str:
+        # Models do not always keep to the requested length, so the summary
+        # is cut to the longest prefix of words within the limit.
+        def tokens(text: str) -> int:
+            return self._chat.count_message_tokens(
+                ChatMessage(role="developer", content=text)
+            )
+
+        words = content.split()
+        limit = self._summary_limit + tokens("")
+        if tokens(content) <= limit:
+            return content
+        low, high = 0, len(words)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if tokens(" ".join(words[:middle])) <= limit:
+                low = middle
+            else:
+                high = middle - 1
+        return " ".join(words[:low])
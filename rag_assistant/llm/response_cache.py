@@ -0,0 +1,133 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+from rag_assistant.llm.chat import ChatMessage
+from rag_assistant.retrieval.embedding import Embedding
+from rag_assistant.retrieval.vector_index import Filter, NumpyVectorIndex, VectorIndex
+
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+@dataclass(slots=True)
+class _CacheEntry:
+    answer: ChatMessage
+    vector: np.ndarray
+    created: float
+    constraints: tuple
+
+
+def _constraints(text: str, where: Filter | None = None) -> tuple:
+    # Texts that embed alike may still ask for different prices or sizes,
+    # so a hit also needs the same filter and the same numbers.
+    return where, tuple(float(n) for n in _NUMBER.findall(text))
+
+
+class SemanticResponseCache:
+    _embedding: Embedding
+    _threshold: float
+    _ttl: float
+    _capacity: int
+    _candidates: int = 4
+    _entries: OrderedDict[str, _CacheEntry]
+    _index: NumpyVectorIndex
+    _next_id: int
+    _source: VectorIndex | None
+    _source_version: int
+    _last: tuple[str, np.ndarray] | None
+    _lock: threading.Lock
+    hits: int
+    misses: int
+
+    def __init__(
+        self,
+        embedding: Embedding,
+        threshold: float = 0.95,
+        ttl: float = 3600.0,
+        capacity: int = 1000,
+        source: VectorIndex | None = None,
+    ):
+        self._embedding = embedding
+        self._threshold = threshold
+        self._ttl = ttl
+        self._capacity = capacity
+        self._source = source
+        self._last = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        self._entries = OrderedDict()
+        self._index = NumpyVectorIndex(self._embedding.dim)
+        self._next_id = 0
+        self._source_version = self._source.version if self._source else 0
+
+    def lookup(self, text: str, where: Filter | None = None) -> ChatMessage | None:
+        vector = self._embed(text)
+        wanted = _constraints(text, where)
+        with self._lock:
+            self._check_source()
+            now = time.monotonic()
+            for key, score in self._index.search_with_scores(vector, self._candidates):
+                if score < self._threshold:
+                    break
+                entry = self._entries.get(key)
+                if entry is None or entry.constraints != wanted:
+                    continue
+                if now - entry.created > self._ttl:
+                    self._evict(key)
+                    continue
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.answer
+            self.misses += 1
+            return None
+
+    def store(
+        self, text: str, answer: ChatMessage, where: Filter | None = None
+    ) -> None:
+        vector = self._embed(text)
+        with self._lock:
+            self._check_source()
+            key = str(self._next_id)
+            self._next_id += 1
+            self._entries[key] = _CacheEntry(
+                answer, vector, time.monotonic(), _constraints(text, where)
+            )
+            self._index.insert_array([key], vector[np.newaxis])
+            while len(self._entries) > self._capacity:
+                self._evict(next(iter(self._entries)))
+
+    def _embed(self, text: str) -> np.ndarray:
+        # store() usually follows a missed lookup() of the same text.
+        last = self._last
+        if last is not None and last[0] == text:
+            return last[1]
+        vector = np.asarray(self._embedding.embed(text), dtype=np.float32)
+        self._last = (text, vector)
+        return vector
+
+    def _check_source(self) -> None:
+        if self._source is not None and self._source.version != self._source_version:
+            self.clear()
+
+    def _evict(self, key: str) -> None:
+        del self._entries[key]
+        # Evicted rows stay in the index until they outnumber live entries.
+        if len(self._index) > 2 * len(self._entries) + self._candidates:
+            entries = list(self._entries.items())
+            self._index = NumpyVectorIndex(self._embedding.dim)
+            if entries:
+                self._index.insert_array(
+                    [key for key, _ in entries],
+                    np.stack([entry.vector for _, entry in entries]),
+                )
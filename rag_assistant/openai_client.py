@@ -0,0 +1,83 @@
+import asyncio
+import random
+import threading
+from collections.abc import AsyncIterator, Awaitable, Callable, Coroutine, Iterator
+from typing import TypeVar
+
+import httpx
+from openai import (
+    APIConnectionError,
+    AsyncOpenAI,
+    InternalServerError,
+    RateLimitError,
+)
+
+T = TypeVar("T")
+
+RETRYABLE_ERRORS = (APIConnectionError, InternalServerError, RateLimitError)
+
+_client: AsyncOpenAI | None = None
+_loop: "EventLoopThread | None" = None
+_lock = threading.Lock()
+
+
+def shared_async_client(
+    max_connections: int = 32, max_keepalive_connections: int = 16
+) -> AsyncOpenAI:
+    # Retries are handled by with_retries, so the client itself never retries.
+    global _client
+    with _lock:
+        if _client is None:
+            limits = httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+            )
+            _client = AsyncOpenAI(
+                max_retries=0, http_client=httpx.AsyncClient(limits=limits)
+            )
+        return _client
+
+
+async def with_retries(
+    call: Callable[[], Awaitable[T]], retries: int = 3, backoff: float = 0.5
+) -> T:
+    for attempt in range(retries + 1):
+        try:
+            return await call()
+        except RETRYABLE_ERRORS:
+            if attempt == retries:
+                raise
+            delay = backoff * 2**attempt
+            await asyncio.sleep(delay * (0.5 + random.random()))
+    raise AssertionError("unreachable")
+
+
+class EventLoopThread:
+    _loop: asyncio.AbstractEventLoop
+    _thread: threading.Thread
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def run(self, coroutine: Coroutine[object, object, T]) -> T:
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def iterate(self, iterator: AsyncIterator[T]) -> Iterator[T]:
+        async def step() -> T:
+            return await anext(iterator)
+
+        while True:
+            try:
+                yield self.run(step())
+            except StopAsyncIteration:
+                return
+
+
+def background_loop() -> EventLoopThread:
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = EventLoopThread()
+        return _loop
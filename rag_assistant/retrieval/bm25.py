@@ -0,0 +1,126 @@
+import math
+import re
+
+import numpy as np
+
+from rag_assistant.database.product_database import Product, ProductRow
+from rag_assistant.retrieval.vector_index import (
+    AttributeStore,
+    DocumentStore,
+    Filter,
+    top_k,
+)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    _k1: float
+    _b: float
+    _documents: DocumentStore
+    _attributes: AttributeStore
+    _lengths: list[int]
+    _postings: dict[str, tuple[list[int], list[int]]]
+    _arrays: dict[str, tuple[np.ndarray, np.ndarray]] | None
+    _version: int = 0
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self._k1 = k1
+        self._b = b
+        self._documents = DocumentStore()
+        self._attributes = AttributeStore()
+        self._lengths = []
+        self._postings = {}
+        self._arrays = None
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def insert(
+        self,
+        documents: list[str],
+        texts: list[str],
+        categories: list[str] | None = None,
+        prices: list[float] | np.ndarray | None = None,
+    ) -> None:
+        for text in texts:
+            doc = len(self._lengths)
+            tokens = tokenize(text)
+            self._lengths.append(len(tokens))
+            terms, counts = np.unique(tokens, return_counts=True)
+            for term, count in zip(terms.tolist(), counts.tolist(), strict=True):
+                ids, tfs = self._postings.setdefault(term, ([], []))
+                ids.append(doc)
+                tfs.append(count)
+        self._documents.extend(documents)
+        self._attributes.extend(len(documents), categories, prices)
+        self._arrays = None
+        self._version += 1
+
+    def insert_products(self, products: list[Product] | list[ProductRow]) -> None:
+        self.insert(
+            [str(product) for product in products],
+            [
+                f"{product.title} {product.category} {product.description}"
+                for product in products
+            ],
+            [product.category for product in products],
+            [product.price for product in products],
+        )
+
+    def scores(self, query: str) -> tuple[np.ndarray, float]:
+        # Returns the score of every document and the score of a document of
+        # average length containing every query term once. Unknown terms count
+        # towards the latter, so a query that is only partly in the vocabulary
+        # never looks like a confident lexical match.
+        if self._arrays is None:
+            self._arrays = {
+                term: (np.array(ids, dtype=np.int64), np.array(tfs, dtype=np.float32))
+                for term, (ids, tfs) in self._postings.items()
+            }
+        n = len(self._lengths)
+        scores = np.zeros(n, dtype=np.float32)
+        if n == 0:
+            return scores, 0.0
+        lengths = np.asarray(self._lengths, dtype=np.float32)
+        norms = self._k1 * (1 - self._b + self._b * lengths / lengths.mean())
+        reference = 0.0
+        for term in set(tokenize(query)):
+            ids, tfs = self._arrays.get(term, (np.empty(0, np.int64), None))
+            idf = math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+            if len(ids):
+                scores[ids] += idf * tfs * (self._k1 + 1) / (tfs + norms[ids])
+            reference += idf
+        return scores, reference
+
+    def search_with_scores(
+        self,
+        query: str,
+        k: int,
+        normalized: bool = False,
+        where: Filter | None = None,
+    ) -> list[tuple[str, float]]:
+        scores, reference = self.scores(query)
+        if normalized and reference:
+            scores /= reference
+        matches = np.flatnonzero(scores)
+        if where is not None:
+            matches = np.intersect1d(
+                matches, self._attributes.candidates(where), assume_unique=True
+            )
+        return [
+            (self._documents[i], float(scores[i]))
+            for i in matches[top_k(scores[matches], k)]
+        ]
+
+    def search(self, query: str, k: int, where: Filter | None = None) -> list[str]:
+        results = self.search_with_scores(query, k, where=where)
+        return [document for document, _ in results]
@@ -1,16 +1,114 @@
+import asyncio
+import hashlib
+import re
+import threading
+import time
 from abc import ABC, abstractmethod
+from collections import deque
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future
+from functools import cached_property, lru_cache
 
-from openai import OpenAI
+import numpy as np
+from openai import AsyncOpenAI, OpenAI
 from tiktoken import Encoding, encoding_for_model
 
+from rag_assistant.cache import LRUCache, SQLiteStore
+from rag_assistant.openai_client import (
+    EventLoopThread,
+    background_loop,
+    shared_async_client,
+    with_retries,
+)
+from rag_assistant.tracing import Tracer
+
+EMBEDDING_CACHE_ENVIRON = "EMBEDDING_CACHE_FILE"
+
+
+def pack_batches(
+    texts: list[str],
+    count_tokens: Callable[[str], int],
+    max_tokens: int,
+    max_size: int,
+) -> Iterator[tuple[int, int]]:
+    start = 0
+    tokens = 0
+    for stop, text in enumerate(texts):
+        count = count_tokens(text)
+        full = tokens + count > max_tokens or stop - start >= max_size
+        # An oversized text still gets a request of its own.
+        if full and stop > start:
+            yield start, stop
+            start = stop
+            tokens = 0
+        tokens += count
+    if start < len(texts):
+        yield start, len(texts)
+
 
 class Embedding(ABC):
+    @property
+    @abstractmethod
+    def model(self) -> str: ...
+
+    @property
+    @abstractmethod
+    def dim(self) -> int: ...
+
     @abstractmethod
     def count_tokens(self, s: str) -> int: ...
 
     @abstractmethod
     def embed(self, s: str) -> list[float]: ...
 
+    def embed_batch(self, texts: list[str]) -> np.ndarray:
+        return np.ascontiguousarray([self.embed(s) for s in texts], dtype=np.float32)
+
+
+class AsyncEmbedding(ABC):
+    @property
+    @abstractmethod
+    def model(self) -> str: ...
+
+    @property
+    @abstractmethod
+    def dim(self) -> int: ...
+
+    @abstractmethod
+    def count_tokens(self, s: str) -> int: ...
+
+    @abstractmethod
+    async def embed(self, s: str) -> list[float]: ...
+
+    @abstractmethod
+    async def embed_batch(self, texts: list[str]) -> np.ndarray: ...
+
+
+class SyncEmbeddingAdapter(Embedding):
+    _embedding: AsyncEmbedding
+    _loop: EventLoopThread
+
+    def __init__(self, embedding: AsyncEmbedding, loop: EventLoopThread | None = None):
+        self._embedding = embedding
+        self._loop = loop or background_loop()
+
+    @property
+    def model(self) -> str:
+        return self._embedding.model
+
+    @property
+    def dim(self) -> int:
+        return self._embedding.dim
+
+    def count_tokens(self, s: str) -> int:
+        return self._embedding.count_tokens(s)
+
+    def embed(self, s: str) -> list[float]:
+        return self._loop.run(self._embedding.embed(s))
+
+    def embed_batch(self, texts: list[str]) -> np.ndarray:
+        return self._loop.run(self._embedding.embed_batch(texts))
+
 
 class SafeEmbeddingDecorator(Embedding):
     _embedding: Embedding
@@ -20,6 +118,14 @@ class SafeEmbeddingDecorator(Embedding):
         self._embedding = embedding
         self._limit = limit
 
+    @property
+    def model(self) -> str:
+        return self._embedding.model
+
+    @property
+    def dim(self) -> int:
+        return self._embedding.dim
+
     def count_tokens(self, s: str) -> int:
         return self._embedding.count_tokens(s)
 
@@ -28,19 +134,315 @@ class SafeEmbeddingDecorator(Embedding):
             raise ValueError("Token limit exceeded")
         return self._embedding.embed(s)
 
+    def embed_batch(self, texts: list[str]) -> np.ndarray:
+        if any(self.count_tokens(s) > self._limit for s in texts):
+            raise ValueError("Token limit exceeded")
+        return self._embedding.embed_batch(texts)
+
+
+class CachedEmbeddingDecorator(Embedding):
+    _embedding: Embedding
+    _memory: LRUCache
+    _store: SQLiteStore | None
+    _table_name: str = "embeddings"
+    hits: int
+    misses: int
+
+    def __init__(
+        self, embedding: Embedding, path: str | None = None, capacity: int = 10_000
+    ):
+        self._embedding = embedding
+        self._memory = LRUCache(capacity)
+        self._store = None if path is None else SQLiteStore(path, self._table_name)
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def model(self) -> str:
+        return self._embedding.model
+
+    @property
+    def dim(self) -> int:
+        return self._embedding.dim
+
+    def count_tokens(self, s: str) -> int:
+        return self._embedding.count_tokens(s)
+
+    def embed(self, s: str) -> list[float]:
+        return self.embed_batch([s])[0].tolist()
+
+    def embed_batch(self, texts: list[str]) -> np.ndarray:
+        result = np.empty((len(texts), self.dim), dtype=np.float32)
+        missing: dict[str, list[int]] = {}
+        for i, text in enumerate(texts):
+            key = self._key(text)
+            v = self._memory.get(key)
+            if v is None:
+                missing.setdefault(key, []).append(i)
+            else:
+                result[i] = v
+                self.hits += 1
+
+        if missing and self._store is not None:
+            for key, value in self._store.get_many(list(missing)).items():
+                v = np.frombuffer(value, dtype=np.float32)
+                self._memory.put(key, v)
+                positions = missing.pop(key)
+                result[positions] = v
+                self.hits += len(positions)
+
+        if missing:
+            keys = list(missing)
+            vectors = self._embedding.embed_batch([texts[missing[k][0]] for k in keys])
+            for key, v in zip(keys, vectors, strict=True):
+                self._memory.put(key, v.copy())
+                result[missing[key]] = v
+                self.misses += 1
+                self.hits += len(missing[key]) - 1
+            if self._store is not None:
+                self._store.put_many(
+                    (key, v.tobytes()) for key, v in zip(keys, vectors, strict=True)
+                )
+
+        return result
+
+    def _key(self, text: str) -> str:
+        digest = hashlib.sha256(text.encode()).hexdigest()
+        return f"{self.model}:{self.dim}:{digest}"
+
+
+class TracingEmbeddingDecorator(Embedding):
+    _embedding: Embedding
+    _tracer: Tracer
+
+    def __init__(self, embedding: Embedding, tracer: Tracer):
+        self._embedding = embedding
+        self._tracer = tracer
+
+    @property
+    def model(self) -> str:
+        return self._embedding.model
+
+    @property
+    def dim(self) -> int:
+        return self._embedding.dim
+
+    def count_tokens(self, s: str) -> int:
+        return self._embedding.count_tokens(s)
+
+    def embed(self, s: str) -> list[float]:
+        if not self._tracer.enabled:
+            return self._embedding.embed(s)
+        hits = getattr(self._embedding, "hits", None)
+        with self._tracer.span(
+            "embedding.embed", model=self.model, tokens=self.count_tokens(s)
+        ) as attributes:
+            v = self._embedding.embed(s)
+            if hits is not None:
+                attributes["cache_hit"] = self._embedding.hits > hits
+        return v
+
+    def embed_batch(self, texts: list[str]) -> np.ndarray:
+        if not self._tracer.enabled:
+            return self._embedding.embed_batch(texts)
+        hits = getattr(self._embedding, "hits", None)
+        with self._tracer.span(
+            "embedding.embed_batch",
+            model=self.model,
+            texts=len(texts),
+            tokens=sum(map(self.count_tokens, texts)),
+        ) as attributes:
+            vectors = self._embedding.embed_batch(texts)
+            if hits is not None:
+                attributes["cache_hits"] = self._embedding.hits - hits
+        return vectors
+
+
+class BatchingEmbeddingDecorator(Embedding):
+    # Coalesces concurrent embed() calls into one embed_batch() request. The
+    # first caller of a batch waits up to window seconds for others to join,
+    # or until max_batch texts are queued, then sends the batch and hands
+    # every caller its vector. Several batches may be in flight at once.
+    _embedding: Embedding
+    _window: float
+    _max_batch: int
+    _pending: list[tuple[str, float, Future]]
+    _condition: threading.Condition
+    batch_sizes: deque[int]
+    queue_delays: deque[float]
+
+    def __init__(
+        self,
+        embedding: Embedding,
+        window: float = 0.005,
+        max_batch: int = 64,
+        capacity: int = 10_000,
+    ):
+        self._embedding = embedding
+        self._window = window
+        self._max_batch = max_batch
+        self._pending = []
+        self._condition = threading.Condition()
+        self.batch_sizes = deque(maxlen=capacity)
+        self.queue_delays = deque(maxlen=capacity)
+
+    @property
+    def model(self) -> str:
+        return self._embedding.model
+
+    @property
+    def dim(self) -> int:
+        return self._embedding.dim
+
+    def count_tokens(self, s: str) -> int:
+        return self._embedding.count_tokens(s)
+
+    def embed(self, s: str) -> list[float]:
+        return self._submit(s).tolist()
+
+    def embed_batch(self, texts: list[str]) -> np.ndarray:
+        # A single text, as sent by CachedEmbeddingDecorator.embed, is
+        # coalesced too; larger batches go straight through.
+        if len(texts) == 1:
+            return self._submit(texts[0])[None]
+        return self._embedding.embed_batch(texts)
+
+    def stats(self) -> dict[str, float]:
+        # Over the last capacity batches and queued calls.
+        with self._condition:
+            sizes = list(self.batch_sizes)
+            delays = list(self.queue_delays)
+        if not sizes:
+            return {"batches": 0, "requests": 0}
+        p50, p90, p99 = np.percentile(delays, [50, 90, 99])
+        return {
+            "batches": len(sizes),
+            "requests": sum(sizes),
+            "mean_batch_size": float(np.mean(sizes)),
+            "max_batch_size": max(sizes),
+            "queue_delay_mean": float(np.mean(delays)),
+            "queue_delay_p50": float(p50),
+            "queue_delay_p90": float(p90),
+            "queue_delay_p99": float(p99),
+        }
+
+    def _submit(self, s: str) -> np.ndarray:
+        future = Future()
+        with self._condition:
+            batch = self._pending
+            batch.append((s, time.perf_counter(), future))
+            leader = len(batch) == 1
+            if len(batch) >= self._max_batch:
+                # Full: later calls start a new batch, and the leader sends
+                # this one without waiting out the window.
+                self._pending = []
+                self._condition.notify_all()
+            if leader:
+                self._condition.wait_for(
+                    lambda: self._pending is not batch, timeout=self._window
+                )
+                if self._pending is batch:
+                    self._pending = []
+        if leader:
+            self._send(batch)
+        return future.result()
+
+    def _send(self, batch: list[tuple[str, float, Future]]) -> None:
+        sent = time.perf_counter()
+        with self._condition:
+            self.batch_sizes.append(len(batch))
+            self.queue_delays.extend(sent - queued for _, queued, _ in batch)
+        error: BaseException | None = None
+        try:
+            vectors = self._embedding.embed_batch([s for s, _, _ in batch])
+            for (_, _, future), v in zip(batch, vectors, strict=True):
+                future.set_result(v)
+        except BaseException as err:
+            error = err
+            if not isinstance(err, Exception):
+                raise
+        finally:
+            # Every caller is released, whatever interrupted the batch.
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(
+                        error or RuntimeError("Embedding batch was not sent")
+                    )
+
+
+@lru_cache(maxsize=1 << 16)
+def _hash_word(word: str) -> int:
+    digest = hashlib.blake2b(word.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+class HashEmbedding(Embedding):
+    # A deterministic offline stand-in for benchmarks and tests. Words are
+    # hashed into signed buckets, so texts sharing words get similar
+    # vectors. latency is paid once per call, like a network round trip.
+    _dim: int
+    latency: float
+    _word = re.compile(r"\w+")
+
+    def __init__(self, dim: int = 100, latency: float = 0.0):
+        self._dim = dim
+        self.latency = latency
+
+    @property
+    def model(self) -> str:
+        return "hash"
+
+    @property
+    def dim(self) -> int:
+        return self._dim
+
+    def count_tokens(self, s: str) -> int:
+        return len(self._word.findall(s))
+
+    def embed(self, s: str) -> list[float]:
+        return self.embed_batch([s])[0].tolist()
+
+    def embed_batch(self, texts: list[str]) -> np.ndarray:
+        time.sleep(self.latency)
+        vectors = np.zeros((len(texts), self._dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in self._word.findall(text.lower()):
+                h = _hash_word(word)
+                vectors[i, h % self._dim] += 1.0 if h >> 63 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-6)
+
 
 class OpenAIEmbedding(Embedding):
     _model: str
     _dim: int
     _client: OpenAI
     _encoding: Encoding
+    _batch_tokens: int
+    _batch_size: int
 
-    def __init__(self, model: str, dim: int = 100):
+    def __init__(
+        self,
+        model: str,
+        dim: int = 100,
+        batch_tokens: int = 250_000,
+        batch_size: int = 2048,
+    ):
         self._model = model
         self._dim = dim
+        self._batch_tokens = batch_tokens
+        self._batch_size = batch_size
         self._encoding = encoding_for_model(self._model)
         self._client = OpenAI()
 
+    @property
+    def model(self) -> str:
+        return self._model
+
+    @property
+    def dim(self) -> int:
+        return self._dim
+
     def count_tokens(self, s: str) -> int:
         return len(self._encoding.encode(s))
 
@@ -49,3 +451,88 @@ class OpenAIEmbedding(Embedding):
             model=self._model, input=s, dimensions=self._dim
         )
         return response.data[0].embedding
+
+    def embed_batch(self, texts: list[str]) -> np.ndarray:
+        result = np.empty((len(texts), self._dim), dtype=np.float32)
+        for start, stop in pack_batches(
+            texts, self.count_tokens, self._batch_tokens, self._batch_size
+        ):
+            response = self._client.embeddings.create(
+                model=self._model, input=texts[start:stop], dimensions=self._dim
+            )
+            for item in response.data:
+                result[start + item.index] = item.embedding
+        return result
+
+
+class AsyncOpenAIEmbedding(AsyncEmbedding):
+    _model: str
+    _dim: int
+    _client: AsyncOpenAI
+    _semaphore: asyncio.Semaphore
+    _retries: int
+    _backoff: float
+    _batch_tokens: int
+    _batch_size: int
+
+    def __init__(
+        self,
+        model: str,
+        dim: int = 100,
+        client: AsyncOpenAI | None = None,
+        max_concurrency: int = 8,
+        retries: int = 3,
+        backoff: float = 0.5,
+        batch_tokens: int = 250_000,
+        batch_size: int = 2048,
+    ):
+        self._model = model
+        self._dim = dim
+        self._client = client or shared_async_client()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._retries = retries
+        self._backoff = backoff
+        self._batch_tokens = batch_tokens
+        self._batch_size = batch_size
+
+    @cached_property
+    def _encoding(self) -> Encoding:
+        return encoding_for_model(self._model)
+
+    @property
+    def model(self) -> str:
+        return self._model
+
+    @property
+    def dim(self) -> int:
+        return self._dim
+
+    def count_tokens(self, s: str) -> int:
+        return len(self._encoding.encode(s))
+
+    async def embed(self, s: str) -> list[float]:
+        response = await self._create(s)
+        return response.data[0].embedding
+
+    async def embed_batch(self, texts: list[str]) -> np.ndarray:
+        result = np.empty((len(texts), self._dim), dtype=np.float32)
+        batches = list(
+            pack_batches(texts, self.count_tokens, self._batch_tokens, self._batch_size)
+        )
+        responses = await asyncio.gather(
+            *[self._create(texts[start:stop]) for start, stop in batches]
+        )
+        for (start, _), response in zip(batches, responses, strict=True):
+            for item in response.data:
+                result[start + item.index] = item.embedding
+        return result
+
+    async def _create(self, texts: str | list[str]):
+        async with self._semaphore:
+            return await with_retries(
+                lambda: self._client.embeddings.create(
+                    model=self._model, input=texts, dimensions=self._dim
+                ),
+                self._retries,
+                self._backoff,
+            )
@@ -0,0 +1,151 @@
+import os
+
+import numpy as np
+
+from rag_assistant.retrieval.kmeans import assign, kmeans
+from rag_assistant.retrieval.vector_index import (
+    Filter,
+    NumpyVectorIndex,
+    grow,
+    save_array,
+    top_k,
+)
+
+
+class IVFVectorIndex(NumpyVectorIndex):
+    _nlist: int
+    _train_size: int = 50_000
+    _centroids: np.ndarray | None
+    _assignments: np.ndarray
+    _lists: tuple[np.ndarray, np.ndarray] | None
+    nprobe: int
+
+    def __init__(
+        self,
+        dim,
+        nlist=100,
+        nprobe=8,
+        capacity=1024,
+        dtype=np.float32,
+        train_size=_train_size,
+    ):
+        super().__init__(dim, capacity, dtype)
+        self._nlist = nlist
+        self._train_size = train_size
+        self._centroids = None
+        self._assignments = np.empty(capacity, dtype=np.int32)
+        self._lists = None
+        self.nprobe = nprobe
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, nprobe: int = 8) -> "IVFVectorIndex":
+        index = super().load(path, mmap)
+        index._centroids = None
+        index._assignments = np.empty(0, dtype=np.int32)
+        centroids = os.path.join(path, "centroids.npy")
+        # Indexes saved before training have no lists yet.
+        if os.path.exists(centroids):
+            index._centroids = np.load(centroids)
+            index._assignments = np.load(os.path.join(path, "assignments.npy"))
+            index._nlist = len(index._centroids)
+        else:
+            index._nlist = int(np.load(os.path.join(path, "nlist.npy")))
+        index._lists = None
+        index.nprobe = nprobe
+        return index
+
+    def save(self, path: str) -> None:
+        super().save(path)
+        save_array(path, "nlist.npy", np.array(self._nlist))
+        if self.trained:
+            save_array(path, "centroids.npy", self._centroids)
+            save_array(path, "assignments.npy", self._assignments[: self._size])
+            return
+        for name in ("centroids.npy", "assignments.npy"):
+            if os.path.exists(os.path.join(path, name)):
+                os.remove(os.path.join(path, name))
+
+    @property
+    def trained(self) -> bool:
+        return self._centroids is not None
+
+    def train(self) -> None:
+        if self.trained:
+            return
+        vectors = self._vectors[: self._size]
+        if len(vectors) > self._train_size:
+            rng = np.random.default_rng(0)
+            sample = rng.choice(len(vectors), size=self._train_size, replace=False)
+            vectors = vectors[np.sort(sample)]
+        self._centroids = kmeans(vectors, self._nlist, spherical=True)
+        self._assign(0)
+
+    def insert_array(
+        self,
+        documents: list[str],
+        vectors: np.ndarray,
+        categories: list[str] | None = None,
+        prices: list[float] | np.ndarray | None = None,
+        ids: list[int] | None = None,
+        hashes: list[str] | None = None,
+    ) -> None:
+        start = self._size
+        super().insert_array(documents, vectors, categories, prices, ids, hashes)
+        if self.trained:
+            self._assign(start)
+        elif self._size >= max(self._train_size, self._nlist):
+            self.train()
+
+    def compact(self) -> np.ndarray:
+        rows = super().compact()
+        if self.trained:
+            self._assignments = self._assignments[rows]
+            self._lists = None
+        return rows
+
+    def search(self, v: np.ndarray, k: int, where: Filter | None = None) -> list[str]:
+        # Searches never train, so they stay read-only; until train() is
+        # called or train_size rows are inserted, they are exact.
+        if not self.trained:
+            return super().search(v, k, where)
+        v = np.asarray(v, dtype=np.float32)
+        rows = self._probe(v)
+        available = self._size
+        if where is not None or self.deleted:
+            candidates = self._attributes.candidates(where or Filter())
+            rows = np.intersect1d(rows, candidates, assume_unique=True)
+            available = len(candidates)
+        # The probed lists can hold fewer than k matches, e.g. under a
+        # selective filter; exact search then scans all of them.
+        if len(rows) < min(k, available):
+            return super().search(v, k, where)
+        vectors = self._vectors[rows].astype(np.float32, copy=False)
+        similarity = vectors @ v
+        return [self._documents[i] for i in rows[top_k(similarity, k)]]
+
+    def search_batch(self, Q: np.ndarray, k: int) -> list[list[str]]:
+        if not self.trained:
+            return super().search_batch(Q, k)
+        return [self.search(v, k) for v in Q]
+
+    def _assign(self, start: int) -> None:
+        vectors = self._vectors[start : self._size].astype(np.float32, copy=False)
+        self._assignments = grow(self._assignments, self._size)
+        self._assignments[start : self._size] = assign(vectors, self._centroids)
+        self._lists = None
+
+    def _probe(self, v: np.ndarray) -> np.ndarray:
+        # Concurrent searches may build the lists at once, so rows and
+        # offsets are published together.
+        lists = self._lists
+        if lists is None:
+            assignments = self._assignments[: self._size]
+            counts = np.bincount(assignments, minlength=self._nlist)
+            offsets = np.concatenate(([0], np.cumsum(counts)))
+            lists = np.argsort(assignments, kind="stable"), offsets
+            self._lists = lists
+        list_rows, offsets = lists
+        probes = top_k(self._centroids @ v, self.nprobe)
+        rows = [list_rows[offsets[p] : offsets[p + 1]] for p in probes]
+        # Sorted rows keep ties in insertion order, as in the exact index.
+        return np.sort(np.concatenate(rows))
@@ -0,0 +1,40 @@
+import numpy as np
+
+
+def assign(data: np.ndarray, centroids: np.ndarray, block_size: int = 1 << 22):
+    # argmin |x - c|^2 == argmax (x.c - |c|^2 / 2), computed a block at a time.
+    half_norms = 0.5 * np.einsum("ij,ij->i", centroids, centroids)
+    labels = np.empty(len(data), dtype=np.int32)
+    step = max(1, block_size // max(len(centroids), 1))
+    for start in range(0, len(data), step):
+        scores = data[start : start + step] @ centroids.T - half_norms
+        labels[start : start + step] = np.argmax(scores, axis=1)
+    return labels
+
+
+def kmeans(
+    data: np.ndarray,
+    k: int,
+    iterations: int = 20,
+    spherical: bool = False,
+    seed: int = 0,
+) -> np.ndarray:
+    data = np.asarray(data, dtype=np.float32)
+    if len(data) < k:
+        raise ValueError(f"Need at least {k} points to train {k} centroids")
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = assign(data, centroids)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.stack(
+            [np.bincount(labels, weights=column, minlength=k) for column in data.T],
+            axis=1,
+        )
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, np.newaxis]
+        # Re-seed empty clusters from random points instead of dropping them.
+        centroids[empty] = data[rng.choice(len(data), size=empty.sum())]
+        if spherical:
+            centroids /= np.linalg.norm(centroids, axis=1, keepdims=True) + 1e-6
+    return centroids
@@ -0,0 +1,263 @@
+import os
+
+import numpy as np
+
+from rag_assistant.retrieval.kmeans import assign, kmeans
+from rag_assistant.retrieval.vector_index import (
+    DocumentStore,
+    Filter,
+    VectorIndex,
+    grow,
+    normalize,
+    save_array,
+    top_k,
+)
+
+
+class ProductQuantizer:
+    _dim: int
+    _m: int
+    _dsub: int
+    _ksub: int
+    _codebooks: np.ndarray | None
+
+    def __init__(self, dim: int, m: int, nbits: int = 8):
+        if not 1 <= nbits <= 8:
+            raise ValueError("nbits must be between 1 and 8")
+        self._dim = dim
+        self._m = m
+        self._dsub = -(-dim // m)
+        self._ksub = 1 << nbits
+        self._codebooks = None
+
+    @property
+    def trained(self) -> bool:
+        return self._codebooks is not None
+
+    @property
+    def code_size(self) -> int:
+        return self._m
+
+    @property
+    def ksub(self) -> int:
+        return self._ksub
+
+    def train(self, data: np.ndarray) -> None:
+        subvectors = self._split(data)
+        self._codebooks = np.stack(
+            [kmeans(subvectors[:, j], self._ksub, seed=j) for j in range(self._m)]
+        )
+
+    def encode(self, data: np.ndarray) -> np.ndarray:
+        subvectors = self._split(data)
+        codes = np.empty((len(data), self._m), dtype=np.uint8)
+        for j in range(self._m):
+            codes[:, j] = assign(subvectors[:, j], self._codebooks[j])
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        subvectors = self._codebooks[np.arange(self._m), codes]
+        return subvectors.reshape(len(codes), -1)[:, : self._dim]
+
+    def lookup_table(self, q: np.ndarray) -> np.ndarray:
+        # Inner products of every query sub-vector with every sub-centroid.
+        subvectors = self._split(q[np.newaxis])[0]
+        return np.einsum("mkd,md->mk", self._codebooks, subvectors)
+
+    def scores(self, codes: np.ndarray, table: np.ndarray) -> np.ndarray:
+        similarity = np.zeros(len(codes), dtype=np.float32)
+        for j in range(self._m):
+            similarity += table[j].take(codes[:, j])
+        return similarity
+
+    def _split(self, data: np.ndarray) -> np.ndarray:
+        data = np.asarray(data, dtype=np.float32)
+        padding = self._m * self._dsub - self._dim
+        if padding:
+            data = np.pad(data, ((0, 0), (0, padding)))
+        return data.reshape(len(data), self._m, self._dsub)
+
+
+class PQVectorIndex(VectorIndex):
+    _dim: int
+    _quantizer: ProductQuantizer
+    _codes: np.ndarray
+    _vectors: np.ndarray | None
+    _documents: DocumentStore
+    _size: int
+    _train_size: int = 16_384
+    _block_size: int = 1 << 16
+    rerank: int
+
+    def __init__(
+        self,
+        dim,
+        m=10,
+        nbits=8,
+        rerank=0,
+        capacity=1024,
+        train_size=_train_size,
+    ):
+        self._dim = dim
+        self._quantizer = ProductQuantizer(dim, m, nbits)
+        self._codes = np.empty((capacity, m), dtype=np.uint8)
+        self._vectors = np.empty((capacity, dim), dtype=np.float32)
+        self._documents = DocumentStore(capacity)
+        self._size = 0
+        self._train_size = train_size
+        self.rerank = rerank
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, rerank: int = 0) -> "PQVectorIndex":
+        mmap_mode = "r" if mmap else None
+        vectors = os.path.join(path, "vectors.npy")
+        codebooks = os.path.join(path, "codebooks.npy")
+        # Indexes saved before training keep only their full vectors.
+        trained = os.path.exists(codebooks)
+        if (rerank or not trained) and not os.path.exists(vectors):
+            raise ValueError("Re-ranking needs an index saved with full vectors")
+        index = cls.__new__(cls)
+        index._dim = int(np.load(os.path.join(path, "dim.npy")))
+        if trained:
+            codebooks = np.load(codebooks)
+            m, ksub, _ = codebooks.shape
+            index._quantizer = ProductQuantizer(index._dim, m, ksub.bit_length() - 1)
+            index._quantizer._codebooks = codebooks
+            index._codes = np.load(os.path.join(path, "codes.npy"), mmap_mode)
+        else:
+            m, ksub = np.load(os.path.join(path, "quantizer.npy")).tolist()
+            index._quantizer = ProductQuantizer(index._dim, m, ksub.bit_length() - 1)
+            index._codes = np.empty((0, m), dtype=np.uint8)
+        keep = rerank or not trained
+        index._vectors = np.load(vectors, mmap_mode) if keep else None
+        index._documents = DocumentStore.load(path, mmap)
+        index._size = len(index._documents)
+        index.rerank = rerank
+        return index
+
+    def save(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        quantizer = np.array([self._quantizer.code_size, self._quantizer.ksub])
+        arrays = {"dim.npy": np.array(self._dim), "quantizer.npy": quantizer}
+        if self.trained:
+            arrays["codebooks.npy"] = self._quantizer._codebooks
+            arrays["codes.npy"] = self._codes[: self._size]
+        if self._vectors is not None:
+            arrays["vectors.npy"] = self._vectors[: self._size]
+        # Files of an earlier save that this state does not have.
+        for name in ("codebooks.npy", "codes.npy", "vectors.npy"):
+            if name not in arrays and os.path.exists(os.path.join(path, name)):
+                os.remove(os.path.join(path, name))
+        for name, array in arrays.items():
+            save_array(path, name, array)
+        self._documents.save(path)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def trained(self) -> bool:
+        return self._quantizer.trained
+
+    @property
+    def nbytes(self) -> int:
+        vectors = 0 if self._vectors is None else self._vectors[: self._size].nbytes
+        return self._codes[: self._size].nbytes + vectors
+
+    def train(self) -> None:
+        if self.trained:
+            return
+        vectors = self._vectors[: self._size]
+        if len(vectors) > self._train_size:
+            rng = np.random.default_rng(0)
+            sample = rng.choice(len(vectors), size=self._train_size, replace=False)
+            vectors = vectors[np.sort(sample)]
+        self._quantizer.train(vectors)
+        self._codes = grow(self._codes, self._size)
+        self._codes[: self._size] = self._quantizer.encode(self._vectors[: self._size])
+        if not self.rerank:
+            self._vectors = None
+
+    def insert(self, data: list[tuple[str, np.ndarray]]) -> None:
+        if not data:
+            return
+        documents, vectors = zip(*data, strict=True)
+        self.insert_array(list(documents), np.stack(vectors))
+
+    def insert_array(
+        self,
+        documents: list[str],
+        vectors: np.ndarray,
+        categories: list[str] | None = None,
+        prices: list[float] | np.ndarray | None = None,
+        ids: list[int] | None = None,
+        hashes: list[str] | None = None,
+    ) -> None:
+        if any(a is not None for a in (categories, prices, ids, hashes)):
+            raise ValueError(f"{type(self).__name__} does not store attributes")
+        if not documents:
+            return
+        vectors = np.asarray(vectors)
+        if vectors.shape != (len(documents), self._dim):
+            raise ValueError(
+                f"Expected vectors of shape {(len(documents), self._dim)}, "
+                f"got {vectors.shape}"
+            )
+        vectors = normalize(vectors.astype(np.float32))
+        size = self._size + len(documents)
+        if self.trained:
+            self._codes = grow(self._codes, size)
+            self._codes[self._size : size] = self._quantizer.encode(vectors)
+        if self._vectors is not None:
+            self._vectors = grow(self._vectors, size)
+            self._vectors[self._size : size] = vectors
+        self._documents.extend(documents)
+        self._size = size
+        self._version += 1
+        if not self.trained and size >= max(self._train_size, self._quantizer.ksub):
+            self.train()
+
+    def search(self, v: np.ndarray, k: int, where: Filter | None = None) -> list[str]:
+        return [self._documents[i] for i, _ in self._search(v, k, where)]
+
+    def search_with_scores(
+        self, v: np.ndarray, k: int, where: Filter | None = None
+    ) -> list[tuple[str, float]]:
+        # Rows are normalized; scale by the query norm to get cosines.
+        norm = np.linalg.norm(v) + 1e-6
+        return [
+            (self._documents[i], score / norm) for i, score in self._search(v, k, where)
+        ]
+
+    def _search(
+        self, v: np.ndarray, k: int, where: Filter | None
+    ) -> list[tuple[int, float]]:
+        if where is not None:
+            raise ValueError(f"{type(self).__name__} does not support filters")
+        v = np.asarray(v, dtype=np.float32)
+        # Searches never train, so they stay read-only; until train() is
+        # called or train_size rows are inserted, they are exact.
+        if not self.trained:
+            similarity = self._vectors[: self._size] @ v
+            return self._ranked(np.arange(self._size), similarity, k)
+
+        table = self._quantizer.lookup_table(v)
+        similarity = np.empty(self._size, dtype=np.float32)
+        for start in range(0, self._size, self._block_size):
+            stop = min(start + self._block_size, self._size)
+            codes = self._codes[start:stop]
+            similarity[start:stop] = self._quantizer.scores(codes, table)
+
+        if not self.rerank:
+            return self._ranked(np.arange(self._size), similarity, k)
+        # Re-score a shortlist with the full vectors; sorted rows keep ties
+        # in insertion order.
+        shortlist = np.sort(top_k(similarity, max(k, self.rerank)))
+        return self._ranked(shortlist, self._vectors[shortlist] @ v, k)
+
+    @staticmethod
+    def _ranked(
+        rows: np.ndarray, similarity: np.ndarray, k: int
+    ) -> list[tuple[int, float]]:
+        best = top_k(similarity, k)
+        return list(zip(rows[best].tolist(), similarity[best].tolist(), strict=True))
@@ -0,0 +1,103 @@
+from abc import ABC, abstractmethod
+from collections import defaultdict
+
+from rag_assistant.locks import ReadWriteLock
+from rag_assistant.retrieval.bm25 import BM25Index
+from rag_assistant.retrieval.embedding import Embedding
+from rag_assistant.retrieval.vector_index import Filter, VectorIndex
+
+
+class Retriever(ABC):
+    @abstractmethod
+    def search(self, query: str, k: int, where: Filter | None = None) -> list[str]: ...
+
+
+def reciprocal_rank_fusion(
+    rankings: list[list[str]], k: int, constant: int = 60
+) -> list[str]:
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, document in enumerate(ranking):
+            scores[document] += 1 / (constant + rank + 1)
+    # Python's sort is stable, so ties keep the order of first appearance.
+    return sorted(scores, key=scores.__getitem__, reverse=True)[:k]
+
+
+class VectorRetriever(Retriever):
+    _embedding: Embedding
+    _vector_index: VectorIndex
+
+    def __init__(self, embedding: Embedding, vector_index: VectorIndex):
+        self._embedding = embedding
+        self._vector_index = vector_index
+
+    def search(self, query: str, k: int, where: Filter | None = None) -> list[str]:
+        return self._vector_index.search(self._embedding.embed(query), k, where)
+
+
+class HybridRetriever(Retriever):
+    _lexical_index: BM25Index
+    _embedding: Embedding
+    _vector_index: VectorIndex
+    _candidates: int
+    _constant: int
+    _lexical_threshold: float | None
+    lexical_only: int
+
+    def __init__(
+        self,
+        lexical_index: BM25Index,
+        embedding: Embedding,
+        vector_index: VectorIndex,
+        candidates: int = 20,
+        constant: int = 60,
+        lexical_threshold: float | None = 1.0,
+    ):
+        self._lexical_index = lexical_index
+        self._embedding = embedding
+        self._vector_index = vector_index
+        self._candidates = candidates
+        self._constant = constant
+        self._lexical_threshold = lexical_threshold
+        self.lexical_only = 0
+
+    def search(self, query: str, k: int, where: Filter | None = None) -> list[str]:
+        candidates = max(k, self._candidates)
+        lexical = self._lexical_index.search_with_scores(
+            query, candidates, normalized=True, where=where
+        )
+        # A query whose every term matches the best document at least as well
+        # as a single occurrence in an average document (e.g. an exact product
+        # title) is answered without embedding it.
+        if (
+            self._lexical_threshold is not None
+            and len(lexical) >= k
+            and lexical[0][1] >= self._lexical_threshold
+        ):
+            self.lexical_only += 1
+            return [document for document, _ in lexical[:k]]
+        vector = self._vector_index.search(
+            self._embedding.embed(query), candidates, where
+        )
+        return reciprocal_rank_fusion(
+            [[document for document, _ in lexical], vector], k, self._constant
+        )
+
+
+class LockedRetriever(Retriever):
+    # Searches share the lock's read side; whoever updates the underlying
+    # indexes holds its write side.
+    _retriever: Retriever
+    _lock: ReadWriteLock
+
+    def __init__(self, retriever: Retriever, lock: ReadWriteLock):
+        self._retriever = retriever
+        self._lock = lock
+
+    def search(self, query: str, k: int, where: Filter | None = None) -> list[str]:
+        with self._lock.read():
+            return self._retriever.search(query, k, where)
+
+    def replace(self, retriever: Retriever) -> None:
+        with self._lock.write():
+            self._retriever = retriever
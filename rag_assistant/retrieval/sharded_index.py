@@ -0,0 +1,225 @@
+import multiprocessing
+import os
+import threading
+import weakref
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import suppress
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from rag_assistant.retrieval.vector_index import (
+    Filter,
+    NumpyVectorIndex,
+    dot_similarity,
+    near_top_k,
+    score_tolerance,
+)
+
+
+def _shard_top_k(
+    vectors: np.ndarray,
+    start: int,
+    v: np.ndarray,
+    k: int,
+    dead: np.ndarray,
+    block_size: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    # Global rows of one shard that may be in the top k, and their scores.
+    # The merged candidates are rescored exactly, as in a single-shard search.
+    scores = dot_similarity(vectors, v[np.newaxis], block_size)[0]
+    scores[dead] = -np.inf
+    rows = near_top_k(scores, k, score_tolerance(v))
+    return rows + start, scores[rows]
+
+
+# Worker processes keep the most recently used block attached.
+_attached: dict[str, SharedMemory] = {}
+
+
+def _shared_shard_top_k(
+    name: str,
+    shape: tuple[int, int],
+    dtype: str,
+    start: int,
+    stop: int,
+    v: np.ndarray,
+    k: int,
+    dead: np.ndarray,
+    block_size: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    if name not in _attached:
+        for shm in _attached.values():
+            shm.close()
+        _attached.clear()
+        # Pool workers share the parent's resource tracker, so attaching
+        # does not make them owners of the block.
+        _attached[name] = SharedMemory(name)
+    vectors = np.ndarray(shape, dtype=dtype, buffer=_attached[name].buf)
+    return _shard_top_k(vectors[start:stop], start, v, k, dead, block_size)
+
+
+def _release(shm: SharedMemory | None, pool: Executor | None) -> None:
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+    if shm is not None:
+        shm.unlink()
+        # Arrays still viewing the block keep it mapped until they are freed.
+        with suppress(BufferError):
+            shm.close()
+
+
+class ShardedVectorIndex(NumpyVectorIndex):
+    # Exact search split across row-range shards of one shared-memory block,
+    # scored in parallel by a thread or process pool and merged into the
+    # same results as NumpyVectorIndex. The block is built, under a lock, by
+    # the first search after an insert or compaction and becomes the index's
+    # storage, so rows are not held twice. Like NumpyVectorIndex, searches may
+    # run concurrently with each other but not with inserts. Filtered
+    # searches, indexes that are mostly deleted and small indexes use the
+    # single-shard search.
+    _shards: int
+    _processes: bool
+    _min_shard_rows: int = 50_000
+    _shm: SharedMemory | None
+    _shared: np.ndarray | None
+    _pool: Executor | None
+    _bounds: list[tuple[int, int]]
+    _finalizer: weakref.finalize | None
+    _share_lock: threading.Lock
+
+    def __init__(
+        self,
+        dim,
+        shards: int | None = None,
+        processes: bool = False,
+        capacity=1024,
+        dtype=np.float32,
+    ):
+        super().__init__(dim, capacity, dtype)
+        self._init_shards(shards, processes)
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        mmap: bool = True,
+        shards: int | None = None,
+        processes: bool = False,
+    ) -> "ShardedVectorIndex":
+        index = super().load(path, mmap)
+        index._init_shards(shards, processes)
+        return index
+
+    def _init_shards(self, shards: int | None, processes: bool) -> None:
+        self._shards = shards or os.cpu_count() or 1
+        self._processes = processes
+        self._shm = None
+        self._shared = None
+        self._pool = None
+        self._bounds = []
+        self._finalizer = None
+        self._share_lock = threading.Lock()
+
+    def close(self) -> None:
+        # Stops the pool and frees the shared block.
+        with self._share_lock:
+            if self._finalizer is not None:
+                self._finalizer()
+                self._finalizer = None
+            self._shm = None
+            self._shared = None
+            self._pool = None
+
+    def _search(
+        self, v: np.ndarray, k: int, where: Filter | None
+    ) -> list[tuple[int, float]]:
+        live = self._size - self.deleted
+        if (
+            where is not None
+            or self._size < self._min_shard_rows
+            or live < self._selectivity * self._size
+        ):
+            return super()._search(v, k, where)
+        shm, vectors, pool, bounds = self._share()
+        dead = None if not self.deleted else ~self._attributes.live
+        if self._processes:
+            futures = [
+                pool.submit(
+                    _shared_shard_top_k,
+                    shm.name,
+                    vectors.shape,
+                    vectors.dtype.str,
+                    start,
+                    stop,
+                    v,
+                    k,
+                    self._dead_rows(dead, start, stop),
+                    self._block_size,
+                )
+                for start, stop in bounds
+            ]
+        else:
+            futures = [
+                pool.submit(
+                    _shard_top_k,
+                    vectors[start:stop],
+                    start,
+                    v,
+                    k,
+                    self._dead_rows(dead, start, stop),
+                    self._block_size,
+                )
+                for start, stop in bounds
+            ]
+        results = [future.result() for future in futures]
+        rows = np.concatenate([rows for rows, _ in results])
+        scores = np.concatenate([scores for _, scores in results])
+        k = min(k, live)
+        return self._exact(v, rows[near_top_k(scores, k, score_tolerance(v))], k)
+
+    @staticmethod
+    def _dead_rows(dead: np.ndarray | None, start: int, stop: int) -> np.ndarray:
+        if dead is None:
+            return np.empty(0, dtype=np.intp)
+        return np.flatnonzero(dead[start:stop])
+
+    def _share(
+        self,
+    ) -> tuple[SharedMemory, np.ndarray, Executor, list[tuple[int, int]]]:
+        # Moves the rows into a fresh shared block unless they are already
+        # in the current one, and returns what a search needs, so a search
+        # never sees a half-built block.
+        with self._share_lock:
+            if self._shm is None or self._vectors is not self._shared:
+                self._build()
+            return self._shm, self._shared, self._pool, self._bounds
+
+    def _build(self) -> None:
+        vectors = self._vectors[: self._size]
+        shm = SharedMemory(create=True, size=max(vectors.nbytes, 1))
+        shared = np.ndarray(vectors.shape, dtype=vectors.dtype, buffer=shm.buf)
+        shared[:] = vectors
+        if self._finalizer is not None:
+            self._finalizer.detach()
+            _release(self._shm, None)
+        pool = self._pool
+        if pool is None:
+            pool = (
+                ProcessPoolExecutor(
+                    self._shards, mp_context=multiprocessing.get_context("spawn")
+                )
+                if self._processes
+                else ThreadPoolExecutor(self._shards)
+            )
+        self._shm = shm
+        self._shared = shared
+        self._vectors = shared
+        self._pool = pool
+        self._finalizer = weakref.finalize(self, _release, shm, pool)
+        bounds = np.linspace(0, self._size, self._shards + 1).astype(int)
+        self._bounds = [
+            (int(start), int(stop))
+            for start, stop in zip(bounds[:-1], bounds[1:], strict=True)
+            if stop > start
+        ]
@@ -0,0 +1,59 @@
+from dataclasses import dataclass
+
+from rag_assistant.database.product_database import ProductDatabase
+from rag_assistant.locks import ReadWriteLock
+from rag_assistant.retrieval.embedding import Embedding
+from rag_assistant.retrieval.vector_index import NumpyVectorIndex
+
+
+@dataclass
+class SyncResult:
+    inserted: int = 0
+    updated: int = 0
+    deleted: int = 0
+
+
+def sync_vector_index(
+    database: ProductDatabase,
+    vector_index: NumpyVectorIndex,
+    embedding: Embedding,
+    batch_size: int = 512,
+    lock: ReadWriteLock | None = None,
+) -> SyncResult:
+    # Only products whose content hash differs from the one they were indexed
+    # with are embedded again. With a lock shared with searches, the index is
+    # only write-locked while it changes, not while embedding. Concurrent
+    # syncs of the same index are not supported.
+    lock = lock or ReadWriteLock()
+    database_hashes = database.fetch_hashes()
+    with lock.read():
+        index_hashes = vector_index.content_hashes()
+    result = SyncResult()
+
+    removed = [i for i in index_hashes if i not in database_hashes]
+    with lock.write():
+        vector_index.delete(removed)
+    result.deleted = len(removed)
+
+    changed = [i for i, h in database_hashes.items() if index_hashes.get(i) != h]
+    for start in range(0, len(changed), batch_size):
+        products = database.fetch_products(changed[start : start + batch_size])
+        vectors = embedding.embed_batch([product.description for product in products])
+        with lock.write():
+            vector_index.insert_array(
+                [str(product) for product in products],
+                vectors,
+                [product.category for product in products],
+                [product.price for product in products],
+                [product.id for product in products],
+                [database_hashes[product.id] for product in products],
+            )
+        result.updated += sum(product.id in index_hashes for product in products)
+        result.inserted += sum(product.id not in index_hashes for product in products)
+
+    # Tombstoned rows still cost a dot product each, so drop them once they
+    # outnumber the live ones.
+    with lock.write():
+        if vector_index.deleted > len(vector_index) - vector_index.deleted:
+            vector_index.compact()
+    return result
@@ -1,13 +1,100 @@
+import os
 from abc import ABC, abstractmethod
+from dataclasses import dataclass
 
 import numpy as np
 
+from rag_assistant.tracing import Tracer
+
+VECTOR_INDEX_ENVIRON = "VECTOR_INDEX_DIR"
+
+
+@dataclass(frozen=True)
+class Filter:
+    category: str | None = None
+    min_price: float | None = None
+    max_price: float | None = None
+
 
 class VectorIndex(ABC):
+    _version: int = 0
+
+    @property
+    def version(self) -> int:
+        return self._version
+
     @abstractmethod
     def insert(self, data: list[tuple[str, np.ndarray]]) -> None: ...
     @abstractmethod
-    def search(self, v: np.ndarray, k: int) -> list[str]: ...
+    def search(
+        self, v: np.ndarray, k: int, where: Filter | None = None
+    ) -> list[str]: ...
+
+    def insert_array(
+        self,
+        documents: list[str],
+        vectors: np.ndarray,
+        categories: list[str] | None = None,
+        prices: list[float] | np.ndarray | None = None,
+        ids: list[int] | None = None,
+        hashes: list[str] | None = None,
+    ) -> None:
+        if any(a is not None for a in (categories, prices, ids, hashes)):
+            raise ValueError(f"{type(self).__name__} does not store attributes")
+        self.insert(list(zip(documents, vectors, strict=True)))
+
+    def search_batch(self, Q: np.ndarray, k: int) -> list[list[str]]:
+        return [self.search(v, k) for v in Q]
+
+    @abstractmethod
+    def search_with_scores(
+        self, v: np.ndarray, k: int, where: Filter | None = None
+    ) -> list[tuple[str, float]]: ...
+
+
+class TracingVectorIndexDecorator(VectorIndex):
+    _vector_index: VectorIndex
+    _tracer: Tracer
+
+    def __init__(self, vector_index: VectorIndex, tracer: Tracer):
+        self._vector_index = vector_index
+        self._tracer = tracer
+
+    @property
+    def version(self) -> int:
+        return self._vector_index.version
+
+    def insert(self, data: list[tuple[str, np.ndarray]]) -> None:
+        with self._tracer.span("index.insert", rows=len(data)):
+            self._vector_index.insert(data)
+
+    def insert_array(
+        self,
+        documents: list[str],
+        vectors: np.ndarray,
+        categories: list[str] | None = None,
+        prices: list[float] | np.ndarray | None = None,
+        ids: list[int] | None = None,
+        hashes: list[str] | None = None,
+    ) -> None:
+        with self._tracer.span("index.insert", rows=len(documents)):
+            self._vector_index.insert_array(
+                documents, vectors, categories, prices, ids, hashes
+            )
+
+    def search(self, v: np.ndarray, k: int, where: Filter | None = None) -> list[str]:
+        with self._tracer.span("index.search", k=k, filtered=where is not None):
+            return self._vector_index.search(v, k, where)
+
+    def search_batch(self, Q: np.ndarray, k: int) -> list[list[str]]:
+        with self._tracer.span("index.search_batch", k=k, queries=len(Q)):
+            return self._vector_index.search_batch(Q, k)
+
+    def search_with_scores(
+        self, v: np.ndarray, k: int, where: Filter | None = None
+    ) -> list[tuple[str, float]]:
+        with self._tracer.span("index.search", k=k, filtered=where is not None):
+            return self._vector_index.search_with_scores(v, k, where)
 
 
 def cosine_similarity(data: np.ndarray, query: np.ndarray) -> np.ndarray:
@@ -19,29 +106,497 @@ def cosine_similarity(data: np.ndarray, query: np.ndarray) -> np.ndarray:
     return similarity
 
 
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    # Same epsilon as cosine_similarity so that scores keep their ordering.
+    epsilon = 1e-6
+    norm = np.linalg.norm(vectors, axis=-1, keepdims=True) + epsilon
+    return vectors / norm
+
+
+def dot_similarity(
+    vectors: np.ndarray, Q: np.ndarray, block_size: int = 1 << 24
+) -> np.ndarray:
+    # Scores of normalized rows against each query in Q.
+    dtype = np.promote_types(vectors.dtype, np.float32)
+    Q = Q.astype(dtype, copy=False)
+    if vectors.dtype == dtype:
+        return Q @ vectors.T
+    # Half precision has no BLAS kernel, so upcast it a slice at a time.
+    similarity = np.empty((len(Q), len(vectors)), dtype=dtype)
+    step = max(1, block_size // max(len(Q), 1))
+    for start in range(0, len(vectors), step):
+        block = vectors[start : start + step].astype(dtype)
+        similarity[:, start : start + step] = Q @ block.T
+    return similarity
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.intp)
+    if k < n:
+        candidates = np.argpartition(scores, n - k)[n - k :]
+        kth = scores[candidates].min()
+        # Ties straddling the partition boundary are resolved below.
+        if np.count_nonzero(scores >= kth) > k:
+            candidates = np.flatnonzero(scores >= kth)
+    else:
+        candidates = np.arange(n)
+    # Highest score first, ties broken by insertion order.
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order[:k]]
+
+
+def near_top_k(scores: np.ndarray, k: int, tolerance: float) -> np.ndarray:
+    # Rows scoring within tolerance of the k-th best score; -inf never counts.
+    rows = top_k(scores, k)
+    if len(rows) == 0:
+        return rows
+    threshold = max(scores[rows[-1]] - tolerance, np.finfo(scores.dtype).min)
+    return np.flatnonzero(scores >= threshold)
+
+
+def exact_top_k(
+    vectors: np.ndarray, v: np.ndarray, rows: np.ndarray, k: int
+) -> tuple[np.ndarray, np.ndarray]:
+    # Matrix products round the same dot product differently depending on
+    # how rows are blocked, so candidates are rescored in float64 one row at
+    # a time, and ties broken by row, for a result that does not depend on
+    # how the rows were scored.
+    scores = (vectors.astype(np.float64) * v.astype(np.float64)).sum(axis=1)
+    order = np.lexsort((rows, -scores))[:k]
+    return rows[order], scores[order]
+
+
+def score_tolerance(v: np.ndarray) -> float:
+    # Well above float32 rounding of a dot product with a normalized row.
+    return 1e-3 * (float(np.linalg.norm(v)) + 1e-6)
+
+
+def top_k_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    b, n = scores.shape
+    k = min(k, n)
+    if k <= 0:
+        return np.empty((b, 0), dtype=np.intp)
+    if k < n:
+        candidates = np.argpartition(scores, n - k, axis=1)[:, n - k :]
+    else:
+        candidates = np.broadcast_to(np.arange(n), (b, n))
+    values = np.take_along_axis(scores, candidates, axis=1)
+    order = np.lexsort((candidates, -values), axis=1)
+    result = np.take_along_axis(candidates, order, axis=1)
+    if k < n:
+        kth = values.min(axis=1, keepdims=True)
+        for i in np.flatnonzero(np.count_nonzero(scores >= kth, axis=1) > k):
+            result[i] = top_k(scores[i], k)
+    return result
+
+
+class DocumentStore:
+    _data: np.ndarray
+    _offsets: np.ndarray
+    _size: int
+
+    def __init__(self, capacity: int = 1024):
+        self._data = np.empty(capacity * 64, dtype=np.uint8)
+        self._offsets = np.zeros(capacity + 1, dtype=np.int64)
+        self._size = 0
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "DocumentStore":
+        mmap_mode = "r" if mmap else None
+        store = cls.__new__(cls)
+        store._data = np.load(os.path.join(path, "documents.npy"), mmap_mode)
+        store._offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode)
+        store._size = len(store._offsets) - 1
+        return store
+
+    def save(self, path: str) -> None:
+        offsets = self._offsets[: self._size + 1]
+        save_array(path, "documents.npy", self._data[: offsets[-1]])
+        save_array(path, "offsets.npy", offsets)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, i: int) -> str:
+        start, stop = self._offsets[i], self._offsets[i + 1]
+        return self._data[start:stop].tobytes().decode()
+
+    def extend(self, documents: list[str]) -> None:
+        if not documents:
+            return
+        encoded = [document.encode() for document in documents]
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+        end = self._offsets[self._size]
+        offsets = end + np.cumsum(lengths)
+        self._offsets = grow(self._offsets, self._size + len(encoded) + 1)
+        self._offsets[self._size + 1 : self._size + len(encoded) + 1] = offsets
+        stop = int(offsets[-1])
+        if stop > end:
+            self._data = grow(self._data, stop)
+            self._data[end:stop] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        self._size += len(encoded)
+
+
+class AttributeStore:
+    # Columnar product attributes. Categories are dictionary-encoded, with -1
+    # for rows inserted without one; missing prices are NaN and so fail every
+    # price predicate. Rows inserted with a product id replace the previous
+    # row of that id, which is tombstoned rather than removed.
+    _categories: list[str]
+    _category_codes: dict[str, int]
+    _codes: np.ndarray
+    _prices: np.ndarray
+    _ids: np.ndarray
+    _hashes: np.ndarray
+    _live: np.ndarray
+    _rows_by_id: dict[int, int]
+    _size: int
+    _deleted: int
+    _category_index: tuple[np.ndarray, np.ndarray] | None
+
+    def __init__(self, capacity: int = 1024):
+        self._categories = []
+        self._category_codes = {}
+        self._codes = np.empty(capacity, dtype=np.int32)
+        self._prices = np.empty(capacity, dtype=np.float32)
+        self._ids = np.empty(capacity, dtype=np.int64)
+        self._hashes = np.empty(capacity, dtype="S64")
+        self._live = np.empty(capacity, dtype=bool)
+        self._rows_by_id = {}
+        self._size = 0
+        self._deleted = 0
+        self._category_index = None
+
+    @classmethod
+    def load(cls, path: str, size: int, mmap: bool = True) -> "AttributeStore":
+        store = cls(0)
+        codes = os.path.join(path, "category_codes.npy")
+        if not os.path.exists(codes):
+            # Indexes saved before attributes existed.
+            store.extend(size)
+            return store
+        mmap_mode = "r" if mmap else None
+        store._categories = np.load(os.path.join(path, "categories.npy")).tolist()
+        store._category_codes = {c: i for i, c in enumerate(store._categories)}
+        store._codes = np.load(codes, mmap_mode)
+        store._prices = np.load(os.path.join(path, "prices.npy"), mmap_mode)
+        if os.path.exists(os.path.join(path, "ids.npy")):
+            # Tombstones are written in place, so these are always in memory.
+            store._ids = np.load(os.path.join(path, "ids.npy"))
+            store._hashes = np.load(os.path.join(path, "hashes.npy"))
+            store._live = np.load(os.path.join(path, "live.npy"))
+        else:
+            # Indexes saved before change tracking: no ids, all rows live.
+            store._ids = np.full(size, -1, dtype=np.int64)
+            store._hashes = np.zeros(size, dtype="S64")
+            store._live = np.ones(size, dtype=bool)
+        store._size = size
+        store._deleted = size - int(np.count_nonzero(store._live))
+        rows = np.flatnonzero(store._live & (store._ids >= 0))
+        store._rows_by_id = dict(
+            zip(store._ids[rows].tolist(), rows.tolist(), strict=False)
+        )
+        return store
+
+    def save(self, path: str) -> None:
+        save_array(path, "categories.npy", np.array(self._categories))
+        save_array(path, "category_codes.npy", self._codes[: self._size])
+        save_array(path, "prices.npy", self._prices[: self._size])
+        save_array(path, "ids.npy", self._ids[: self._size])
+        save_array(path, "hashes.npy", self._hashes[: self._size])
+        save_array(path, "live.npy", self._live[: self._size])
+
+    @property
+    def categories(self) -> list[str]:
+        return list(self._categories)
+
+    @property
+    def deleted(self) -> int:
+        return self._deleted
+
+    @property
+    def live(self) -> np.ndarray:
+        return self._live[: self._size]
+
+    def content_hashes(self) -> dict[int, str]:
+        return {i: self._hashes[row].decode() for i, row in self._rows_by_id.items()}
+
+    def extend(
+        self,
+        n: int,
+        categories: list[str] | None = None,
+        prices: list[float] | np.ndarray | None = None,
+        ids: list[int] | None = None,
+        hashes: list[str] | None = None,
+    ) -> None:
+        if n == 0:
+            return
+        size = self._size + n
+        self._codes = grow(self._codes, size)
+        self._prices = grow(self._prices, size)
+        self._ids = grow(self._ids, size)
+        self._hashes = grow(self._hashes, size)
+        self._live = grow(self._live, size)
+        if categories is None:
+            self._codes[self._size : size] = -1
+        else:
+            for category in categories:
+                if category not in self._category_codes:
+                    self._category_codes[category] = len(self._categories)
+                    self._categories.append(category)
+            self._codes[self._size : size] = [
+                self._category_codes[category] for category in categories
+            ]
+        self._prices[self._size : size] = np.nan if prices is None else prices
+        self._hashes[self._size : size] = b"" if hashes is None else hashes
+        self._live[self._size : size] = True
+        if ids is None:
+            self._ids[self._size : size] = -1
+        else:
+            self._ids[self._size : size] = ids
+            self.delete(ids)
+            self._rows_by_id.update(zip(ids, range(self._size, size), strict=True))
+        self._size = size
+        self._category_index = None
+
+    def delete(self, ids: list[int]) -> int:
+        rows = [row for i in ids if (row := self._rows_by_id.pop(i, None)) is not None]
+        self._live[rows] = False
+        self._deleted += len(rows)
+        return len(rows)
+
+    def take(self, rows: np.ndarray) -> "AttributeStore":
+        # A copy holding only the given rows, all of them live.
+        store = AttributeStore(0)
+        store._categories = list(self._categories)
+        store._category_codes = dict(self._category_codes)
+        store._codes = self._codes[rows]
+        store._prices = self._prices[rows]
+        store._ids = self._ids[rows]
+        store._hashes = self._hashes[rows]
+        store._live = np.ones(len(rows), dtype=bool)
+        store._size = len(rows)
+        store._rows_by_id = {
+            i: row for row, i in enumerate(store._ids.tolist()) if i >= 0
+        }
+        return store
+
+    def candidates(self, where: Filter) -> np.ndarray:
+        # Sorted live rows matching the filter, so ties keep insertion order.
+        if where.category is None:
+            rows = None
+            prices = self._prices[: self._size]
+            keep = self._live[: self._size].copy()
+        else:
+            code = self._category_codes.get(where.category)
+            if code is None:
+                return np.empty(0, dtype=np.intp)
+            rows = self._rows(code)
+            prices = self._prices[rows]
+            keep = self._live[rows]
+        if where.min_price is not None:
+            keep &= prices >= where.min_price
+        if where.max_price is not None:
+            keep &= prices <= where.max_price
+        return np.flatnonzero(keep) if rows is None else rows[keep]
+
+    def _rows(self, code: int) -> np.ndarray:
+        # Rows per category in a CSR layout, rebuilt after inserts. Concurrent
+        # searches may build it at once, so both arrays are published together.
+        index = self._category_index
+        if index is None:
+            codes = self._codes[: self._size]
+            counts = np.bincount(codes + 1, minlength=len(self._categories) + 1)
+            index = np.argsort(codes, kind="stable"), np.cumsum(counts)
+            self._category_index = index
+        rows, offsets = index
+        return rows[offsets[code] : offsets[code + 1]]
+
+
+def save_array(path: str, name: str, array: np.ndarray) -> None:
+    # The file is replaced rather than rewritten, so arrays memory-mapped from
+    # it, possibly the one being saved, keep reading the old contents.
+    target = os.path.join(path, name)
+    with open(target + ".tmp", "wb") as file:
+        np.save(file, array)
+    os.replace(target + ".tmp", target)
+
+
+def grow(array: np.ndarray, size: int) -> np.ndarray:
+    if size <= len(array):
+        return array
+    grown = np.empty((max(size, 2 * len(array)), *array.shape[1:]), dtype=array.dtype)
+    grown[: len(array)] = array
+    return grown
+
+
 class NumpyVectorIndex(VectorIndex):
     _dim: int
-    _capacity: int
     _vectors: np.ndarray
-    _index: dict[int, str]
+    _documents: DocumentStore
+    _attributes: AttributeStore
+    _size: int
+    _block_size: int = 1 << 24
+    # Filters matching fewer than this fraction of rows score only the
+    # matching rows; broader ones mask a full scan instead.
+    _selectivity: float = 0.25
 
-    def __init__(self, dim, capacity):
+    def __init__(self, dim, capacity=1024, dtype=np.float32):
         self._dim = dim
-        self._capacity = capacity
-        self._vectors = np.zeros((capacity, dim))
-        self._index = {}
+        self._vectors = np.empty((capacity, dim), dtype=dtype)
+        self._documents = DocumentStore(capacity)
+        self._attributes = AttributeStore(capacity)
+        self._size = 0
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "NumpyVectorIndex":
+        # Memory-mapped arrays are read-only; the first insert copies them.
+        index = cls.__new__(cls)
+        index._vectors = np.load(
+            os.path.join(path, "vectors.npy"), mmap_mode="r" if mmap else None
+        )
+        index._dim = index._vectors.shape[1]
+        index._documents = DocumentStore.load(path, mmap)
+        index._size = len(index._vectors)
+        index._attributes = AttributeStore.load(path, index._size, mmap)
+        return index
+
+    def save(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        self._documents.save(path)
+        self._attributes.save(path)
+        # Written last, so a directory with vectors holds a complete index.
+        save_array(path, "vectors.npy", self._vectors[: self._size])
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def categories(self) -> list[str]:
+        return self._attributes.categories
+
+    @property
+    def deleted(self) -> int:
+        return self._attributes.deleted
+
+    def content_hashes(self) -> dict[int, str]:
+        return self._attributes.content_hashes()
 
     def insert(self, data: list[tuple[str, np.ndarray]]) -> None:
-        for document, v in data:
-            if len(self._index) >= self._capacity:
-                raise ValueError("Index is full")
-            index = len(self._index)
-            self._index[index] = document
-            self._vectors[index] = v
-
-    def search(self, v: np.ndarray, k: int) -> list[str]:
-        similarity = cosine_similarity(self._vectors, v)
-        indices = np.argsort(similarity)[::-1]
-        indices = indices[:k]
-        results = [self._index[i] for i in indices]
+        if not data:
+            return
+        documents, vectors = zip(*data, strict=True)
+        self.insert_array(list(documents), np.stack(vectors))
+
+    def insert_array(
+        self,
+        documents: list[str],
+        vectors: np.ndarray,
+        categories: list[str] | None = None,
+        prices: list[float] | np.ndarray | None = None,
+        ids: list[int] | None = None,
+        hashes: list[str] | None = None,
+    ) -> None:
+        # Rows inserted with a product id replace the current row of that id.
+        if not documents:
+            return
+        vectors = np.asarray(vectors)
+        if vectors.shape != (len(documents), self._dim):
+            raise ValueError(
+                f"Expected vectors of shape {(len(documents), self._dim)}, "
+                f"got {vectors.shape}"
+            )
+        size = self._size + len(documents)
+        self._vectors = grow(self._vectors, size)
+        dtype = np.promote_types(self._vectors.dtype, np.float32)
+        self._vectors[self._size : size] = normalize(vectors.astype(dtype))
+        self._documents.extend(documents)
+        self._attributes.extend(len(documents), categories, prices, ids, hashes)
+        self._size = size
+        self._version += 1
+
+    def delete(self, ids: list[int]) -> None:
+        if self._attributes.delete(ids):
+            self._version += 1
+
+    def compact(self) -> np.ndarray:
+        # Drops tombstoned rows and returns the surviving row numbers.
+        rows = np.flatnonzero(self._attributes.live)
+        if len(rows) == self._size:
+            return rows
+        documents = [self._documents[i] for i in rows]
+        self._vectors = np.ascontiguousarray(self._vectors[rows])
+        self._documents = DocumentStore(len(rows))
+        self._documents.extend(documents)
+        self._attributes = self._attributes.take(rows)
+        self._size = len(rows)
+        self._version += 1
+        return rows
+
+    def search(self, v: np.ndarray, k: int, where: Filter | None = None) -> list[str]:
+        return [self._documents[i] for i, _ in self._search(np.asarray(v), k, where)]
+
+    def search_with_scores(
+        self, v: np.ndarray, k: int, where: Filter | None = None
+    ) -> list[tuple[str, float]]:
+        v = np.asarray(v)
+        # Rows are already normalized; scale by the query norm to get cosines.
+        norm = np.linalg.norm(v) + 1e-6
+        return [
+            (self._documents[i], float(score / norm))
+            for i, score in self._search(v, k, where)
+        ]
+
+    def _search(
+        self, v: np.ndarray, k: int, where: Filter | None
+    ) -> list[tuple[int, float]]:
+        tolerance = score_tolerance(v)
+        if where is None and not self.deleted:
+            similarity = self._similarity(v[np.newaxis])[0]
+            return self._exact(v, near_top_k(similarity, k, tolerance), k)
+        rows = self._attributes.candidates(where or Filter())
+        if len(rows) < self._selectivity * self._size:
+            dtype = np.promote_types(self._vectors.dtype, np.float32)
+            vectors = self._vectors[rows].astype(dtype, copy=False)
+            similarity = vectors @ v.astype(dtype, copy=False)
+            return self._exact(v, rows[near_top_k(similarity, k, tolerance)], k)
+        similarity = self._similarity(v[np.newaxis])[0]
+        mask = np.ones(self._size, dtype=bool)
+        mask[rows] = False
+        similarity[mask] = -np.inf
+        k = min(k, len(rows))
+        return self._exact(v, near_top_k(similarity, k, tolerance), k)
+
+    def _exact(
+        self, v: np.ndarray, rows: np.ndarray, k: int
+    ) -> list[tuple[int, float]]:
+        rows, scores = exact_top_k(self._vectors[rows], v, rows, k)
+        return list(zip(rows.tolist(), scores.tolist(), strict=True))
+
+    def search_batch(self, Q: np.ndarray, k: int) -> list[list[str]]:
+        # Tile the queries so a block of scores stays under _block_size entries.
+        step = max(1, self._block_size // max(self._size, 1))
+        k = min(k, self._size - self.deleted)
+        if k <= 0:
+            return [[] for _ in Q]
+        results = []
+        for start in range(0, len(Q), step):
+            batch = np.asarray(Q[start : start + step])
+            similarity = self._similarity(batch)
+            if self.deleted:
+                similarity[:, ~self._attributes.live] = -np.inf
+            # Near-ties of each k-th score are rescored as in search(), so
+            # both return the same results.
+            best = top_k_rows(similarity, k)
+            kth = np.take_along_axis(similarity, best[:, -1:], axis=1)
+            tolerance = np.array([[score_tolerance(v)] for v in batch])
+            near = similarity >= kth - tolerance
+            for v, row in zip(batch, near, strict=True):
+                rows = self._exact(v, np.flatnonzero(row), k)
+                results.append([self._documents[i] for i, _ in rows])
         return results
+
+    def _similarity(self, Q: np.ndarray) -> np.ndarray:
+        return dot_similarity(self._vectors[: self._size], Q, self._block_size)
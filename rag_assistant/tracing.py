@@ -0,0 +1,129 @@
+import json
+import threading
+import time
+from collections import deque
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Any
+
+import numpy as np
+
+TRACE_ENVIRON = "TRACE_FILE"
+
+
+@dataclass
+class Span:
+    name: str
+    start: float
+    duration: float = 0.0
+    attributes: dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class TurnRecord:
+    start: float
+    duration: float = 0.0
+    spans: list[Span] = field(default_factory=list)
+    attributes: dict[str, Any] = field(default_factory=dict)
+    # False for a record holding a single span opened outside any turn.
+    turn: bool = True
+
+
+class Tracer:
+    # Spans opened inside turn() belong to that turn, so concurrent sessions
+    # can share a tracer. Work handed to other threads must run in a copy of
+    # the turn's context (contextvars.copy_context). Spans outside any turn
+    # are recorded on their own.
+    enabled: bool
+    records: deque[TurnRecord]
+    _path: str | None
+    _current: ContextVar[TurnRecord | None]
+    _lock: threading.Lock
+
+    def __init__(
+        self, path: str | None = None, enabled: bool = True, capacity: int = 10_000
+    ):
+        self.enabled = enabled
+        self.records = deque(maxlen=capacity)
+        self._path = path
+        self._current = ContextVar(f"tracer_{id(self)}", default=None)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def turn(self, **attributes) -> Iterator[TurnRecord | None]:
+        if not self.enabled:
+            yield None
+            return
+        record = TurnRecord(start=time.time(), attributes=attributes)
+        token = self._current.set(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.duration = time.perf_counter() - start
+            self._current.reset(token)
+            self._finish(record)
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[dict[str, Any]]:
+        # Yields the span's attributes so the caller can add to them.
+        if not self.enabled:
+            yield attributes
+            return
+        record = self._current.get()
+        span = Span(name=name, start=time.time(), attributes=attributes)
+        start = time.perf_counter()
+        try:
+            yield span.attributes
+        finally:
+            span.duration = time.perf_counter() - start
+            if record is None:
+                self._finish(TurnRecord(span.start, span.duration, [span], turn=False))
+            else:
+                with self._lock:
+                    record.spans.append(span)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        # Duration percentiles per span name ("turn" for whole turns), and
+        # totals of numeric span attributes such as token counts.
+        durations: dict[str, list[float]] = {}
+        totals: dict[str, dict[str, float]] = {}
+        with self._lock:
+            records = list(self.records)
+        for record in records:
+            if record.turn:
+                durations.setdefault("turn", []).append(record.duration)
+            for span in record.spans:
+                durations.setdefault(span.name, []).append(span.duration)
+                span_totals = totals.setdefault(span.name, {})
+                for key, value in span.attributes.items():
+                    if isinstance(value, int | float):
+                        span_totals[key] = span_totals.get(key, 0) + value
+        summary = {}
+        for name, values in durations.items():
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            summary[name] = {
+                "count": len(values),
+                "mean": float(np.mean(values)),
+                "p50": float(p50),
+                "p90": float(p90),
+                "p99": float(p99),
+                **totals.get(name, {}),
+            }
+        return summary
+
+    def export(self, path: str) -> None:
+        with self._lock:
+            records = list(self.records)
+        with open(path, "w") as file:
+            for record in records:
+                file.write(json.dumps(asdict(record)) + "\n")
+
+    def _finish(self, record: TurnRecord) -> None:
+        with self._lock:
+            self.records.append(record)
+            if self._path is not None:
+                with open(self._path, "a") as file:
+                    file.write(json.dumps(asdict(record)) + "\n")
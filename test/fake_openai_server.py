@@ -0,0 +1,138 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    failures: int
+    latency: float
+    requests: list[dict]
+    active: int
+    max_active: int
+
+    def __init__(self, failures: int = 0, latency: float = 0.0):
+        super().__init__(("127.0.0.1", 0), FakeOpenAIHandler)
+        self.failures = failures
+        self.latency = latency
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    server: FakeOpenAIServer
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server._lock:
+            self.server.requests.append(body)
+            self.server.active += 1
+            self.server.max_active = max(self.server.max_active, self.server.active)
+            fail = self.server.failures > 0
+            self.server.failures -= fail
+        try:
+            time.sleep(self.server.latency)
+            if fail:
+                self._send(500, {"error": {"message": "Injected failure"}})
+            elif self.path.endswith("/chat/completions") and body.get("stream"):
+                self._send_stream(self._chat_completion_chunks(body))
+            elif self.path.endswith("/chat/completions"):
+                self._send(200, self._chat_completion(body))
+            elif self.path.endswith("/embeddings"):
+                self._send(200, self._embeddings(body))
+            else:
+                self._send(404, {"error": {"message": "Not found"}})
+        finally:
+            with self.server._lock:
+                self.server.active -= 1
+
+    def _send(self, status: int, payload: dict):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, chunks: list[dict]):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    @staticmethod
+    def _chat_completion_chunks(body: dict) -> list[dict]:
+        words = f"echo: {body['messages'][-1]['content']}".split(" ")
+        deltas = [{"role": "assistant", "content": ""}]
+        deltas += [{"content": w if i == 0 else f" {w}"} for i, w in enumerate(words)]
+        return [
+            {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": 0,
+                "model": body["model"],
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+            }
+            for delta in deltas
+        ]
+
+    @staticmethod
+    def _chat_completion(body: dict) -> dict:
+        content = body["messages"][-1]["content"]
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body["model"],
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": f"echo: {content}"},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }
+
+    @staticmethod
+    def _embeddings(body: dict) -> dict:
+        texts = body["input"]
+        texts = [texts] if isinstance(texts, str) else texts
+        return {
+            "object": "list",
+            "data": [
+                {
+                    "object": "embedding",
+                    "index": i,
+                    "embedding": fake_embedding(text, body["dimensions"]),
+                }
+                for i, text in enumerate(texts)
+            ],
+            "model": body["model"],
+            "usage": {"prompt_tokens": 1, "total_tokens": 1},
+        }
+
+
+def fake_embedding(text: str, dim: int) -> list[float]:
+    return [float(len(text) + i) for i in range(dim)]
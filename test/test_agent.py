@@ -0,0 +1,215 @@
+import time
+from collections.abc import Generator, Iterator
+
+import numpy as np
+from pytest import fixture
+
+from rag_assistant.llm.agent import SimpleChatBot, SimpleRAGAgent, extract_filter
+from rag_assistant.llm.chat import Chat, ChatMessage
+from rag_assistant.llm.response_cache import SemanticResponseCache
+from rag_assistant.retrieval.embedding import Embedding
+from rag_assistant.retrieval.retriever import Retriever
+from rag_assistant.retrieval.vector_index import Filter, NumpyVectorIndex
+
+
+class MockChat(Chat):
+    decision: str
+    latency: float
+    calls: list[str]
+
+    def __init__(self, decision: str = "yes", latency: float = 0.0):
+        self.decision = decision
+        self.latency = latency
+        self.calls = []
+
+    @property
+    def model(self) -> str:
+        return "mock"
+
+    def chat(self, messages: list[ChatMessage]) -> ChatMessage:
+        time.sleep(self.latency)
+        content = messages[-1].content
+        if "Do we need to search" in content:
+            self.calls.append("decide")
+            return ChatMessage(role="assistant", content=self.decision)
+        if "Construct a query" in content:
+            self.calls.append("query")
+            return ChatMessage(role="assistant", content="backpack")
+        self.calls.append("answer")
+        return ChatMessage(role="assistant", content=content)
+
+    def stream(self, messages: list[ChatMessage]) -> Iterator[str]:
+        content = self.chat(messages).content
+        for start in range(0, len(content), 10):
+            yield content[start : start + 10]
+
+    def count_tokens(self, messages: list[ChatMessage]) -> int:
+        return sum(len(m.content.split()) for m in messages)
+
+
+class MockEmbedding(Embedding):
+    @property
+    def model(self) -> str:
+        return "mock"
+
+    @property
+    def dim(self) -> int:
+        return 2
+
+    def count_tokens(self, s: str) -> int:
+        return len(s.split())
+
+    def embed(self, s: str) -> list[float]:
+        return [1.0, 0.0] if "backpack" in s else [0.0, 1.0]
+
+
+@fixture
+def vector_index() -> Generator[NumpyVectorIndex]:
+    index = NumpyVectorIndex(2)
+    index.insert(
+        [("Fjallraven Backpack", np.array([1, 0.1])), ("Jacket", np.array([0, 1]))]
+    )
+    yield index
+
+
+@fixture
+def message() -> Generator[ChatMessage]:
+    yield ChatMessage(role="user", content="Do you sell backpacks?")
+
+
+def test_rag_agent_search(vector_index, message):
+    chat = MockChat()
+    agent = SimpleRAGAgent(chat, vector_index, MockEmbedding(), k=1)
+    answer = agent.respond(message)
+    assert "Fjallraven Backpack" in answer.content
+    assert "Jacket" not in answer.content
+    assert chat.calls == ["decide", "query", "answer"]
+    stages = {"decide", "query", "embed", "search", "answer", "total"}
+    assert set(agent.timings) == stages
+
+
+def test_rag_agent_parallel_matches_sequential(vector_index, message):
+    sequential = SimpleRAGAgent(MockChat(), vector_index, MockEmbedding(), k=1)
+    parallel = SimpleRAGAgent(
+        MockChat(), vector_index, MockEmbedding(), k=1, parallel=True
+    )
+    assert parallel.respond(message) == sequential.respond(message)
+    assert parallel._history.messages == sequential._history.messages
+
+
+def test_rag_agent_parallel_overlaps_calls(vector_index, message):
+    agent = SimpleRAGAgent(
+        MockChat(latency=0.1), vector_index, MockEmbedding(), parallel=True
+    )
+    agent.respond(message)
+    assert agent.timings["total"] < 0.28
+
+
+def test_rag_agent_parallel_discards_retrieval(vector_index, message):
+    chat = MockChat(decision="no")
+    agent = SimpleRAGAgent(chat, vector_index, MockEmbedding(), parallel=True)
+    answer = agent.respond(message)
+    assert answer.content == message.content
+    assert agent._history[-1] == answer
+
+
+def test_rag_agent_respond_stream(vector_index, message):
+    expected = SimpleRAGAgent(MockChat(), vector_index, MockEmbedding(), k=1)
+    agent = SimpleRAGAgent(MockChat(), vector_index, MockEmbedding(), k=1)
+    deltas = list(agent.respond_stream(message))
+    assert len(deltas) > 1
+    assert "".join(deltas) == expected.respond(message).content
+    assert agent._history.messages == expected._history.messages
+    assert agent.timings["first_token"] <= agent.timings["total"]
+
+
+def test_chat_bot_respond_stream(message):
+    agent = SimpleChatBot(MockChat())
+    assert "".join(agent.respond_stream(message)) == message.content
+    assert agent._history[-1].content == message.content
+
+
+def test_chat_bot_abandoned_stream_keeps_history(message):
+    agent = SimpleChatBot(MockChat())
+    stream = agent.respond_stream(message)
+    next(stream)
+    stream.close()
+    assert [m.role for m in agent._history] == ["developer"]
+    "".join(agent.respond_stream(message))
+    assert [m.role for m in agent._history] == ["developer", "user", "assistant"]
+
+
+def test_rag_agent_response_cache(vector_index, message):
+    chat = MockChat()
+    cache = SemanticResponseCache(MockEmbedding(), source=vector_index)
+    agent = SimpleRAGAgent(
+        chat, vector_index, MockEmbedding(), k=1, response_cache=cache
+    )
+    first = agent.respond(message)
+    assert agent.respond(message) == first
+    assert "".join(agent.respond_stream(message)) == first.content
+    assert chat.calls == ["decide", "query", "answer"]
+    assert len(agent._history) == 7
+
+
+def test_rag_agent_memoizes_auxiliary_calls(vector_index, message):
+    chat = MockChat()
+    agent = SimpleRAGAgent(chat, vector_index, MockEmbedding(), k=1)
+    agent.respond(message)
+    agent.respond(ChatMessage(role="user", content="  Do you sell\nbackpacks? "))
+    assert chat.calls == ["decide", "query", "answer", "answer"]
+
+
+def test_rag_agent_retriever(vector_index, message):
+    class StaticRetriever(Retriever):
+        def search(self, query: str, k: int, where=None) -> list[str]:
+            return [f"{query} result"]
+
+    chat = MockChat()
+    agent = SimpleRAGAgent(
+        chat, vector_index, MockEmbedding(), retriever=StaticRetriever()
+    )
+    answer = agent.respond(message)
+    assert "backpack result" in answer.content
+    assert "embed" not in agent.timings
+
+
+def test_extract_filter():
+    categories = ["men's clothing", "women's clothing", "jewelery"]
+    assert extract_filter("Jackets under $50", categories) == Filter(max_price=50)
+    assert extract_filter("women's clothing between 10 and $20", categories) == (
+        Filter(category="women's clothing", min_price=10, max_price=20)
+    )
+    assert extract_filter("jewelery over 100.5", categories) == Filter(
+        category="jewelery", min_price=100.5
+    )
+    assert extract_filter("A backpack for up to 15 inch laptops", categories) is None
+    assert extract_filter("electronics under $1,000", categories) == Filter(
+        max_price=1000
+    )
+    assert extract_filter("jewelery between $1,250.50 and 2,000", categories) == (
+        Filter(category="jewelery", min_price=1250.5, max_price=2000)
+    )
+    assert extract_filter("rings over 4.5 stars", categories) is None
+    assert extract_filter("a jacket with a rating above 4", categories) is None
+    assert extract_filter("Jackets under $50.", categories) == Filter(max_price=50)
+
+
+def test_rag_agent_filters_search(message):
+    index = NumpyVectorIndex(2)
+    index.insert_array(
+        ["Fjallraven Backpack", "Cheap Backpack", "Jacket"],
+        np.array([[1, 0.1], [1, 0.2], [0, 1]]),
+        ["bags", "bags", "clothing"],
+        [109.95, 20.0, 55.99],
+    )
+    agent = SimpleRAGAgent(MockChat(), index, MockEmbedding(), k=1)
+    assert agent.search(ChatMessage(role="user", content="backpacks under $50")) == [
+        "Fjallraven Backpack"
+    ]
+    agent = SimpleRAGAgent(
+        MockChat(), index, MockEmbedding(), k=1, categories=index.categories
+    )
+    assert agent.search(ChatMessage(role="user", content="backpacks under $50")) == [
+        "Cheap Backpack"
+    ]
@@ -0,0 +1,95 @@
+import threading
+from collections.abc import Generator
+
+from pytest import fixture
+
+from rag_assistant.app.backend import RetrievalBackend
+from rag_assistant.database.product_database import Product, SQLiteProductDatabase
+from rag_assistant.llm.chat import ChatMessage, ScriptedChat
+from rag_assistant.retrieval.embedding import HashEmbedding
+from rag_assistant.retrieval.vector_index import Filter, NumpyVectorIndex
+
+
+def make_product(i: int, title: str, category: str, price: float = 10.0) -> Product:
+    return Product(
+        id=i,
+        title=title,
+        price=price,
+        description=f"{title} for every day",
+        category=category,
+        image=f"https://example.com/{i}.jpg",
+    )
+
+
+@fixture
+def backend() -> Generator[RetrievalBackend]:
+    database = SQLiteProductDatabase(":memory:")
+    database.create_tables()
+    database.insert_products(
+        [
+            make_product(1, "Leather Backpack", "bags"),
+            make_product(2, "Gold Ring", "jewelery"),
+            make_product(3, "Cotton Jacket", "clothing"),
+        ]
+    )
+    chat = ScriptedChat(
+        rules=[
+            ("Do we need to search", "yes"),
+            ("Construct a query", lambda content: content.split("---")[1]),
+        ],
+        default="Here you go.",
+    )
+    backend = RetrievalBackend(chat, HashEmbedding(32), database, NumpyVectorIndex(32))
+    yield backend
+    backend.close()
+    database.close()
+
+
+def test_agents_have_own_history(backend):
+    first, second = backend.agent(), backend.agent()
+    first.respond(ChatMessage(role="user", content="I need a backpack"))
+    assert [m.role for m in first._history][-2:] == ["user", "assistant"]
+    assert "user" not in [m.role for m in second._history]
+    assert first.search(ChatMessage(role="user", content="gold ring"))[0].startswith(
+        "id=2 "
+    )
+
+
+def test_agents_share_one_executor(backend):
+    first, second = backend.agent(), backend.agent()
+    assert first._executor is second._executor is not None
+    second.respond(ChatMessage(role="user", content="I need a ring"))
+
+
+def test_agents_see_categories_added_by_refresh(backend):
+    agent = backend.agent()
+    message = ChatMessage(role="user", content="shoes under $20")
+    assert agent._filter(message) == Filter(max_price=20)
+    backend.refresh([make_product(4, "Running Shoe", "shoes")])
+    assert agent._filter(message) == Filter(category="shoes", max_price=20)
+    assert agent.search(message)[0].startswith("id=4 ")
+
+
+def test_refresh_during_searches(backend):
+    agent = backend.agent()
+    message = ChatMessage(role="user", content="cotton jacket")
+    results = []
+
+    def search():
+        for _ in range(50):
+            results.append(agent.search(message))
+
+    threads = [threading.Thread(target=search) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for i in range(4, 24):
+        backend.refresh([make_product(i, f"Cotton Jacket {i}", "clothing")])
+    for thread in threads:
+        thread.join()
+    assert len(results) == 200
+    assert all(len(result) == 2 for result in results)
+
+    result = backend.refresh([make_product(2, "Silver Ring", "jewelery")])
+    assert (result.inserted, result.updated, result.deleted) == (0, 1, 0)
+    assert "Silver Ring" in agent.search(ChatMessage(role="user", content="ring"))[0]
+    assert sorted(backend.agent()._categories()) == ["bags", "clothing", "jewelery"]
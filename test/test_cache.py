@@ -0,0 +1,40 @@
+import os
+from collections.abc import Generator
+
+from pytest import fixture
+
+from rag_assistant.cache import LRUCache, SQLiteStore
+
+
+@fixture
+def sqlite_store() -> Generator[SQLiteStore]:
+    file = "/tmp/mock_sqlite_store_file.db"
+    store = SQLiteStore(file, "entries")
+    yield store
+    store.close()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(file + suffix):
+            os.remove(file + suffix)
+
+
+def test_lru_eviction():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+    assert cache.hits == 3
+    assert cache.misses == 1
+    assert cache.hit_rate == 0.75
+
+
+def test_sqlite_store_put_and_get(sqlite_store):
+    sqlite_store.put_many([("a", b"1"), ("b", b"2")])
+    sqlite_store.put_many([("a", b"3")])
+    assert sqlite_store.get_many(["a", "b", "c"]) == {"a": b"3", "b": b"2"}
+    sqlite_store.clear()
+    assert sqlite_store.get_many(["a"]) == {}
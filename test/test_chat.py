@@ -1,9 +1,61 @@
+import asyncio
+import os
+import time
 from collections.abc import Generator
 
+import pytest
 from dotenv import load_dotenv
+from openai import AsyncOpenAI, InternalServerError
 from pytest import fixture
 
-from rag_assistant.llm.chat import ChatMessage, OpenAIChat, SafeChatDecorator
+from rag_assistant.llm.chat import (
+    TOKENS_PER_MESSAGE,
+    TOKENS_PER_REPLY,
+    AsyncOpenAIChat,
+    CachedChatDecorator,
+    Chat,
+    ChatMessage,
+    OpenAIChat,
+    SafeChatDecorator,
+    ScriptedChat,
+    SyncChatAdapter,
+    count_message_tokens,
+    count_messages_tokens,
+)
+from test.fake_openai_server import FakeOpenAIServer
+
+
+class MockChat(Chat):
+    calls: int = 0
+
+    @property
+    def model(self) -> str:
+        return "mock"
+
+    def chat(self, messages: list[ChatMessage]) -> ChatMessage:
+        self.calls += 1
+        return ChatMessage(role="assistant", content=f"answer {self.calls}")
+
+    def count_tokens(self, messages: list[ChatMessage]) -> int:
+        return sum(len(m.content.split()) for m in messages)
+
+
+class MockEncoding:
+    name = "mock"
+    calls: int = 0
+
+    def encode(self, text: str) -> list[str]:
+        self.calls += 1
+        return text.split()
+
+
+@fixture
+def cache_file() -> Generator[str]:
+    file = "/tmp/mock_chat_cache_file.db"
+    yield file
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(file + suffix):
+            os.remove(file + suffix)
 
 
 @fixture
@@ -15,6 +67,17 @@ def openai_chat() -> Generator[SafeChatDecorator]:
     yield chat
 
 
+@fixture
+def fake_server() -> Generator[FakeOpenAIServer]:
+    with FakeOpenAIServer() as server:
+        yield server
+
+
+@fixture
+def fake_client(fake_server) -> Generator[AsyncOpenAI]:
+    yield AsyncOpenAI(api_key="test", base_url=fake_server.base_url, max_retries=0)
+
+
 @fixture
 def chat_messages() -> Generator[list[ChatMessage]]:
     messages = [
@@ -41,3 +104,134 @@ def test_openai_chat(openai_chat, chat_messages):
     assert isinstance(response, ChatMessage)
     assert response.role == "assistant"
     assert response.content != ""
+
+
+def test_async_chat(fake_client, chat_messages):
+    chat = AsyncOpenAIChat(model="gpt-4o-mini", client=fake_client)
+    response = asyncio.run(chat.chat(chat_messages))
+    assert response.role == "assistant"
+    assert response.content == f"echo: {chat_messages[-1].content}"
+
+
+def test_async_chat_bounded_concurrency(fake_server, fake_client, chat_messages):
+    fake_server.latency = 0.05
+    chat = AsyncOpenAIChat(model="gpt-4o-mini", client=fake_client, max_concurrency=2)
+
+    async def chat_many():
+        return await asyncio.gather(*[chat.chat(chat_messages) for _ in range(6)])
+
+    assert len(asyncio.run(chat_many())) == 6
+    assert fake_server.max_active == 2
+
+
+def test_async_chat_retries(fake_server, fake_client, chat_messages):
+    fake_server.failures = 2
+    chat = AsyncOpenAIChat(
+        model="gpt-4o-mini", client=fake_client, retries=2, backoff=0.01
+    )
+    assert asyncio.run(chat.chat(chat_messages)).content.startswith("echo: ")
+    assert len(fake_server.requests) == 3
+
+    fake_server.failures = 2
+    chat = AsyncOpenAIChat(
+        model="gpt-4o-mini", client=fake_client, retries=1, backoff=0.01
+    )
+    with pytest.raises(InternalServerError):
+        asyncio.run(chat.chat(chat_messages))
+
+
+def test_sync_chat_adapter(fake_client, chat_messages):
+    chat = SyncChatAdapter(AsyncOpenAIChat(model="gpt-4o-mini", client=fake_client))
+    response = chat.chat(chat_messages)
+    assert response.content == f"echo: {chat_messages[-1].content}"
+
+
+def test_async_chat_stream(fake_client, chat_messages):
+    chat = AsyncOpenAIChat(model="gpt-4o-mini", client=fake_client)
+
+    async def collect():
+        return [delta async for delta in chat.stream(chat_messages)]
+
+    deltas = asyncio.run(collect())
+    assert len(deltas) > 1
+    assert "".join(deltas) == f"echo: {chat_messages[-1].content}"
+
+
+def test_sync_chat_adapter_stream(fake_client, chat_messages):
+    chat = SyncChatAdapter(AsyncOpenAIChat(model="gpt-4o-mini", client=fake_client))
+    deltas = list(chat.stream(chat_messages))
+    assert len(deltas) > 1
+    assert "".join(deltas) == chat.chat(chat_messages).content
+
+
+def test_cached_chat(chat_messages):
+    mock = MockChat()
+    chat = CachedChatDecorator(mock, capacity=1)
+    first = chat.chat(chat_messages)
+    assert chat.chat(chat_messages) == first
+    assert chat.chat([ChatMessage(role="user", content="Other")]) != first
+    assert chat.chat(chat_messages) != first
+    assert mock.calls == 3
+    assert (chat.hits, chat.misses) == (1, 3)
+    assert chat.hit_rate == 0.25
+
+
+def test_cached_chat_normalizes_whitespace(chat_messages):
+    chat = CachedChatDecorator(MockChat())
+    spaced = [
+        ChatMessage(role=m.role, content=f"\n  {m.content.replace(' ', '   ')} ")
+        for m in chat_messages
+    ]
+    assert chat.chat(spaced) == chat.chat(chat_messages)
+    other_role = [ChatMessage(role="user", content=m.content) for m in chat_messages]
+    assert chat.chat(other_role) != chat.chat(chat_messages)
+
+
+def test_cached_chat_persistence(chat_messages, cache_file):
+    first = CachedChatDecorator(MockChat(), path=cache_file).chat(chat_messages)
+    mock = MockChat()
+    chat = CachedChatDecorator(mock, path=cache_file)
+    assert chat.chat(chat_messages) == first
+    assert mock.calls == 0
+    assert chat.hits == 1
+
+
+def test_count_message_tokens_cached(chat_messages):
+    encoding = MockEncoding()
+    counts = [count_message_tokens(m, encoding) for m in chat_messages]
+    assert counts == [3 + 1 + 4, 3 + 1 + 11]
+    assert count_messages_tokens(chat_messages, encoding) == sum(counts) + 3
+    assert encoding.calls == 4
+
+    chat_messages[0].content = "Summarize."
+    assert count_message_tokens(chat_messages[0], encoding) == 3 + 1 + 1
+    assert encoding.calls == 6
+    assert chat_messages[0] == ChatMessage(role="system", content="Summarize.")
+
+
+def test_scripted_chat():
+    chat = ScriptedChat(
+        rules=[("search", "yes"), ("echo", lambda content: content.upper())],
+        default="fallback answer",
+    )
+    ask = [ChatMessage(role="user", content="should we search?")]
+    assert chat.chat(ask).content == "yes"
+    assert chat.chat([ChatMessage(role="user", content="echo me")]).content == (
+        "ECHO ME"
+    )
+    other = [ChatMessage(role="user", content="hello")]
+    assert "".join(chat.stream(other)) == "fallback answer"
+    assert chat.calls == 3
+    assert chat.count_tokens(ask) == TOKENS_PER_REPLY + TOKENS_PER_MESSAGE + 3
+
+
+def test_scripted_chat_latency():
+    chat = ScriptedChat(default="one two three", latency=0.05, token_latency=0.01)
+    start = time.perf_counter()
+    deltas = chat.stream([ChatMessage(role="user", content="hi")])
+    next(deltas)
+    first_token = time.perf_counter() - start
+    list(deltas)
+    total = time.perf_counter() - start
+    assert 0.06 <= first_token < total
+    assert total >= 0.08
@@ -1,7 +1,46 @@
+import asyncio
+import os
+import time
+from collections.abc import Generator
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
 from dotenv import load_dotenv
+from openai import AsyncOpenAI
 from pytest import fixture
 
-from rag_assistant.retrieval.embedding import OpenAIEmbedding, SafeEmbeddingDecorator
+from rag_assistant.retrieval.embedding import (
+    AsyncOpenAIEmbedding,
+    BatchingEmbeddingDecorator,
+    CachedEmbeddingDecorator,
+    Embedding,
+    HashEmbedding,
+    OpenAIEmbedding,
+    SafeEmbeddingDecorator,
+    SyncEmbeddingAdapter,
+    pack_batches,
+)
+from test.fake_openai_server import FakeOpenAIServer, fake_embedding
+
+
+class MockEmbedding(Embedding):
+    calls: int = 0
+
+    @property
+    def model(self) -> str:
+        return "mock"
+
+    @property
+    def dim(self) -> int:
+        return 3
+
+    def count_tokens(self, s: str) -> int:
+        return len(s.split())
+
+    def embed(self, s: str) -> list[float]:
+        self.calls += 1
+        return [float(len(s)), float(s.count(" ")), 1.0]
 
 
 @fixture
@@ -12,6 +51,37 @@ def openai_embedding():
     yield embedding
 
 
+@fixture
+def mock_embedding():
+    yield SafeEmbeddingDecorator(MockEmbedding(), limit=5)
+
+
+@fixture
+def fake_server() -> Generator[FakeOpenAIServer]:
+    with FakeOpenAIServer() as server:
+        yield server
+
+
+@fixture
+def async_embedding(fake_server) -> Generator[AsyncOpenAIEmbedding]:
+    client = AsyncOpenAI(api_key="test", base_url=fake_server.base_url, max_retries=0)
+    embedding = AsyncOpenAIEmbedding(
+        model="text-embedding-3-small", dim=4, client=client, backoff=0.01
+    )
+    # Count words instead of downloading a tokenizer.
+    embedding.count_tokens = lambda s: len(s.split())
+    yield embedding
+
+
+@fixture
+def cache_file() -> Generator[str]:
+    file = "/tmp/mock_embedding_cache_file.db"
+    yield file
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(file + suffix):
+            os.remove(file + suffix)
+
+
 @fixture
 def string():
     yield "Hello, World!"
@@ -28,3 +98,178 @@ def test_embed(openai_embedding, string):
     assert embedding is not None
     assert isinstance(embedding, list)
     assert isinstance(embedding[0], float)
+
+
+def test_embed_batch(openai_embedding, string):
+    embeddings = openai_embedding.embed_batch([string, "Goodbye!", string])
+    assert embeddings.dtype == np.float32
+    assert embeddings.shape == (3, 100)
+    assert embeddings.flags["C_CONTIGUOUS"]
+    np.testing.assert_allclose(embeddings[0], embeddings[2], atol=1e-2)
+
+
+@pytest.mark.parametrize(
+    "texts,max_tokens,max_size,batches",
+    [
+        ([], 10, 10, []),
+        (["a b", "c d", "e f"], 4, 10, [(0, 2), (2, 3)]),
+        (["a b", "c d", "e f"], 10, 2, [(0, 2), (2, 3)]),
+        (["a b c d e f", "a", "b"], 4, 10, [(0, 1), (1, 3)]),
+        (["a", "b c d e f", "g"], 4, 10, [(0, 1), (1, 2), (2, 3)]),
+    ],
+)
+def test_pack_batches(texts, max_tokens, max_size, batches):
+    count_tokens = MockEmbedding().count_tokens
+    assert list(pack_batches(texts, count_tokens, max_tokens, max_size)) == batches
+
+
+def test_mock_embed_batch(mock_embedding):
+    texts = ["Hello, World!", "a b c"]
+    embeddings = mock_embedding.embed_batch(texts)
+    assert embeddings.dtype == np.float32
+    assert embeddings.shape == (2, 3)
+    for text, v in zip(texts, embeddings, strict=True):
+        np.testing.assert_array_equal(v, mock_embedding.embed(text))
+
+
+def test_mock_embed_batch_limit(mock_embedding):
+    with pytest.raises(ValueError):
+        mock_embedding.embed_batch(["short", "one two three four five six"])
+
+
+def test_cached_embed_batch(cache_file):
+    mock = MockEmbedding()
+    cached = CachedEmbeddingDecorator(mock, path=cache_file, capacity=2)
+    texts = ["a", "b c", "a", "d e f"]
+    expected = MockEmbedding().embed_batch(texts)
+    np.testing.assert_array_equal(cached.embed_batch(texts), expected)
+    assert mock.calls == 3
+    assert cached.misses == 3
+    assert cached.hits == 1
+
+    np.testing.assert_array_equal(cached.embed_batch(texts), expected)
+    assert mock.calls == 3
+    assert cached.hits == 5
+
+
+def test_cached_embed_warm_restart(cache_file):
+    texts = ["a", "b c", "d e f"]
+    CachedEmbeddingDecorator(MockEmbedding(), path=cache_file).embed_batch(texts)
+
+    mock = MockEmbedding()
+    cached = CachedEmbeddingDecorator(mock, path=cache_file)
+    assert cached.embed("b c") == MockEmbedding().embed("b c")
+    cached.embed_batch(texts)
+    assert mock.calls == 0
+    assert cached.misses == 0
+
+
+def test_async_embed(async_embedding, string):
+    assert asyncio.run(async_embedding.embed(string)) == fake_embedding(string, 4)
+
+
+def test_async_embed_batch(fake_server, async_embedding):
+    fake_server.failures = 1
+    async_embedding._batch_size = 2
+    texts = ["a", "b c", "d e f", "g"]
+    embeddings = asyncio.run(async_embedding.embed_batch(texts))
+    assert embeddings.dtype == np.float32
+    np.testing.assert_array_equal(embeddings, [fake_embedding(t, 4) for t in texts])
+    assert [len(r["input"]) for r in fake_server.requests] == [2, 2, 2]
+
+
+def test_sync_embedding_adapter(async_embedding, string):
+    embedding = SyncEmbeddingAdapter(async_embedding)
+    assert embedding.embed(string) == fake_embedding(string, 4)
+    assert embedding.embed_batch([string]).shape == (1, 4)
+    assert embedding.dim == 4
+
+
+def test_hash_embedding_is_deterministic():
+    embedding = HashEmbedding(dim=64)
+    vectors = embedding.embed_batch(
+        ["Mens cotton jacket", "A cotton jacket for men", "Gold ring"]
+    )
+    assert vectors.shape == (3, 64)
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1)
+    assert np.allclose(vectors[0], HashEmbedding(dim=64).embed("mens COTTON jacket"))
+    assert vectors[0] @ vectors[1] > vectors[0] @ vectors[2]
+    assert embedding.count_tokens("Mens cotton jacket") == 3
+
+
+def test_hash_embedding_latency():
+    embedding = HashEmbedding(dim=8, latency=0.05)
+    start = time.perf_counter()
+    embedding.embed_batch(["a", "b", "c"])
+    assert 0.05 <= time.perf_counter() - start < 0.15
+
+
+class RecordingEmbedding(HashEmbedding):
+    batches: list[list[str]]
+
+    def __init__(self, dim: int = 8, latency: float = 0.0):
+        super().__init__(dim, latency)
+        self.batches = []
+
+    def embed_batch(self, texts: list[str]) -> np.ndarray:
+        self.batches.append(texts)
+        if "fail" in texts:
+            raise RuntimeError("fail")
+        return super().embed_batch(texts)
+
+
+def test_batching_coalesces_concurrent_calls():
+    inner = RecordingEmbedding(latency=0.02)
+    embedding = BatchingEmbeddingDecorator(inner, window=0.05, max_batch=8)
+    texts = [f"text {i}" for i in range(20)]
+    with ThreadPoolExecutor(20) as executor:
+        vectors = list(executor.map(embedding.embed, texts))
+    assert np.allclose(vectors, HashEmbedding(8).embed_batch(texts))
+    assert sorted(t for batch in inner.batches for t in batch) == sorted(texts)
+    assert len(inner.batches) < len(texts)
+    assert max(map(len, inner.batches)) <= 8
+    stats = embedding.stats()
+    assert stats["requests"] == 20
+    assert stats["batches"] == len(inner.batches)
+    assert 0 <= stats["queue_delay_p99"] < 0.2
+
+
+def test_batching_single_and_failing_calls():
+    inner = RecordingEmbedding()
+    embedding = BatchingEmbeddingDecorator(inner, window=0.001)
+    assert embedding.embed_batch(["a"]).shape == (1, 8)
+    assert embedding.embed_batch(["a", "b"]).shape == (2, 8)
+    assert inner.batches == [["a"], ["a", "b"]]
+    assert embedding.stats()["batches"] == 1
+    with pytest.raises(RuntimeError):
+        embedding.embed("fail")
+
+
+def test_batching_failures_stay_with_their_callers():
+    inner = RecordingEmbedding()
+    embedding = SafeEmbeddingDecorator(
+        BatchingEmbeddingDecorator(inner, window=0.05), limit=3
+    )
+    texts = ["a b", "a b c d e", "c d"]
+    with ThreadPoolExecutor(3) as executor:
+        futures = [executor.submit(embedding.embed, t) for t in texts]
+    assert len(futures[0].result()) == len(futures[2].result()) == 8
+    with pytest.raises(ValueError):
+        futures[1].result()
+    assert all("a b c d e" not in batch for batch in inner.batches)
+
+
+def test_batching_releases_callers_on_base_exceptions():
+    class Interrupted(BaseException):
+        pass
+
+    class InterruptedEmbedding(RecordingEmbedding):
+        def embed_batch(self, texts: list[str]) -> np.ndarray:
+            raise Interrupted()
+
+    embedding = BatchingEmbeddingDecorator(InterruptedEmbedding(), window=0.05)
+    with ThreadPoolExecutor(4) as executor:
+        futures = [executor.submit(embedding.embed, str(i)) for i in range(4)]
+        for future in futures:
+            with pytest.raises(Interrupted):
+                future.result(timeout=5)
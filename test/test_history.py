@@ -0,0 +1,161 @@
+from collections.abc import Generator
+
+import pytest
+from pytest import fixture
+
+from rag_assistant.llm.agent import SimpleChatBot
+from rag_assistant.llm.chat import Chat, ChatMessage, SafeChatDecorator, ScriptedChat
+from rag_assistant.llm.history import ChatHistory
+
+
+class MockChat(Chat):
+    counted: list[str]
+    prompts: list[str]
+
+    def __init__(self):
+        self.counted = []
+        self.prompts = []
+
+    @property
+    def model(self) -> str:
+        return "mock"
+
+    def chat(self, messages: list[ChatMessage]) -> ChatMessage:
+        self.prompts.append(messages[-1].content)
+        return ChatMessage(role="assistant", content=f"summary {len(self.prompts)}")
+
+    def count_tokens(self, messages: list[ChatMessage]) -> int:
+        self.counted.extend(m.content for m in messages)
+        return sum(len(m.content.split()) for m in messages)
+
+
+@fixture
+def messages() -> Generator[list[ChatMessage]]:
+    yield [
+        ChatMessage(role="developer", content="You are an assistant."),
+        ChatMessage(role="user", content="Do you sell backpacks?"),
+        ChatMessage(role="assistant", content="Yes."),
+    ]
+
+
+def test_history_running_total(messages):
+    chat = MockChat()
+    history = ChatHistory(chat, messages[:1])
+    for message in messages[1:]:
+        history.append(message)
+    assert history.tokens == chat.count_tokens(messages)
+    assert history.messages == messages
+    assert len(history) == 3
+    assert history[-1] == messages[-1]
+
+
+def test_history_counts_each_message_once(messages):
+    chat = MockChat()
+    history = ChatHistory(chat)
+    for message in messages:
+        history.append(message)
+    assert chat.counted == [m.content for m in messages]
+
+
+def test_history_clear(messages):
+    history = ChatHistory(MockChat(), messages)
+    history.clear()
+    assert history.tokens == 0
+    assert history.messages == []
+
+
+def test_history_budget_summarizes_old_turns(messages):
+    chat = MockChat()
+    history = ChatHistory(chat, messages[:1], budget=20)
+    for i in range(6):
+        history.append(ChatMessage(role="user", content=f"question number {i}"))
+        history.append(ChatMessage(role="assistant", content=f"answer number {i}"))
+        assert history.tokens <= 20
+        assert history.tokens == chat.count_tokens(history.messages)
+
+    assert history.messages[0] == messages[0]
+    assert history.messages[1].content.endswith(f"summary {len(chat.prompts)}")
+    assert history.messages[-1].content == "answer number 5"
+    assert "question number 0" in chat.prompts[0]
+    assert f"summary {len(chat.prompts) - 1}" in chat.prompts[-1]
+    assert history.tokens_saved > 0
+    assert len(history.turn_savings) == 6
+    assert history.turn_savings[-1] == history.tokens_saved
+
+
+def test_history_without_budget_keeps_everything(messages):
+    chat = MockChat()
+    history = ChatHistory(chat, messages[:1])
+    for message in messages[1:] * 10:
+        history.append(message)
+    assert len(history) == 21
+    assert history.tokens_saved == 0
+    assert chat.prompts == []
+
+
+def test_history_turn_savings_are_bounded():
+    history = ChatHistory(MockChat(), budget=10, capacity=3)
+    for i in range(5):
+        history.append(ChatMessage(role="user", content=f"question number {i}"))
+        history.append(ChatMessage(role="assistant", content=f"answer number {i}"))
+    assert len(history.turn_savings) == 3
+    assert history.turn_savings[-1] == history.tokens_saved
+
+
+def test_chat_bot_summarizes_under_token_limit():
+    # The summary prompt with the evicted turns exceeds the limit of the
+    # chat that answers.
+    chat = ScriptedChat(default="Sure, we have plenty of those in stock.")
+    question = (
+        "Do you sell a light waterproof jacket with a hood and zipped pockets "
+        "for hiking in the rain, ideally in dark blue or green, in size medium, "
+        "for less than a hundred dollars, item {}?"
+    )
+    bot = SimpleChatBot(SafeChatDecorator(chat, limit=100), history_budget=60)
+    with pytest.raises(ValueError, match="Token limit exceeded"):
+        for i in range(10):
+            bot.respond(ChatMessage(role="user", content=question.format(i)))
+    bot = SimpleChatBot(
+        SafeChatDecorator(chat, limit=100), history_budget=60, auxiliary_chat=chat
+    )
+    for i in range(10):
+        bot.respond(ChatMessage(role="user", content=question.format(i)))
+    assert bot._history.tokens <= 60
+    assert bot._history.summary is not None
+
+
+def test_chat_bot_caps_long_summaries():
+    # The app's settings, with summaries longer than the headroom the
+    # limit leaves over the budget.
+    summary = " ".join(f"detail{i}" for i in range(45))
+    chat = ScriptedChat(
+        rules=[("Write a summary", summary)],
+        default="Sure, we have plenty of those in stock.",
+    )
+    bot = SimpleChatBot(
+        SafeChatDecorator(chat, limit=100), history_budget=60, auxiliary_chat=chat
+    )
+    for i in range(20):
+        bot.respond(ChatMessage(role="user", content=f"Do you sell hiking boots {i}?"))
+        assert bot._history.tokens <= 60
+    assert bot._history.summary.endswith(": " + " ".join(summary.split()[:15]))
+    # At most one summary per turn, where each append used to need one.
+    assert chat.calls <= 2 * 20
+    chat.calls = 0
+    bot = SimpleChatBot(chat, history_budget=200, auxiliary_chat=chat)
+    for i in range(20):
+        bot.respond(ChatMessage(role="user", content=f"Do you sell hiking boots {i}?"))
+    # Compaction frees half the budget, so summaries come every few turns.
+    assert chat.calls - 20 <= 5
+
+
+def test_safe_chat_checks_running_total(messages):
+    chat = MockChat()
+    history = ChatHistory(chat, messages)
+    question = ChatMessage(role="user", content="And bags?")
+    chat.counted.clear()
+    SafeChatDecorator(chat, limit=20).chat(history.prompt(question))
+    assert chat.counted == ["And bags?"]
+    assert history.prompt(question).tokens == chat.count_tokens([*messages, question])
+    with pytest.raises(ValueError):
+        SafeChatDecorator(chat, limit=5).chat(history.messages)
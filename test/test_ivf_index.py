@@ -0,0 +1,160 @@
+import shutil
+from collections.abc import Generator
+
+import numpy as np
+import pytest
+from pytest import fixture
+
+from rag_assistant.retrieval.ivf_index import IVFVectorIndex
+from rag_assistant.retrieval.kmeans import kmeans
+from rag_assistant.retrieval.vector_index import Filter, NumpyVectorIndex
+
+
+@fixture
+def clustered_dataset() -> Generator[tuple[list[str], np.ndarray]]:
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(32, 24))
+    labels = rng.integers(0, len(centers), size=4000)
+    vectors = centers[labels] + 0.3 * rng.normal(size=(len(labels), 24))
+    yield [str(i) for i in range(len(vectors))], vectors
+
+
+@fixture
+def queries() -> Generator[np.ndarray]:
+    yield np.random.default_rng(1).normal(size=(50, 24))
+
+
+@fixture
+def index_dir() -> Generator[str]:
+    path = "/tmp/mock_ivf_vector_index_dir"
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def recall_at_k(
+    index: IVFVectorIndex, exact: NumpyVectorIndex, queries: np.ndarray, k: int
+) -> float:
+    found = 0
+    for q in queries:
+        found += len(set(index.search(q, k)) & set(exact.search(q, k)))
+    return found / (k * len(queries))
+
+
+def test_kmeans_separates_clusters():
+    rng = np.random.default_rng(0)
+    data = np.concatenate([rng.normal(-5, 1, (100, 2)), rng.normal(5, 1, (100, 2))])
+    centroids = kmeans(data, 2)
+    assert sorted(np.round(centroids[:, 0] / 5).tolist()) == [-1, 1]
+
+
+def test_ivf_untrained_is_exact():
+    index = IVFVectorIndex(3, nlist=10)
+    index.insert([("Apple", np.array([1, 1, 1])), ("Melon", np.array([-1, -1, 1]))])
+    assert not index.trained
+    assert index.search(np.array([1, 0.5, 1]), 2) == ["Apple", "Melon"]
+
+
+@pytest.mark.parametrize("nprobe,min_recall", [(1, 0.5), (4, 0.9), (32, 1.0)])
+def test_ivf_recall(clustered_dataset, queries, nprobe, min_recall):
+    documents, vectors = clustered_dataset
+    exact = NumpyVectorIndex(24)
+    exact.insert_array(documents, vectors)
+    index = IVFVectorIndex(24, nlist=32, nprobe=nprobe)
+    index.insert_array(documents[:1000], vectors[:1000])
+    index.train()
+    index.insert_array(documents[1000:], vectors[1000:])
+    assert recall_at_k(index, exact, queries, 10) >= min_recall
+
+
+def test_ivf_exhaustive_matches_exact(clustered_dataset, queries):
+    documents, vectors = clustered_dataset
+    exact = NumpyVectorIndex(24)
+    exact.insert_array(documents, vectors)
+    index = IVFVectorIndex(24, nlist=16, nprobe=16)
+    index.insert_array(documents, vectors)
+    index.train()
+    assert index.search_batch(queries, 10) == exact.search_batch(queries, 10)
+
+
+def test_ivf_save_and_load(clustered_dataset, queries, index_dir):
+    documents, vectors = clustered_dataset
+    index = IVFVectorIndex(24, nlist=32, nprobe=4)
+    index.insert_array(documents, vectors)
+    index.train()
+    index.save(index_dir)
+    loaded = IVFVectorIndex.load(index_dir, nprobe=4)
+    assert loaded.trained
+    assert loaded.search_batch(queries, 10) == index.search_batch(queries, 10)
+
+
+def test_ivf_untrained_save_and_load(clustered_dataset, queries, index_dir):
+    documents, vectors = clustered_dataset
+    trained = IVFVectorIndex(24, nlist=32)
+    trained.insert_array(documents, vectors)
+    trained.train()
+    trained.save(index_dir)
+    index = IVFVectorIndex(24, nlist=32)
+    index.insert_array(documents[:10], vectors[:10])
+    index.save(index_dir)
+    assert not index.trained
+    loaded = IVFVectorIndex.load(index_dir)
+    assert not loaded.trained
+    assert loaded.search_batch(queries, 3) == index.search_batch(queries, 3)
+    loaded.insert_array(documents[10:], vectors[10:])
+    loaded.train()
+    assert loaded._centroids.shape == (32, 24)
+
+
+def test_ivf_trains_on_insert(clustered_dataset, queries):
+    documents, vectors = clustered_dataset
+    index = IVFVectorIndex(24, nlist=16, train_size=2000)
+    index.insert_array(documents[:1000], vectors[:1000])
+    index.search(queries[0], 5)
+    assert not index.trained
+    index.insert_array(documents[1000:], vectors[1000:])
+    assert index.trained
+
+
+def test_ivf_filtered_search(clustered_dataset, queries):
+    documents, vectors = clustered_dataset
+    categories = ["even" if i % 2 == 0 else "odd" for i in range(len(documents))]
+    index = IVFVectorIndex(24, nlist=16, nprobe=16)
+    index.insert_array(documents, vectors, categories, np.zeros(len(documents)))
+    index.train()
+    exact = NumpyVectorIndex(24)
+    exact.insert_array(documents, vectors, categories, np.zeros(len(documents)))
+    where = Filter(category="odd")
+    for q in queries[:10]:
+        results = index.search(q, 5, where)
+        assert all(int(document) % 2 == 1 for document in results)
+        assert results == exact.search(q, 5, where)
+
+
+def test_ivf_selective_filter_returns_k(clustered_dataset, queries):
+    documents, vectors = clustered_dataset
+    categories = ["rare" if i % 500 == 0 else "common" for i in range(len(documents))]
+    index = IVFVectorIndex(24, nlist=16, nprobe=1)
+    index.insert_array(documents, vectors, categories, np.zeros(len(documents)))
+    index.train()
+    exact = NumpyVectorIndex(24)
+    exact.insert_array(documents, vectors, categories, np.zeros(len(documents)))
+    where = Filter(category="rare")
+    for q in queries[:10]:
+        assert index.search(q, 5, where) == exact.search(q, 5, where)
+
+
+def test_ivf_delete_and_compact(clustered_dataset, queries):
+    documents, vectors = clustered_dataset
+    ids = list(range(len(documents)))
+    index = IVFVectorIndex(24, nlist=16, nprobe=16)
+    index.insert_array(documents, vectors, ids=ids)
+    index.train()
+    exact = NumpyVectorIndex(24)
+    exact.insert_array(documents[1::2], vectors[1::2])
+    index.delete(ids[::2])
+    for q in queries[:5]:
+        assert index.search(q, 5) == exact.search(q, 5)
+    index.compact()
+    assert len(index) == len(exact)
+    for q in queries[:5]:
+        assert index.search(q, 5) == exact.search(q, 5)
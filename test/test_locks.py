@@ -0,0 +1,49 @@
+import threading
+import time
+
+from rag_assistant.locks import ReadWriteLock
+
+
+def test_readers_share_lock():
+    lock = ReadWriteLock()
+    inside = threading.Barrier(2, timeout=1)
+
+    def reader():
+        with lock.read():
+            inside.wait()
+
+    threads = [threading.Thread(target=reader) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_writer_excludes_readers():
+    lock = ReadWriteLock()
+    events = []
+    reading = threading.Event()
+
+    def reader():
+        with lock.read():
+            reading.set()
+            time.sleep(0.05)
+            events.append("read")
+
+    def writer():
+        reading.wait()
+        with lock.write():
+            events.append("write")
+
+    def late_reader():
+        # Queued behind the waiting writer.
+        time.sleep(0.02)
+        with lock.read():
+            events.append("late read")
+
+    threads = [threading.Thread(target=f) for f in (reader, writer, late_reader)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert events == ["read", "write", "late read"]
@@ -5,8 +5,10 @@ from collections.abc import Generator
 from pytest import fixture
 
 from rag_assistant.database.product_database import (
+    Product,
     SQLiteProductDatabase,
     get_fake_store_data,
+    product_hash,
 )
 
 
@@ -15,6 +17,7 @@ class MockSQLiteProductDatabase(SQLiteProductDatabase):
 
     def __init__(self):
         self._connection = sqlite3.connect(self.file)
+        self._configure()
 
     def close(self) -> None:
         self._connection.close()
@@ -28,6 +31,29 @@ def mock_sqlite_database_empty() -> Generator[MockSQLiteProductDatabase]:
     database.close()
 
 
+def make_products(n: int) -> list[Product]:
+    return [
+        Product(
+            id=i,
+            title=f"Product {i}",
+            price=i + 0.5,
+            description=f"Description {i}",
+            category="electronics" if i % 2 else "jewelery",
+            image=f"https://example.com/{i}.jpg",
+        )
+        for i in range(1, n + 1)
+    ]
+
+
+@fixture
+def mock_sqlite_database_local(
+    mock_sqlite_database_empty,
+) -> Generator[MockSQLiteProductDatabase]:
+    mock_sqlite_database_empty.create_tables()
+    mock_sqlite_database_empty.insert_products(make_products(1200))
+    yield mock_sqlite_database_empty
+
+
 @fixture
 def mock_sqlite_database_full(
     mock_sqlite_database_empty,
@@ -62,3 +88,122 @@ def test_sqlite_insert_and_fetch_all(mock_sqlite_database_empty):
         assert i.description == o.description
         assert i.category == o.category
         assert i.image == o.image
+
+
+def test_sqlite_fetch_products(mock_sqlite_database_local):
+    # More ids than fit in one IN (...) chunk, in a non-sorted order.
+    ids = [1100, 3, 5000, *range(1, 1001)]
+    products = mock_sqlite_database_local.fetch_products(ids)
+    assert [p.id for p in products] == [1100, 3, *range(1, 1001)]
+    assert products[0].title == "Product 1100"
+    assert mock_sqlite_database_local.fetch_products(7)[0].price == 7.5
+
+
+def test_sqlite_upsert(mock_sqlite_database_local):
+    product = make_products(2)[1].model_copy(update={"title": "Renamed"})
+    mock_sqlite_database_local.insert_products([product, *make_products(1201)[-1:]])
+    assert mock_sqlite_database_local.fetch_products(2)[0].title == "Renamed"
+    assert len(mock_sqlite_database_local.fetch_all()) == 1201
+
+
+def test_sqlite_delete(mock_sqlite_database_local):
+    mock_sqlite_database_local.delete_products(list(range(1, 1001)))
+    mock_sqlite_database_local.delete_products(1100)
+    remaining = [p.id for p in mock_sqlite_database_local.fetch_all()]
+    assert sorted(remaining) == [i for i in range(1001, 1201) if i != 1100]
+    mock_sqlite_database_local.delete_all()
+    assert mock_sqlite_database_local.fetch_all() == []
+
+
+def test_sqlite_iter_all(mock_sqlite_database_local):
+    products = mock_sqlite_database_local.iter_all(batch_size=100)
+    assert next(products).id == 1
+    assert [p.id for p in products] == list(range(2, 1201))
+
+
+def test_sqlite_content_hashes(mock_sqlite_database_local):
+    hashes = mock_sqlite_database_local.fetch_hashes()
+    assert len(hashes) == 1200
+    assert hashes[5] == product_hash(make_products(5)[-1])
+    cur = mock_sqlite_database_local._connection.execute(
+        "SELECT updated_at FROM products WHERE id = 5"
+    )
+    updated_at = cur.fetchone()[0]
+    mock_sqlite_database_local.insert_products(make_products(5)[-1])
+    changed = make_products(6)[-1].model_copy(update={"price": 1.0})
+    mock_sqlite_database_local.insert_products(changed)
+    cur = mock_sqlite_database_local._connection.execute(
+        "SELECT id, updated_at FROM products WHERE id IN (5, 6) ORDER BY id"
+    )
+    (_, unchanged_at), (_, changed_at) = cur.fetchall()
+    assert unchanged_at == updated_at
+    assert changed_at > updated_at
+    assert mock_sqlite_database_local.fetch_hashes()[6] == product_hash(changed)
+
+
+def test_sqlite_migrates_old_table(mock_sqlite_database_empty):
+    mock_sqlite_database_empty._connection.execute("""
+        CREATE TABLE products (
+            id INTEGER PRIMARY KEY,
+            title STRING NOT NULL,
+            price FLOAT NOT NULL,
+            description STR DEFAULT '',
+            category STRING NOT NULL,
+            image STRING
+        )
+    """)
+    product = make_products(1)[0]
+    mock_sqlite_database_empty._connection.execute(
+        "INSERT INTO products VALUES (1, ?, ?, ?, ?, ?)",
+        (
+            product.title,
+            product.price,
+            product.description,
+            product.category,
+            str(product.image),
+        ),
+    )
+    mock_sqlite_database_empty.create_tables()
+    assert mock_sqlite_database_empty.fetch_hashes() == {1: product_hash(product)}
+
+
+def test_sqlite_iter_rows(mock_sqlite_database_local):
+    rows = mock_sqlite_database_local.iter_rows(batch_size=100)
+    products = mock_sqlite_database_local.iter_all()
+    for row, product in zip(rows, products, strict=True):
+        assert str(row) == str(product)
+        assert row.to_product() == product
+
+
+# Image URLs as served by the fake store, plus forms pydantic normalizes.
+CATALOG_IMAGES = [
+    "https://fakestoreapi.com/img/81fPKd-2AYL._AC_SL1500_.jpg",
+    "https://fakestoreapi.com/img/71-3HjGNDUL._AC_SY879._SX._UX._SY._UY_.jpg",
+    "https://fakestoreapi.com/img/61pHAEJ4NML._AC_UX679_t.png",
+    "https://FakeStoreAPI.com",
+    "https://fakestoreapi.com/img/a b.jpg?size=1&q=ä#top",
+]
+
+
+def test_sqlite_rows_format_like_products(mock_sqlite_database_empty):
+    # Rows must produce the same document text as the products they were
+    # stored from, whatever pydantic does to the URL.
+    mock_sqlite_database_empty.create_tables()
+    products = [
+        Product(**{**product.model_dump(), "image": image})
+        for product, image in zip(
+            make_products(len(CATALOG_IMAGES)), CATALOG_IMAGES, strict=True
+        )
+    ]
+    mock_sqlite_database_empty.insert_products(products)
+    rows = list(mock_sqlite_database_empty.iter_rows())
+    assert [str(row) for row in rows] == [str(product) for product in products]
+
+
+def test_sqlite_rows_format_like_fake_store(mock_sqlite_database_full):
+    for row, product in zip(
+        mock_sqlite_database_full.iter_rows(),
+        mock_sqlite_database_full.iter_all(),
+        strict=True,
+    ):
+        assert str(row) == str(product)
@@ -0,0 +1,170 @@
+import shutil
+from collections.abc import Generator
+
+import numpy as np
+import pytest
+from pytest import fixture
+
+from rag_assistant.retrieval.quantization import PQVectorIndex, ProductQuantizer
+from rag_assistant.retrieval.vector_index import Filter, NumpyVectorIndex
+
+
+@fixture
+def clustered_dataset() -> Generator[tuple[list[str], np.ndarray]]:
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(64, 30))
+    labels = rng.integers(0, len(centers), size=3000)
+    vectors = centers[labels] + 0.4 * rng.normal(size=(len(labels), 30))
+    yield [str(i) for i in range(len(vectors))], vectors
+
+
+@fixture
+def queries(clustered_dataset) -> Generator[np.ndarray]:
+    _, vectors = clustered_dataset
+    rng = np.random.default_rng(1)
+    yield vectors[rng.choice(len(vectors), 40)] + 0.1 * rng.normal(size=(40, 30))
+
+
+@fixture
+def index_dir() -> Generator[str]:
+    path = "/tmp/mock_pq_vector_index_dir"
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def recall_at_k(
+    index: PQVectorIndex, exact: NumpyVectorIndex, queries: np.ndarray, k: int
+) -> float:
+    found = 0
+    for q in queries:
+        found += len(set(index.search(q, k)) & set(exact.search(q, k)))
+    return found / (k * len(queries))
+
+
+def test_product_quantizer_roundtrip(clustered_dataset):
+    _, vectors = clustered_dataset
+    quantizer = ProductQuantizer(30, m=7, nbits=6)
+    quantizer.train(vectors)
+    codes = quantizer.encode(vectors)
+    assert codes.shape == (len(vectors), 7)
+    assert codes.max() < 64
+    error = np.linalg.norm(quantizer.decode(codes) - vectors, axis=1)
+    assert error.mean() < 0.5 * np.linalg.norm(vectors, axis=1).mean()
+
+
+def test_product_quantizer_scores(clustered_dataset):
+    _, vectors = clustered_dataset
+    quantizer = ProductQuantizer(30, m=5)
+    quantizer.train(vectors)
+    codes = quantizer.encode(vectors[:10])
+    q = vectors[0].astype(np.float32)
+    np.testing.assert_allclose(
+        quantizer.scores(codes, quantizer.lookup_table(q)),
+        quantizer.decode(codes) @ q,
+        rtol=1e-4,
+    )
+
+
+def test_pq_untrained_is_exact():
+    index = PQVectorIndex(3, m=3)
+    index.insert([("Apple", np.array([1, 1, 1])), ("Melon", np.array([-1, -1, 1]))])
+    assert not index.trained
+    assert index.search(np.array([1, 0.5, 1]), 2) == ["Apple", "Melon"]
+
+
+def test_pq_search_with_scores(clustered_dataset, queries):
+    documents, vectors = clustered_dataset
+    exact = NumpyVectorIndex(30)
+    exact.insert_array(documents, vectors)
+    index = PQVectorIndex(30, m=10, rerank=50)
+    index.insert_array(documents, vectors)
+    index.train()
+    results = index.search_with_scores(queries[0], 5)
+    assert [document for document, _ in results] == index.search(queries[0], 5)
+    expected = dict(exact.search_with_scores(queries[0], 5))
+    for document, score in results:
+        if document in expected:
+            assert score == pytest.approx(expected[document], abs=1e-4)
+
+
+def test_pq_rejects_attributes_and_filters():
+    index = PQVectorIndex(3, m=3)
+    with pytest.raises(ValueError, match="attributes"):
+        index.insert_array(["Apple"], np.ones((1, 3)), categories=["fruit"])
+    with pytest.raises(ValueError, match="filters"):
+        index.search(np.ones(3), 1, Filter(category="fruit"))
+
+
+@pytest.mark.parametrize("rerank,min_recall", [(0, 0.5), (50, 0.95)])
+def test_pq_recall(clustered_dataset, queries, rerank, min_recall):
+    documents, vectors = clustered_dataset
+    exact = NumpyVectorIndex(30)
+    exact.insert_array(documents, vectors)
+    index = PQVectorIndex(30, m=10, rerank=rerank)
+    index.insert_array(documents[:2000], vectors[:2000])
+    index.train()
+    index.insert_array(documents[2000:], vectors[2000:])
+    assert recall_at_k(index, exact, queries, 10) >= min_recall
+
+
+def test_pq_compression(clustered_dataset):
+    documents, vectors = clustered_dataset
+    index = PQVectorIndex(30, m=5)
+    index.insert_array(documents, vectors)
+    index.train()
+    exact = NumpyVectorIndex(30)
+    exact.insert_array(documents, vectors)
+    assert exact._vectors[: len(exact)].nbytes / index.nbytes == 24
+
+
+def test_pq_save_and_load(clustered_dataset, queries, index_dir):
+    documents, vectors = clustered_dataset
+    index = PQVectorIndex(30, m=10, rerank=20)
+    index.insert_array(documents, vectors)
+    index.train()
+    index.save(index_dir)
+    loaded = PQVectorIndex.load(index_dir, rerank=20)
+    assert [loaded.search(q, 5) for q in queries] == [
+        index.search(q, 5) for q in queries
+    ]
+    compressed = PQVectorIndex.load(index_dir)
+    assert compressed.nbytes == len(documents) * 10
+
+
+def test_pq_untrained_save_and_load(clustered_dataset, queries, index_dir):
+    documents, vectors = clustered_dataset
+    trained = PQVectorIndex(30, m=10)
+    trained.insert_array(documents, vectors)
+    trained.train()
+    trained.save(index_dir)
+    index = PQVectorIndex(30, m=10)
+    index.insert_array(documents[:10], vectors[:10])
+    index.save(index_dir)
+    loaded = PQVectorIndex.load(index_dir)
+    assert not loaded.trained
+    assert [loaded.search(q, 3) for q in queries] == [
+        index.search(q, 3) for q in queries
+    ]
+    loaded.insert_array(documents[10:], vectors[10:])
+    loaded.train()
+    assert loaded.nbytes == len(documents) * 10
+
+
+def test_pq_load_without_vectors_raises(clustered_dataset, index_dir):
+    documents, vectors = clustered_dataset
+    index = PQVectorIndex(30, m=10)
+    index.insert_array(documents, vectors)
+    index.train()
+    index.save(index_dir)
+    with pytest.raises(ValueError, match="full vectors"):
+        PQVectorIndex.load(index_dir, rerank=20)
+
+
+def test_pq_trains_on_insert(clustered_dataset, queries):
+    documents, vectors = clustered_dataset
+    index = PQVectorIndex(30, m=10, train_size=2000)
+    index.insert_array(documents[:1000], vectors[:1000])
+    index.search(queries[0], 5)
+    assert not index.trained
+    index.insert_array(documents[1000:], vectors[1000:])
+    assert index.trained
@@ -0,0 +1,98 @@
+import time
+from collections.abc import Generator
+
+import numpy as np
+from pytest import fixture
+
+from rag_assistant.llm.chat import ChatMessage
+from rag_assistant.llm.response_cache import SemanticResponseCache
+from rag_assistant.retrieval.embedding import Embedding
+from rag_assistant.retrieval.vector_index import Filter, NumpyVectorIndex
+
+
+class MockEmbedding(Embedding):
+    vectors = {
+        "cheapest backpack": [1.0, 0.0, 0.0],
+        "cheap backpack?": [0.99, 0.05, 0.0],
+        "warm jacket": [0.0, 1.0, 0.0],
+        "rain jacket": [0.0, 0.9, 0.4],
+    }
+    calls: int = 0
+
+    @property
+    def model(self) -> str:
+        return "mock"
+
+    @property
+    def dim(self) -> int:
+        return 3
+
+    def count_tokens(self, s: str) -> int:
+        return len(s.split())
+
+    def embed(self, s: str) -> list[float]:
+        self.calls += 1
+        return self.vectors[s]
+
+
+@fixture
+def answer() -> Generator[ChatMessage]:
+    yield ChatMessage(role="assistant", content="The Fjallraven backpack.")
+
+
+def test_semantic_cache_hit(answer):
+    cache = SemanticResponseCache(MockEmbedding(), threshold=0.95)
+    assert cache.lookup("cheapest backpack") is None
+    cache.store("cheapest backpack", answer)
+    assert cache.lookup("cheap backpack?") == answer
+    assert cache.lookup("warm jacket") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_semantic_cache_reuses_lookup_embedding(answer):
+    embedding = MockEmbedding()
+    cache = SemanticResponseCache(embedding)
+    cache.lookup("cheapest backpack")
+    cache.store("cheapest backpack", answer)
+    assert embedding.calls == 1
+
+
+def test_semantic_cache_ttl(answer):
+    cache = SemanticResponseCache(MockEmbedding(), ttl=0.01)
+    cache.store("cheapest backpack", answer)
+    time.sleep(0.02)
+    assert cache.lookup("cheapest backpack") is None
+    assert len(cache) == 0
+
+
+def test_semantic_cache_capacity(answer):
+    cache = SemanticResponseCache(MockEmbedding(), capacity=2)
+    cache.store("cheapest backpack", answer)
+    cache.store("warm jacket", answer)
+    cache.lookup("cheapest backpack")
+    cache.store("rain jacket", answer)
+    assert len(cache) == 2
+    assert cache.lookup("warm jacket") is None
+    assert cache.lookup("cheapest backpack") == answer
+    assert cache.lookup("rain jacket") == answer
+
+
+def test_semantic_cache_invalidated_by_source(answer):
+    products = NumpyVectorIndex(3)
+    cache = SemanticResponseCache(MockEmbedding(), source=products)
+    cache.store("cheapest backpack", answer)
+    assert cache.lookup("cheapest backpack") == answer
+    products.insert([("Backpack", np.array([1, 0, 0]))])
+    assert cache.lookup("cheapest backpack") is None
+
+
+def test_semantic_cache_keys_on_numbers_and_filter(answer):
+    class PriceBlindEmbedding(MockEmbedding):
+        def embed(self, s: str) -> list[float]:
+            return [1.0, 0.0, 0.0]
+
+    cache = SemanticResponseCache(PriceBlindEmbedding())
+    cache.store("backpacks under $50", answer, Filter(max_price=50))
+    assert cache.lookup("backpacks under $500", Filter(max_price=500)) is None
+    assert cache.lookup("backpacks under $50") is None
+    assert cache.lookup("Backpacks under 50?", Filter(max_price=50)) == answer
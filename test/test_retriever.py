@@ -0,0 +1,140 @@
+from collections.abc import Generator
+
+import numpy as np
+from pytest import fixture
+
+from rag_assistant.retrieval.bm25 import BM25Index, tokenize
+from rag_assistant.retrieval.embedding import Embedding
+from rag_assistant.retrieval.retriever import (
+    HybridRetriever,
+    VectorRetriever,
+    reciprocal_rank_fusion,
+)
+from rag_assistant.retrieval.vector_index import Filter, NumpyVectorIndex
+
+
+class CountingEmbedding(Embedding):
+    calls: int
+
+    def __init__(self):
+        self.calls = 0
+
+    @property
+    def model(self) -> str:
+        return "mock"
+
+    @property
+    def dim(self) -> int:
+        return 2
+
+    def count_tokens(self, s: str) -> int:
+        return len(s.split())
+
+    def embed(self, s: str) -> list[float]:
+        self.calls += 1
+        return [1.0, 0.0] if "bag" in s else [0.0, 1.0]
+
+
+DOCUMENTS = {
+    "Fjallraven Backpack": (
+        "Fjallraven Foldsack No. 1 Backpack bags everyday laptop",
+        [1, 0.1],
+    ),
+    "Mens Casual Slim Fit": ("Mens Casual Slim Fit men's clothing", [0, 1]),
+    "Mens Cotton Jacket": ("Mens Cotton Jacket men's clothing outdoor", [0.1, 1]),
+    "Womens Rain Jacket": ("Womens Rain Jacket women's clothing", [0.2, 1]),
+}
+
+
+@fixture
+def lexical_index() -> Generator[BM25Index]:
+    index = BM25Index()
+    index.insert(list(DOCUMENTS), [text for text, _ in DOCUMENTS.values()])
+    yield index
+
+
+@fixture
+def vector_index() -> Generator[NumpyVectorIndex]:
+    index = NumpyVectorIndex(2)
+    index.insert(
+        [(document, np.array(vector)) for document, (_, vector) in DOCUMENTS.items()]
+    )
+    yield index
+
+
+def test_tokenize():
+    assert tokenize('Mens Casual-Slim Fit, 15"') == [
+        "mens",
+        "casual",
+        "slim",
+        "fit",
+        "15",
+    ]
+
+
+def test_bm25_ranks_exact_title_first(lexical_index):
+    results = lexical_index.search_with_scores("mens casual slim fit", 4)
+    assert results[0][0] == "Mens Casual Slim Fit"
+    assert results[1][0] == "Mens Cotton Jacket"
+    assert len(results) == 2
+    assert results[0][1] > results[1][1] > 0
+
+
+def test_bm25_no_match(lexical_index):
+    assert lexical_index.search("umbrella", 2) == []
+    assert BM25Index().search("jacket", 2) == []
+
+
+def test_bm25_incremental_insert(lexical_index):
+    lexical_index.insert(["Umbrella"], ["Umbrella rain"])
+    assert lexical_index.search("umbrella", 2) == ["Umbrella"]
+    assert lexical_index.search("rain", 2) == ["Umbrella", "Womens Rain Jacket"]
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "b", "d"]], 3)
+    assert fused == ["c", "b", "a"]
+    assert reciprocal_rank_fusion([["a"], ["b"]], 2) == ["a", "b"]
+
+
+def test_vector_retriever(vector_index):
+    retriever = VectorRetriever(CountingEmbedding(), vector_index)
+    assert retriever.search("bag", 1) == ["Fjallraven Backpack"]
+
+
+def test_hybrid_lexical_only_skips_embedding(lexical_index, vector_index):
+    embedding = CountingEmbedding()
+    retriever = HybridRetriever(lexical_index, embedding, vector_index)
+    assert retriever.search("Mens Casual Slim Fit", 1) == ["Mens Casual Slim Fit"]
+    assert embedding.calls == 0
+    assert retriever.lexical_only == 1
+
+
+def test_hybrid_fuses_vector_results(lexical_index, vector_index):
+    embedding = CountingEmbedding()
+    retriever = HybridRetriever(lexical_index, embedding, vector_index)
+    results = retriever.search("something to carry a bag", 2)
+    assert embedding.calls == 1
+    assert results[0] == "Fjallraven Backpack"
+    assert retriever.lexical_only == 0
+
+
+def test_hybrid_threshold_disabled(lexical_index, vector_index):
+    embedding = CountingEmbedding()
+    retriever = HybridRetriever(
+        lexical_index, embedding, vector_index, lexical_threshold=None
+    )
+    assert retriever.search("Mens Casual Slim Fit", 1) == ["Mens Casual Slim Fit"]
+    assert embedding.calls == 1
+
+
+def test_bm25_filter():
+    index = BM25Index()
+    index.insert(
+        ["Jacket A", "Jacket B", "Ring"],
+        ["rain jacket", "leather jacket", "gold ring"],
+        ["clothing", "clothing", "jewelery"],
+        [30.0, 150.0, 20.0],
+    )
+    assert index.search("jacket", 2, Filter(max_price=100)) == ["Jacket A"]
+    assert index.search("jacket", 2, Filter(category="jewelery")) == []
@@ -0,0 +1,111 @@
+import time
+from collections.abc import Generator
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from pytest import fixture
+
+from rag_assistant.retrieval.sharded_index import ShardedVectorIndex
+from rag_assistant.retrieval.vector_index import Filter, NumpyVectorIndex
+
+
+@fixture
+def vectors() -> Generator[np.ndarray]:
+    yield np.random.default_rng(0).normal(size=(2000, 16))
+
+
+def make_index(cls, vectors: np.ndarray, dtype=np.float32, **kwargs):
+    index = cls(16, dtype=dtype, **kwargs)
+    index._min_shard_rows = 0
+    index.insert_array(
+        [str(i) for i in range(len(vectors))],
+        vectors,
+        ["even" if i % 2 == 0 else "odd" for i in range(len(vectors))],
+        ids=list(range(len(vectors))),
+    )
+    return index
+
+
+@pytest.mark.parametrize("processes", [False, True])
+@pytest.mark.parametrize("dtype", [np.float32, np.float16])
+def test_sharded_search_matches_single_shard(vectors, processes, dtype):
+    exact = make_index(NumpyVectorIndex, vectors, dtype)
+    sharded = make_index(
+        ShardedVectorIndex, vectors, dtype, shards=3, processes=processes
+    )
+    queries = np.random.default_rng(1).normal(size=(20, 16))
+    try:
+        for q in queries:
+            assert sharded.search(q, 10) == exact.search(q, 10)
+        assert sharded._shm is not None
+        assert sharded.search_with_scores(queries[0], 5) == exact.search_with_scores(
+            queries[0], 5
+        )
+
+        for index in (exact, sharded):
+            index.delete(list(range(0, 2000, 3)))
+            index.insert_array(["new"], queries[:1])
+        for q in queries:
+            assert sharded.search(q, 10) == exact.search(q, 10)
+        assert sharded.search(queries[0], 1) == ["new"]
+        where = Filter(category="odd")
+        assert sharded.search(queries[1], 5, where) == exact.search(
+            queries[1], 5, where
+        )
+    finally:
+        sharded.close()
+
+
+def test_sharded_ties_and_small_k():
+    index = ShardedVectorIndex(2, shards=4)
+    index._min_shard_rows = 0
+    index.insert_array([str(i) for i in range(10)], np.ones((10, 2)))
+    assert index.search(np.array([1, 1]), 3) == ["0", "1", "2"]
+    assert index.search(np.array([1, 1]), 20) == [str(i) for i in range(10)]
+    index.delete([])
+    index.close()
+    assert index.search(np.array([1, 1]), 1) == ["0"]
+    index.close()
+
+
+@pytest.mark.parametrize("processes", [False, True])
+@pytest.mark.parametrize("dtype", [np.float32, np.float16])
+def test_sharded_duplicates_across_shards(processes, dtype):
+    rng = np.random.default_rng(2)
+    vectors = rng.normal(size=(3000, 16))
+    vectors[[1500, 2999]] = vectors[7]
+    exact = make_index(NumpyVectorIndex, vectors, dtype)
+    sharded = make_index(
+        ShardedVectorIndex, vectors, dtype, shards=4, processes=processes
+    )
+    queries = [vectors[7], *rng.normal(size=(50, 16))]
+    try:
+        for q in queries:
+            assert sharded.search_with_scores(q, 10) == exact.search_with_scores(q, 10)
+        assert sharded.search(vectors[7], 3) == ["7", "1500", "2999"]
+        for index in (exact, sharded):
+            index.delete(list(range(100, 3000)))
+        # More results asked for than there are live rows.
+        assert sharded.search(vectors[7], 500) == exact.search(vectors[7], 500)
+    finally:
+        sharded.close()
+
+
+def test_sharded_concurrent_searches_share_one_block(vectors):
+    index = make_index(ShardedVectorIndex, vectors, shards=3)
+    builds = []
+    build = index._build
+
+    def counting_build():
+        builds.append(1)
+        time.sleep(0.01)
+        build()
+
+    index._build = counting_build
+    q = vectors[0]
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(lambda _: index.search(q, 5), range(16)))
+    assert len(builds) == 1
+    assert all(result == results[0] for result in results)
+    index.close()
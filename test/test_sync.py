@@ -0,0 +1,100 @@
+from collections.abc import Generator
+
+import numpy as np
+from pytest import fixture
+
+from rag_assistant.database.product_database import Product, SQLiteProductDatabase
+from rag_assistant.retrieval.embedding import Embedding
+from rag_assistant.retrieval.sync import SyncResult, sync_vector_index
+from rag_assistant.retrieval.vector_index import Filter, NumpyVectorIndex
+
+
+class CountingEmbedding(Embedding):
+    texts: list[str]
+
+    def __init__(self):
+        self.texts = []
+
+    @property
+    def model(self) -> str:
+        return "mock"
+
+    @property
+    def dim(self) -> int:
+        return 3
+
+    def count_tokens(self, s: str) -> int:
+        return len(s.split())
+
+    def embed(self, s: str) -> list[float]:
+        self.texts.append(s)
+        return [float("bag" in s), float("ring" in s), 1.0]
+
+
+def make_product(i: int, description: str, price: float = 10.0) -> Product:
+    return Product(
+        id=i,
+        title=f"Product {i}",
+        price=price,
+        description=description,
+        category="bags" if "bag" in description else "jewelery",
+        image=f"https://example.com/{i}.jpg",
+    )
+
+
+@fixture
+def database() -> Generator[SQLiteProductDatabase]:
+    database = SQLiteProductDatabase(":memory:")
+    database.create_tables()
+    database.insert_products(
+        [make_product(1, "a bag"), make_product(2, "a ring"), make_product(3, "a hat")]
+    )
+    yield database
+    database.close()
+
+
+def test_sync_embeds_only_changes(database):
+    embedding = CountingEmbedding()
+    index = NumpyVectorIndex(3)
+    assert sync_vector_index(database, index, embedding) == SyncResult(inserted=3)
+    assert len(embedding.texts) == 3
+
+    embedding.texts.clear()
+    assert sync_vector_index(database, index, embedding) == SyncResult()
+    assert embedding.texts == []
+
+    database.insert_products(
+        [make_product(1, "a bag"), make_product(2, "a gold ring", price=99.0)]
+    )
+    database.insert_products(make_product(4, "a big bag"))
+    database.delete_products(3)
+    result = sync_vector_index(database, index, embedding)
+    assert result == SyncResult(inserted=1, updated=1, deleted=1)
+    assert sorted(embedding.texts) == ["a big bag", "a gold ring"]
+    assert sorted(index.content_hashes()) == [1, 2, 4]
+
+    ring = index.search(np.array([0, 1, 0]), 4)
+    assert len(ring) == 3
+    assert "gold ring" in ring[0]
+    assert all("a hat" not in document for document in ring)
+    assert index.search(np.array([0, 1, 0]), 1, Filter(max_price=50)) != ring[:1]
+
+
+def test_sync_compacts_tombstones(database):
+    index = NumpyVectorIndex(3)
+    sync_vector_index(database, index, CountingEmbedding())
+    database.delete_products([1, 2])
+    sync_vector_index(database, index, CountingEmbedding())
+    assert len(index) == 1
+    assert index.deleted == 0
+    assert index.search(np.array([1, 0, 0]), 2) == [str(make_product(3, "a hat"))]
+
+
+def test_sync_saved_index(database, tmp_path):
+    index = NumpyVectorIndex(3)
+    sync_vector_index(database, index, CountingEmbedding())
+    index.save(str(tmp_path))
+    loaded = NumpyVectorIndex.load(str(tmp_path))
+    embedding = CountingEmbedding()
+    assert sync_vector_index(database, loaded, embedding) == SyncResult()
+    assert loaded.content_hashes() == index.content_hashes()
@@ -0,0 +1,175 @@
+import contextvars
+import json
+import threading
+from collections.abc import Generator
+
+import numpy as np
+from pytest import fixture
+
+from rag_assistant.llm.agent import SimpleRAGAgent
+from rag_assistant.llm.chat import (
+    CachedChatDecorator,
+    Chat,
+    ChatMessage,
+    TracingChatDecorator,
+)
+from rag_assistant.retrieval.embedding import Embedding, TracingEmbeddingDecorator
+from rag_assistant.retrieval.vector_index import (
+    NumpyVectorIndex,
+    TracingVectorIndexDecorator,
+)
+from rag_assistant.tracing import Tracer
+
+
+class MockChat(Chat):
+    @property
+    def model(self) -> str:
+        return "mock"
+
+    def chat(self, messages: list[ChatMessage]) -> ChatMessage:
+        if "Do we need to search" in messages[-1].content:
+            return ChatMessage(role="assistant", content="yes")
+        return ChatMessage(role="assistant", content="two words")
+
+    def count_tokens(self, messages: list[ChatMessage]) -> int:
+        return sum(self.count_message_tokens(m) for m in messages)
+
+    def count_message_tokens(self, message: ChatMessage) -> int:
+        return len(message.content.split())
+
+
+class MockEmbedding(Embedding):
+    @property
+    def model(self) -> str:
+        return "mock"
+
+    @property
+    def dim(self) -> int:
+        return 2
+
+    def count_tokens(self, s: str) -> int:
+        return len(s.split())
+
+    def embed(self, s: str) -> list[float]:
+        return [1.0, 0.0]
+
+
+@fixture
+def tracer() -> Generator[Tracer]:
+    yield Tracer()
+
+
+def test_spans_belong_to_turn(tracer):
+    def worker(name):
+        with tracer.span(name):
+            pass
+
+    with tracer.turn(user="a") as record:
+        with tracer.span("outer", tokens=3) as attributes:
+            attributes["extra"] = 1
+        context = contextvars.copy_context()
+        thread = threading.Thread(target=context.run, args=(worker, "copied"))
+        thread.start()
+        thread.join()
+        thread = threading.Thread(target=worker, args=("uncopied",))
+        thread.start()
+        thread.join()
+    assert [span.name for span in record.spans] == ["outer", "copied"]
+    assert record.spans[0].attributes == {"tokens": 3, "extra": 1}
+    assert [r.spans[0].name for r in tracer.records] == ["uncopied", "outer"]
+    assert [r.turn for r in tracer.records] == [False, True]
+
+
+def test_concurrent_turns(tracer):
+    def session(name):
+        with tracer.turn(session=name):
+            for _ in range(50):
+                with tracer.span(name):
+                    pass
+
+    threads = [threading.Thread(target=session, args=(str(i),)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for record in tracer.records:
+        assert {span.name for span in record.spans} == {record.attributes["session"]}
+
+
+def test_summary(tracer):
+    for tokens in range(1, 11):
+        with tracer.turn(), tracer.span("chat.chat", prompt_tokens=tokens):
+            pass
+    summary = tracer.summary()
+    assert summary["turn"]["count"] == 10
+    assert summary["chat.chat"]["count"] == 10
+    assert summary["chat.chat"]["prompt_tokens"] == 55
+    assert summary["chat.chat"]["p50"] <= summary["chat.chat"]["p99"]
+
+
+def test_jsonl_export(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    tracer = Tracer(path=str(path))
+    for _ in range(2):
+        with tracer.turn(), tracer.span("index.search", k=2):
+            pass
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert len(lines) == 2
+    assert lines[0]["spans"][0]["name"] == "index.search"
+    assert lines[0]["spans"][0]["attributes"] == {"k": 2}
+    tracer.export(str(tmp_path / "copy.jsonl"))
+    assert (tmp_path / "copy.jsonl").read_text() == path.read_text()
+
+
+def test_disabled_tracer_records_nothing():
+    tracer = Tracer(enabled=False)
+    chat = TracingChatDecorator(MockChat(), tracer)
+    with tracer.turn():
+        chat.chat([ChatMessage(role="user", content="hi")])
+        assert list(chat.stream([ChatMessage(role="user", content="hi")]))
+    assert len(tracer.records) == 0
+    assert tracer.summary() == {}
+
+
+def test_chat_decorator_tokens_and_cache_hits(tracer):
+    chat = TracingChatDecorator(CachedChatDecorator(MockChat()), tracer)
+    messages = [ChatMessage(role="user", content="three word question")]
+    with tracer.turn() as record:
+        chat.chat(messages)
+        chat.chat(messages)
+        assert "".join(chat.stream(messages)) == "two words"
+    first, second, streamed = record.spans
+    assert first.attributes["prompt_tokens"] == 3
+    assert first.attributes["completion_tokens"] == 2
+    assert not first.attributes["cache_hit"]
+    assert second.attributes["cache_hit"]
+    assert streamed.name == "chat.stream"
+    assert "first_token" in streamed.attributes
+
+
+def test_agent_turn_records(tracer):
+    index = NumpyVectorIndex(2)
+    index.insert([("Backpack", np.array([1, 0])), ("Jacket", np.array([0, 1]))])
+    agent = SimpleRAGAgent(
+        TracingChatDecorator(MockChat(), tracer),
+        TracingVectorIndexDecorator(index, tracer),
+        TracingEmbeddingDecorator(MockEmbedding(), tracer),
+        auxiliary_chat=TracingChatDecorator(MockChat(), tracer, "auxiliary_chat"),
+        tracer=tracer,
+    )
+    agent.respond(ChatMessage(role="user", content="Do you sell backpacks?"))
+    "".join(agent.respond_stream(ChatMessage(role="user", content="And jackets?")))
+    assert len(tracer.records) == 2
+    names = {span.name for span in tracer.records[0].spans}
+    assert {
+        "agent.decide",
+        "agent.query",
+        "agent.embed",
+        "agent.search",
+        "agent.answer",
+        "auxiliary_chat.chat",
+        "embedding.embed",
+        "index.search",
+        "chat.chat",
+    } <= names
+    assert "chat.stream" in {span.name for span in tracer.records[1].spans}
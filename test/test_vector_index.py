@@ -1,10 +1,21 @@
+import os
+import shutil
+import threading
 from collections.abc import Generator
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import pytest
 from pytest import fixture
 
-from rag_assistant.retrieval.vector_index import NumpyVectorIndex
+from rag_assistant.retrieval.vector_index import (
+    DocumentStore,
+    Filter,
+    NumpyVectorIndex,
+    cosine_similarity,
+    top_k,
+    top_k_rows,
+)
 
 
 @fixture
@@ -12,6 +23,13 @@ def pandas_vector_index() -> Generator[NumpyVectorIndex]:
     yield NumpyVectorIndex(3, 10)
 
 
+@fixture
+def index_dir() -> Generator[str]:
+    path = "/tmp/mock_numpy_vector_index_dir"
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
+
+
 @fixture
 def dataset() -> Generator[dict[str, np.ndarray]]:
     data = [
@@ -38,3 +56,271 @@ def test_numpy_insert_and_search(pandas_vector_index, dataset, query, answer):
     pandas_vector_index.insert(dataset)
     document = pandas_vector_index.search(query, 1)[0]
     assert document == answer
+
+
+@fixture
+def random_dataset() -> Generator[list[tuple[str, np.ndarray]]]:
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(500, 16))
+    yield [(str(i), v) for i, v in enumerate(vectors)]
+
+
+def test_numpy_search_matches_argsort(random_dataset):
+    index = NumpyVectorIndex(16, 1000)
+    index.insert(random_dataset)
+    vectors = np.stack([v for _, v in random_dataset])
+    rng = np.random.default_rng(1)
+    for query in rng.normal(size=(20, 16)):
+        expected = np.argsort(cosine_similarity(vectors, query))[::-1][:10]
+        assert index.search(query, 10) == [str(i) for i in expected]
+
+
+def test_numpy_search_only_filled(pandas_vector_index, dataset):
+    pandas_vector_index.insert(dataset)
+    assert pandas_vector_index.search(np.array([0, 0, -1]), 5) == ["Apple", "Melon"]
+
+
+@pytest.mark.parametrize(
+    "scores,k,answer",
+    [
+        ([0.1, 0.5, 0.3], 2, [1, 2]),
+        ([0.1, 0.5, 0.3], 5, [1, 2, 0]),
+        ([0.5, 0.1, 0.5, 0.5], 2, [0, 2]),
+        ([0.1, 0.5], 0, []),
+    ],
+)
+def test_top_k(scores, k, answer):
+    assert top_k(np.array(scores), k).tolist() == answer
+
+
+@pytest.mark.parametrize("block_size", [1, 600, 1 << 24])
+def test_numpy_search_batch(random_dataset, block_size):
+    index = NumpyVectorIndex(16, 1000)
+    index._block_size = block_size
+    index.insert(random_dataset)
+    queries = np.random.default_rng(2).normal(size=(30, 16))
+    assert index.search_batch(queries, 7) == [index.search(q, 7) for q in queries]
+
+
+def test_numpy_search_batch_near_duplicates():
+    # Near-ties are where batched and single-query scores round differently.
+    rng = np.random.default_rng(0)
+    base = rng.normal(size=(50, 16))
+    vectors = base[rng.integers(0, 50, 5000)] + 1e-4 * rng.normal(size=(5000, 16))
+    index = NumpyVectorIndex(16, 5000)
+    index.insert_array([str(i) for i in range(5000)], vectors)
+    queries = rng.normal(size=(200, 16))
+    assert index.search_batch(queries, 10) == [index.search(q, 10) for q in queries]
+
+
+def test_top_k_rows():
+    scores = np.array([[0.1, 0.5, 0.3], [0.5, 0.1, 0.5], [0.2, 0.2, 0.2]])
+    assert top_k_rows(scores, 2).tolist() == [[1, 2], [0, 2], [0, 1]]
+    assert top_k_rows(scores, 4).tolist() == [[1, 2, 0], [0, 2, 1], [0, 1, 2]]
+
+
+def test_numpy_insert_grows(random_dataset):
+    index = NumpyVectorIndex(16, 1)
+    index.insert(random_dataset[:3])
+    index.insert(random_dataset[3:])
+    assert len(index) == len(random_dataset)
+    for document, v in random_dataset[::50]:
+        assert index.search(v, 1) == [document]
+
+
+def test_numpy_insert_array(random_dataset):
+    index = NumpyVectorIndex(16)
+    documents = [document for document, _ in random_dataset]
+    vectors = np.stack([v for _, v in random_dataset])
+    index.insert_array(documents, vectors)
+    assert index._vectors.dtype == np.float32
+    assert index.search(vectors[42], 1) == ["42"]
+    with pytest.raises(ValueError):
+        index.insert_array(["too", "many"], vectors[:1])
+
+
+def test_numpy_float16(random_dataset):
+    exact = NumpyVectorIndex(16)
+    exact.insert(random_dataset)
+    half = NumpyVectorIndex(16, dtype=np.float16)
+    half._block_size = 64
+    half.insert(random_dataset)
+    assert half._vectors.dtype == np.float16
+    for document, v in random_dataset[::25]:
+        assert half.search(v, 1) == [document]
+        assert len(set(half.search(v, 10)) & set(exact.search(v, 10))) >= 8
+
+
+def test_document_store():
+    store = DocumentStore(1)
+    documents = ["Apple", "", "Melon 🍈", "x" * 1000]
+    store.extend(documents[:2])
+    store.extend([])
+    store.extend(documents[2:])
+    assert len(store) == len(documents)
+    assert [store[i] for i in range(len(store))] == documents
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_numpy_save_and_load(random_dataset, index_dir, mmap):
+    index = NumpyVectorIndex(16, dtype=np.float16)
+    index.insert(random_dataset)
+    index.save(index_dir)
+    assert os.path.exists(os.path.join(index_dir, "vectors.npy"))
+
+    loaded = NumpyVectorIndex.load(index_dir, mmap=mmap)
+    assert len(loaded) == len(index)
+    assert loaded._vectors.dtype == np.float16
+    assert isinstance(loaded._vectors, np.memmap) == mmap
+    queries = np.random.default_rng(3).normal(size=(10, 16))
+    assert loaded.search_batch(queries, 5) == index.search_batch(queries, 5)
+
+    loaded.insert([("New", np.ones(16)), ("", -np.ones(16))])
+    assert loaded.search(np.ones(16), 1) == ["New"]
+    assert loaded.search(-np.ones(16), 1) == [""]
+    assert len(NumpyVectorIndex.load(index_dir)) == len(index)
+
+
+def test_numpy_search_with_scores(random_dataset):
+    index = NumpyVectorIndex(16)
+    index.insert(random_dataset)
+    vectors = np.stack([v for _, v in random_dataset])
+    query = np.random.default_rng(4).normal(size=16)
+    results = index.search_with_scores(query, 5)
+    assert [document for document, _ in results] == index.search(query, 5)
+    expected = cosine_similarity(vectors, query)
+    for document, score in results:
+        assert score == pytest.approx(expected[int(document)], abs=1e-5)
+
+
+def test_numpy_version(dataset):
+    index = NumpyVectorIndex(3)
+    assert index.version == 0
+    index.insert(dataset)
+    assert index.version == 1
+
+
+@fixture
+def products_index() -> Generator[NumpyVectorIndex]:
+    index = NumpyVectorIndex(2)
+    index.insert_array(
+        ["Backpack", "Jacket", "Rain Jacket", "Ring", "Cheap Jacket"],
+        np.array([[1, 0.1], [0, 1], [0.1, 1], [1, 1], [0.2, 1]]),
+        ["bags", "clothing", "clothing", "jewelery", "clothing"],
+        [109.95, 55.99, 39.99, 9.99, 15.99],
+    )
+    yield index
+
+
+@pytest.mark.parametrize("selectivity", [0.0, 1.0])
+def test_filtered_search(products_index, selectivity):
+    # Both the candidate-set and the masked full-scan paths.
+    products_index._selectivity = selectivity
+    q = np.array([0, 1])
+    where = Filter(category="clothing", max_price=50)
+    assert products_index.search(q, 3, where) == ["Rain Jacket", "Cheap Jacket"]
+    assert products_index.search(q, 1, Filter(min_price=100)) == ["Backpack"]
+    assert products_index.search(q, 2, Filter(category="shoes")) == []
+    scores = products_index.search_with_scores(q, 1, Filter(category="jewelery"))
+    assert scores[0][0] == "Ring"
+    assert scores[0][1] == pytest.approx(np.sqrt(0.5), abs=1e-4)
+
+
+def test_filtered_search_after_insert(products_index):
+    q = np.array([0, 1])
+    assert products_index.search(q, 1, Filter(category="bags")) == ["Backpack"]
+    products_index.insert_array(["Tote"], np.array([[0, 1]]), ["bags"], [20.0])
+    products_index.insert([("Unlabelled", np.array([0, 1]))])
+    assert products_index.search(q, 1, Filter(category="bags")) == ["Tote"]
+    assert "Unlabelled" not in products_index.search(q, 10, Filter(max_price=1000))
+    assert products_index.categories == ["bags", "clothing", "jewelery"]
+
+
+def test_concurrent_first_filtered_searches():
+    rng = np.random.default_rng(0)
+    index = NumpyVectorIndex(8)
+    index._selectivity = 1.0
+    barrier = threading.Barrier(8)
+
+    def search(category: str) -> list[str]:
+        barrier.wait()
+        return index.search(np.ones(8), 5, Filter(category=category))
+
+    for step in range(5):
+        # A new category each round makes stale offsets point at other rows.
+        wanted = ["a", "b", "c", f"new {step}"]
+        categories = rng.choice(wanted, size=50_000)
+        documents = [f"{c}:{i}" for i, c in enumerate(categories)]
+        index.insert_array(documents, rng.normal(size=(50_000, 8)), categories.tolist())
+        with ThreadPoolExecutor(8) as executor:
+            results = executor.map(search, wanted * 2)
+            for category, found in zip(wanted * 2, results, strict=True):
+                assert len(found) == 5
+                assert all(d.startswith(f"{category}:") for d in found)
+
+
+def test_filtered_search_save_load(products_index, index_dir):
+    products_index.save(index_dir)
+    loaded = NumpyVectorIndex.load(index_dir)
+    where = Filter(category="clothing", max_price=50)
+    q = np.array([0, 1])
+    assert loaded.search(q, 3, where) == products_index.search(q, 3, where)
+    assert loaded.categories == products_index.categories
+
+
+def test_delete_and_update_by_id(index_dir):
+    index = NumpyVectorIndex(2)
+    index.insert_array(
+        ["A", "B", "C"], np.array([[1, 0], [1, 0.1], [0, 1]]), ids=[1, 2, 3]
+    )
+    q = np.array([1, 0])
+    index.delete([1, 42])
+    assert index.deleted == 1
+    assert index.search(q, 3) == ["B", "C"]
+    assert index.search_batch(np.array([q]), 3) == [["B", "C"]]
+    index.insert_array(["C2"], np.array([[1, 0]]), ids=[3], hashes=["abc"])
+    assert index.search(q, 3) == ["C2", "B"]
+    assert index.content_hashes() == {2: "", 3: "abc"}
+
+    index.save(index_dir)
+    loaded = NumpyVectorIndex.load(index_dir)
+    assert loaded.search(q, 3) == ["C2", "B"]
+    loaded.delete([2])
+    assert loaded.search(q, 3) == ["C2"]
+
+    index.compact()
+    assert len(index) == 2
+    assert index.deleted == 0
+    assert index.search(q, 3) == ["C2", "B"]
+    index.delete([3])
+    assert index.search(q, 3) == ["B"]
+
+
+def test_save_over_own_mmap(index_dir):
+    index = NumpyVectorIndex(2)
+    index.insert_array(
+        ["A", "B", "C"], np.array([[1, 0], [1, 0.1], [0, 1]]), ids=[1, 2, 3]
+    )
+    index.save(index_dir)
+    loaded = NumpyVectorIndex.load(index_dir, mmap=True)
+    loaded.delete([1])
+    loaded.save(index_dir)
+    reloaded = NumpyVectorIndex.load(index_dir, mmap=True)
+    assert reloaded.search(np.array([1, 0]), 3) == ["B", "C"]
+    assert loaded.search(np.array([1, 0]), 3) == ["B", "C"]
+    assert sorted(os.listdir(index_dir)) == sorted(
+        name for name in os.listdir(index_dir) if not name.endswith(".tmp")
+    )
+
+
+def test_load_without_change_tracking(products_index, index_dir):
+    # Indexes saved before ids, hashes and tombstones were persisted.
+    products_index.save(index_dir)
+    for name in ("ids.npy", "hashes.npy", "live.npy"):
+        os.remove(os.path.join(index_dir, name))
+    loaded = NumpyVectorIndex.load(index_dir)
+    assert loaded.content_hashes() == {}
+    assert loaded.deleted == 0
+    where = Filter(category="clothing", max_price=50)
+    q = np.array([0, 1])
+    assert loaded.search(q, 3, where) == products_index.search(q, 3, where)